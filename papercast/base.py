@@ -1,8 +1,11 @@
+import asyncio
+import inspect
 import logging
 from abc import ABC, abstractmethod
 from functools import wraps
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
+from papercast.cache import hashable
 from papercast.production import Production
 
 
@@ -53,6 +56,18 @@ class BasePipelineComponent(ABC):
 class BaseProcessor(BasePipelineComponent, ABC):
     input_types: Dict[str, Any] = {}
     output_types: Dict[str, Any] = {}
+    cpu_bound: bool = False
+    """
+    Set to True for processors that spend their time in Python code rather than waiting on I/O,
+    so that pipelines run them in a process pool instead of a thread. Such processors must be
+    picklable, and only the fields named in `input_types` are sent to the worker process.
+    """
+    chunked: bool = False
+    """
+    Set to True for processors that can work on one chunk of a streamed input at a time, such
+    as narrating one section of a paper. Pipelines then call :meth:`process` once per chunk as
+    the chunks arrive, and stream its outputs in turn, instead of waiting for the whole input.
+    """
 
     def __init__(
         self,
@@ -71,12 +86,68 @@ class BaseProcessor(BasePipelineComponent, ABC):
     def process(self, input: Production, *args, **kwargs) -> Production:
         raise NotImplementedError
 
+    def process_batch(
+        self, inputs: List[Production], *args, **kwargs
+    ) -> List[Production]:
+        """
+        Process several productions at once.
+
+        Override this to amortize per-call overhead, such as one HTTP request for many documents.
+        It must return one production per input, in order. The default calls :meth:`process`
+        on each input; :meth:`papercast.pipelines.Pipeline.run_many` only calls this method
+        when it is overridden, and otherwise runs :meth:`process` on the pipeline's executor.
+        """
+        return [self.process(input, *args, **kwargs) for input in inputs]
+
+    def cache_config(self) -> Dict[str, Any]:
+        """
+        The configuration that determines this processor's outputs for given inputs.
+
+        Used by :class:`papercast.cache.ResultCache` to build cache keys. Defaults to the public
+        instance attributes other than the logger and name whose values can be hashed, that is
+        primitives, paths, containers of such values and dataclasses. Other objects, such as
+        HTTP sessions, are left out; override this method if they affect the outputs, or if
+        some attributes do not.
+        """
+        return {
+            k: v
+            for k, v in vars(self).items()
+            if not k.startswith("_") and k not in ("logger", "name") and hashable(v)
+        }
+
     def from_kwargs(self, **kwargs):
         production = Production(**kwargs)
         return self.process(production)
 
 
+class AsyncProcessor(BaseProcessor, ABC):
+    """
+    A processor whose work is done by a coroutine, for I/O-bound stages such as HTTP requests.
+
+    Pipelines await :meth:`aprocess` on the event loop instead of tying up an executor thread.
+    :meth:`process` runs it on a new event loop, for use outside a pipeline.
+    """
+
+    @abstractmethod
+    async def aprocess(self, input: Production, *args, **kwargs) -> Production:
+        raise NotImplementedError
+
+    def process(self, input: Production, *args, **kwargs) -> Production:
+        return asyncio.run(self.aprocess(input, *args, **kwargs))
+
+
+def is_async_processor(processor: BasePipelineComponent) -> bool:
+    "Whether the pipeline should await the processor's ``aprocess`` instead of calling ``process``."
+    return inspect.iscoroutinefunction(getattr(processor, "aprocess", None))
+
+
 class BaseSubscriber(BasePipelineComponent, ABC):
+    priority: Optional[str] = None
+    """
+    The priority class of the subscriber's productions when run in a server, from
+    :data:`papercast.scheduling.PRIORITIES`. None for the default class.
+    """
+
     def __init__(
         self,
     ) -> None:
@@ -104,6 +175,14 @@ class BasePublisher(BasePipelineComponent, ABC):
     def process(self, input: Production, *args, **kwargs) -> None:
         raise NotImplementedError
 
+    def process_batch(self, inputs: List[Production], *args, **kwargs) -> List[None]:
+        """
+        Publish several productions at once.
+
+        See :meth:`BaseProcessor.process_batch`.
+        """
+        return [self.process(input, *args, **kwargs) for input in inputs]
+
     def from_kwargs(self, **kwargs):
         production = Production(**kwargs)
         return self.process(production)
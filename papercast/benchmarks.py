@@ -0,0 +1,389 @@
+"""
+Benchmarks for the overhead Papercast adds per document, independent of any plugin.
+
+Run with ``python -m papercast.benchmarks [--quick] [--output results.json]``. Results are
+written as JSON so they can be compared between releases. Everything runs offline, using
+synthetic processors that do nothing or sleep.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from papercast.base import BaseProcessor
+from papercast.jobs import Job
+from papercast import plugin_utils
+from papercast.pipelines import Pipeline
+from papercast.production import Production
+from papercast.server import Server
+
+
+class NoOpProcessor(BaseProcessor):
+    input_types = {"value": int}
+    output_types = {"value": int}
+
+    def process(self, input: Production, *args, **kwargs) -> Production:
+        return input
+
+
+class SleepProcessor(BaseProcessor):
+    input_types = {"value": int}
+    output_types = {"value": int}
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def process(self, input: Production, *args, **kwargs) -> Production:
+        time.sleep(self.delay)
+        return input
+
+
+def chain_pipeline(
+    length: int, processor_factory: Callable[[], BaseProcessor] = NoOpProcessor, **kwargs
+) -> Pipeline:
+    "A pipeline of `length` processors connected one after the other, starting at ``p0``."
+    pipeline = Pipeline("benchmark", **kwargs)
+    for i in range(length):
+        pipeline.add_processor(f"p{i}", processor_factory())
+        if i:
+            pipeline.connect(f"p{i - 1}", "value", f"p{i}", "value")
+    return pipeline
+
+
+def fan_out_pipeline(
+    width: int, processor_factory: Callable[[], BaseProcessor] = NoOpProcessor, **kwargs
+) -> Pipeline:
+    "A collector ``p0`` feeding `width` independent processors."
+    pipeline = Pipeline("benchmark", **kwargs)
+    pipeline.add_processor("p0", NoOpProcessor())
+    for i in range(1, width + 1):
+        pipeline.add_processor(f"p{i}", processor_factory())
+        pipeline.connect("p0", "value", f"p{i}", "value")
+    return pipeline
+
+
+def measure(func: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """
+    Time `func` `repeat` times.
+
+    Returns:
+        Dict[str, float]: The mean, median, minimum and maximum in microseconds.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return summarize(samples)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    "The mean, median, minimum and maximum of `samples`, in microseconds."
+    return {
+        "mean_us": statistics.mean(samples),
+        "median_us": statistics.median(samples),
+        "min_us": min(samples),
+        "max_us": max(samples),
+    }
+
+
+def bench_run_overhead(repeat: int) -> List[Dict[str, Any]]:
+    "Time Pipeline.run and Pipeline.process on chains of no-op processors."
+    results = []
+    for scheduler in ("sequential", "concurrent"):
+        for length in (2, 5, 20):
+            pipeline = chain_pipeline(length, scheduler=scheduler)
+            results.append(
+                {
+                    "name": "pipeline.run",
+                    "params": {"scheduler": scheduler, "stages": length},
+                    **measure(lambda: pipeline.run(value=1), repeat),
+                }
+            )
+            results.append(
+                {
+                    "name": "pipeline.process",
+                    "params": {"scheduler": scheduler, "stages": length - 1},
+                    **measure(
+                        lambda: pipeline.process(Production(value=1), "p0"), repeat
+                    ),
+                }
+            )
+    return results
+
+
+def bench_parallel_branches(repeat: int) -> List[Dict[str, Any]]:
+    "Compare the schedulers on independent sleeping branches; the ideal is one sleep."
+    results = []
+    delay = 0.01
+    for scheduler in ("sequential", "concurrent"):
+        pipeline = fan_out_pipeline(
+            4, lambda: SleepProcessor(delay), scheduler=scheduler, max_workers=4
+        )
+        results.append(
+            {
+                "name": "pipeline.run.sleep_branches",
+                "params": {"scheduler": scheduler, "branches": 4, "delay_s": delay},
+                **measure(lambda: pipeline.run(value=1), max(3, repeat // 20)),
+            }
+        )
+    return results
+
+
+def bench_graph_scaling(repeat: int) -> List[Dict[str, Any]]:
+    "Time graph traversal and plan compilation as the number of processors grows."
+    results = []
+    for size in (10, 100, 500):
+        pipeline = chain_pipeline(size)
+        stages = list(pipeline.get_downstream_processors("p0"))
+
+        def compile_plan():
+            pipeline._invalidate_plans()
+            pipeline.compile("p0")
+
+        for name, func in (
+            ("pipeline._topological_sort", lambda: pipeline._topological_sort(stages)),
+            (
+                "pipeline.get_downstream_processors",
+                lambda: pipeline.get_downstream_processors("p0"),
+            ),
+            ("pipeline.compile.uncached", compile_plan),
+            ("pipeline.compile.cached", lambda: pipeline.compile("p0")),
+        ):
+            results.append(
+                {"name": name, "params": {"processors": size}, **measure(func, repeat)}
+            )
+    return results
+
+
+async def _asgi_post(app, path: str, body: Dict[str, Any]) -> int:
+    "Send a JSON POST request straight to an ASGI app and return the status code."
+    payload = json.dumps(body).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 8000),
+    }
+    received = False
+    status = 0
+
+    async def receive():
+        nonlocal received
+        if received:
+            return {"type": "http.disconnect"}
+        received = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def bench_server_add(requests: int) -> List[Dict[str, Any]]:
+    "Measure /add throughput through the ASGI app, then the time to drain the queue."
+
+    async def run():
+        pipeline = chain_pipeline(3)
+        server = Server(pipelines={"default": pipeline}, max_queue_size=requests)
+        start = time.perf_counter()
+        statuses = [
+            await _asgi_post(server.app, "/add", {"value": i}) for i in range(requests)
+        ]
+        submitted = time.perf_counter()
+        await server._drain_queues()
+        drained = time.perf_counter()
+        return statuses, submitted - start, drained - start
+
+    statuses, submit_time, total_time = asyncio.run(run())
+    return [
+        {
+            "name": "server.add",
+            "params": {"requests": requests, "stages": 3},
+            "accepted": statuses.count(200),
+            "requests_per_s": requests / submit_time,
+            "documents_per_s": requests / total_time,
+        }
+    ]
+
+
+def bench_production_memory(count: int) -> List[Dict[str, Any]]:
+    "Measure the memory held by in-flight productions and their jobs."
+    results = []
+    for name, factory in (
+        (
+            "memory.production",
+            lambda i: Production(arxiv_id=f"2301.{i:05d}", title="A title", value=i),
+        ),
+        (
+            "memory.job",
+            lambda i: Job(
+                pipeline="default",
+                inputs={"arxiv_id": f"2301.{i:05d}"},
+            ),
+        ),
+    ):
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [factory(i) for i in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.append(
+            {
+                "name": name,
+                "params": {"count": count},
+                "bytes_per_object": (after - before) / count,
+            }
+        )
+        del objects
+    return results
+
+
+_PLUGIN_TYPES = ("processors", "subscribers", "publishers")
+
+
+def _time_import(code: str, env: Dict[str, str]) -> float:
+    "Run `code` in a fresh interpreter and get the seconds it took, as it prints them."
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, check=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def bench_import_time(repeat: int) -> List[Dict[str, Any]]:
+    """
+    Time importing the plugin packages in a fresh interpreter, as the CLI and server workers
+    do, with plugins imported on first access or all of them up front, and the time to read
+    the plugin index with and without its cache.
+    """
+    imports = "; ".join(f"import papercast.{t}" for t in _PLUGIN_TYPES)
+    eager = "; ".join(f"load_plugins({t!r})" for t in _PLUGIN_TYPES)
+    programs = {
+        "lazy": imports,
+        "eager": f"{imports}; from papercast.plugin_utils import load_plugins; {eager}",
+    }
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        index = os.path.join(directory, "plugins.json")
+        env = {**os.environ, "PAPERCAST_PLUGIN_INDEX": index}
+        for mode, program in programs.items():
+            code = f"import time; start = time.perf_counter(); {program}; "
+            code += "print(time.perf_counter() - start)"
+            samples = [_time_import(code, env) * 1e6 for _ in range(repeat)]
+            results.append(
+                {
+                    "name": "import.plugins",
+                    "params": {"mode": mode},
+                    **summarize(samples),
+                }
+            )
+
+        previous = os.environ.get("PAPERCAST_PLUGIN_INDEX")
+        os.environ["PAPERCAST_PLUGIN_INDEX"] = index
+
+        def cached_index():
+            plugin_utils.plugin_index.cache_clear()
+            plugin_utils.plugin_index()
+
+        try:
+            for name, func in (
+                ("plugins.index.scan", plugin_utils._scan_entry_points),
+                ("plugins.index.cached", cached_index),
+            ):
+                results.append({"name": name, "params": {}, **measure(func, repeat)})
+        finally:
+            plugin_utils.plugin_index.cache_clear()
+            if previous is None:
+                del os.environ["PAPERCAST_PLUGIN_INDEX"]
+            else:
+                os.environ["PAPERCAST_PLUGIN_INDEX"] = previous
+    return results
+
+
+def run_benchmarks(quick: bool = False) -> Dict[str, Any]:
+    """
+    Run every benchmark.
+
+    Args:
+        quick (bool): Use few repetitions, for smoke tests.
+
+    Returns:
+        Dict[str, Any]: Environment metadata and a list of results.
+    """
+    try:
+        from importlib.metadata import version
+
+        papercast_version = version("papercast")
+    except Exception:
+        papercast_version = None
+
+    repeat = 5 if quick else 200
+    results = []
+    results += bench_run_overhead(repeat)
+    results += bench_parallel_branches(repeat)
+    results += bench_graph_scaling(repeat)
+    results += bench_server_add(20 if quick else 2000)
+    results += bench_production_memory(100 if quick else 10000)
+    results += bench_import_time(2 if quick else 20)
+    return {
+        "papercast_version": papercast_version,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="Use few repetitions.")
+    parser.add_argument("--output", help="Write results to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    # Per-stage logging would dominate the measurements.
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    report = run_benchmarks(quick=args.quick)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import asyncio
+import dataclasses
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from papercast import types as file_types
+from papercast.production import LazyValue, Production
+
+
+@lru_cache(maxsize=1024)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    # mtime and size are part of the cache key so that edited files are re-hashed.
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _feed(digest, value: Any, ancestors: Optional[Set[int]] = None) -> None:
+    """
+    Feed a stable, type-tagged encoding of `value` into `digest`.
+
+    Only primitives, paths, containers of such values, dataclasses and the file types of
+    :mod:`papercast.types` are encoded, since the representation of other objects, such as
+    clients and sessions, differs between instances that behave the same.
+
+    Raises:
+        TypeError: If `value` contains another kind of object.
+        ValueError: If `value` contains itself.
+    """
+    if value is None or isinstance(value, (bool, int, float, complex)):
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+    elif isinstance(value, str):
+        digest.update(f"str:{len(value)}:".encode())
+        digest.update(value.encode("utf-8", "surrogatepass"))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        digest.update(f"bytes:{len(value)}:".encode())
+        digest.update(value)
+    elif isinstance(value, Path):
+        if value.is_file():
+            stat = value.stat()
+            file_hash = _file_digest(str(value), stat.st_mtime_ns, stat.st_size)
+            digest.update(f"file:{file_hash};".encode())
+        else:
+            _feed(digest, str(value))
+    elif isinstance(value, type):
+        digest.update(f"type:{value.__module__}.{value.__qualname__};".encode())
+    else:
+        ancestors = set() if ancestors is None else ancestors
+        if id(value) in ancestors:
+            raise ValueError(f"Cannot hash a {type(value).__name__} that contains itself")
+        ancestors.add(id(value))
+        try:
+            _feed_container(digest, value, ancestors)
+        finally:
+            ancestors.discard(id(value))
+
+
+def _feed_container(digest, value: Any, ancestors: Set[int]) -> None:
+    if isinstance(value, dict):
+        digest.update(f"dict:{len(value)}:".encode())
+        for k, v in sorted(value.items(), key=lambda item: repr(item[0])):
+            _feed(digest, k, ancestors)
+            _feed(digest, v, ancestors)
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}:{len(value)}:".encode())
+        for v in value:
+            _feed(digest, v, ancestors)
+    elif isinstance(value, (set, frozenset)):
+        digest.update(f"set:{len(value)}:".encode())
+        for v in sorted(value, key=repr):
+            _feed(digest, v, ancestors)
+    elif dataclasses.is_dataclass(value):
+        digest.update(f"{type(value).__qualname__}:".encode())
+        _feed(
+            digest,
+            {f.name: getattr(value, f.name, None) for f in dataclasses.fields(value)},
+            ancestors,
+        )
+    elif type(value).__module__ == file_types.__name__ and hasattr(value, "path"):
+        digest.update(f"{type(value).__qualname__}:".encode())
+        _feed(digest, Path(value.path), ancestors)
+    elif isinstance(value, LazyValue):
+        # Values kept in files are hashed by the contents of the file, without loading them.
+        encoding = getattr(value, "encoding", None)
+        digest.update(f"lazy:{type(value).__qualname__}:{encoding}:".encode())
+        path = getattr(value, "path", None)
+        _feed(digest, Path(path) if path is not None else value.load(), ancestors)
+    else:
+        raise TypeError(f"Cannot hash a {type(value).__qualname__} for a cache key")
+
+
+def hashable(value: Any) -> bool:
+    "Whether :func:`stable_hash` can hash `value`."
+    try:
+        _feed(hashlib.sha256(), value)
+    except (TypeError, ValueError, OSError):
+        return False
+    return True
+
+
+def stable_hash(value: Any) -> str:
+    """
+    Hash a value so that equal configurations and inputs give equal hashes across processes.
+
+    Existing files referenced by :class:`pathlib.Path` values are hashed by content, so the same
+    PDF saved under a different name hits the same cache entry. So are the files of
+    :class:`papercast.production.LazyValue` references, which are not loaded.
+
+    Args:
+        value (Any): The value to hash.
+
+    Returns:
+        str: A hex SHA-256 digest.
+
+    Raises:
+        TypeError: If `value` contains an object other than primitives, paths, containers,
+            dataclasses, lazy values and the file types of :mod:`papercast.types`.
+        ValueError: If `value` contains itself.
+    """
+    digest = hashlib.sha256()
+    _feed(digest, value)
+    return digest.hexdigest()
+
+
+@dataclasses.dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class CacheBackend(ABC):
+    """
+    A storage tier for :class:`ResultCache`.
+
+    Values are dictionaries of processor outputs, keyed by hex digests.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """
+    An in-memory least-recently-used tier.
+
+    Cached values are returned by reference, so processors should not mutate their inputs in place.
+    """
+
+    def __init__(self, max_items: int = 128):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskBackend(CacheBackend):
+    """
+    A local on-disk tier that pickles each entry to its own file.
+
+    Entries older than `max_age` seconds are treated as misses and removed. When the total size
+    of the cache directory exceeds `max_bytes`, the least recently used entries are removed
+    until it is under 90% of `max_bytes`.
+
+    The directory is only scanned for eviction when the size written since the last scan
+    takes the total over `max_bytes`, or, with `max_age`, every `evict_interval` seconds, so
+    that writes do not stat every entry. Entries written by other processes sharing the
+    directory are counted at the next scan.
+    """
+
+    suffix = ".pkl"
+    low_water = 0.9
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 1 << 30,
+        max_age: Optional[float] = None,
+        evict_interval: float = 60.0,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        # The size of the entries, as of the last scan plus what was written since.
+        self._bytes: Optional[int] = None
+        self._scanned = 0.0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def _expired(self, mtime: float, now: float) -> bool:
+        return self.max_age is not None and now - mtime > self.max_age
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            if self._expired(path.stat().st_mtime, time.time()):
+                path.unlink(missing_ok=True)
+                return None
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)  # Mark as recently used for eviction.
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.warning(f"Not caching unpicklable outputs for key {key}: {e}")
+            return
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+        if self._written(len(payload)):
+            self.evict()
+
+    def _written(self, size: int) -> bool:
+        "Count `size` bytes written, and get whether the directory should be scanned."
+        with self._lock:
+            if self._bytes is None:
+                return True
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                return True
+            return (
+                self.max_age is not None
+                and time.monotonic() - self._scanned > self.evict_interval
+            )
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        for path in self.cache_dir.glob(f"*/*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> None:
+        """
+        Remove expired entries, then the least recently used ones if over `max_bytes`.
+
+        Scans the whole directory; :meth:`set` calls this only when needed.
+        """
+        with self._lock:
+            now = time.time()
+            entries = []
+            for mtime, size, path in self._entries():
+                if self._expired(mtime, now):
+                    path.unlink(missing_ok=True)
+                else:
+                    entries.append((mtime, size, path))
+
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                for _, size, path in sorted(entries, key=lambda e: e[0]):
+                    if total <= self.max_bytes * self.low_water:
+                        break
+                    path.unlink(missing_ok=True)
+                    total -= size
+            self._bytes = total
+            self._scanned = time.monotonic()
+
+
+class ResultCache:
+    """
+    Memoizes processor outputs, keyed by the processor's configuration and its inputs.
+
+    Lookups go through `backends` in order; a hit in a later tier is copied into the earlier ones.
+    Hit and miss counts are kept per processor name in :attr:`stats`.
+
+    Example:
+        >>> cache = ResultCache([MemoryBackend(), DiskBackend("data/cache")])
+        >>> pipeline.add_processor("grobid", GROBIDProcessor(...), cache=cache)
+    """
+
+    def __init__(self, backends: Optional[List[CacheBackend]] = None):
+        self.backends = backends if backends is not None else [MemoryBackend()]
+        self.stats: Dict[str, CacheStats] = {}
+        self._lock = threading.Lock()
+
+    def key(self, processor, production: Production) -> str:
+        """
+        Compute the cache key for running `processor` on `production`.
+
+        Args:
+            processor (papercast.base.BaseProcessor): The processor.
+            production (Production): The production it would be run on.
+
+        Returns:
+            str: A hex digest of the processor's class, :meth:`cache_config` and input values.
+        """
+        # The unloaded references of lazy fields, rather than their values.
+        fields = vars(production)
+        inputs = {k: fields.get(k) for k in processor.input_types}
+        return stable_hash(
+            (
+                f"{type(processor).__module__}.{type(processor).__qualname__}",
+                processor.cache_config(),
+                inputs,
+            )
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        for i, backend in enumerate(self.backends):
+            value = backend.get(key)
+            if value is not None:
+                for earlier in self.backends[:i]:
+                    earlier.set(key, value)
+                return value
+        return None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        for backend in self.backends:
+            backend.set(key, value)
+
+    async def alookup(
+        self, name: str, processor, production: Production
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        "Like :meth:`lookup`, hashing and reading the backends on a thread."
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.lookup, name, processor, production)
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        "Like :meth:`set`, pickling and writing on a thread."
+        await asyncio.get_running_loop().run_in_executor(None, self.set, key, value)
+
+    def _record(self, name: str, hit: bool) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(name, CacheStats())
+            if hit:
+                stats.hits += 1
+            else:
+                stats.misses += 1
+
+    def lookup(
+        self, name: str, processor, production: Production
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Look up the outputs of `processor` for `production`, counting a hit or miss for `name`.
+
+        Configurations and inputs that cannot be hashed count as a miss, and are not cached.
+
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: The cache key, or None if there is
+            none, and the cached outputs, or None on a miss.
+        """
+        try:
+            key = self.key(processor, production)
+        except (TypeError, ValueError, OSError) as e:
+            logger.warning(f"Not caching {name}, its configuration or inputs cannot be hashed: {e}")
+            self._record(name, False)
+            return None, None
+        value = self.get(key)
+        self._record(name, value is not None)
+        return key, value
@@ -0,0 +1,128 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from loguru import logger
+
+from papercast.cache import DiskBackend, stable_hash
+
+
+class Checkpoint(ABC):
+    """
+    The outputs of the finished stages of one document, so that processing can resume after a
+    failure or restart without running those stages again.
+
+    Pass a checkpoint to :meth:`papercast.pipelines.Pipeline.run`: stages it has outputs for
+    are skipped and their outputs set on the production, and the outputs of every other stage
+    are saved to it as the stage finishes.
+    """
+
+    @abstractmethod
+    def get(self, stage: str) -> Optional[Dict[str, Any]]:
+        "Get the saved outputs of `stage`, or None if it has not finished."
+        raise NotImplementedError
+
+    @abstractmethod
+    def save(self, stage: str, outputs: Dict[str, Any]) -> None:
+        "Save the outputs of a finished stage."
+        raise NotImplementedError
+
+
+def _referenced_files(value: Any) -> List[Path]:
+    if isinstance(value, Path):
+        return [value]
+    path = getattr(value, "path", None)
+    if isinstance(path, (str, Path)):
+        return [Path(path)]
+    if isinstance(value, (list, tuple)):
+        return [p for v in value for p in _referenced_files(v)]
+    return []
+
+
+class StoredCheckpoint(Checkpoint):
+    """
+    A checkpoint in a :class:`CheckpointStore`.
+
+    Saved outputs that refer to files which no longer exist are ignored, so their stage runs
+    again instead of resuming with missing artifacts.
+    """
+
+    def __init__(self, backend: DiskBackend, key: str):
+        self.backend = backend
+        self.key = key
+
+    def _stage_key(self, stage: str) -> str:
+        return stable_hash((self.key, stage))
+
+    def get(self, stage: str) -> Optional[Dict[str, Any]]:
+        outputs = self.backend.get(self._stage_key(stage))
+        if outputs is None:
+            return None
+        missing = [
+            path
+            for value in outputs.values()
+            for path in _referenced_files(value)
+            if not path.exists()
+        ]
+        if missing:
+            logger.warning(f"Not resuming after {stage}: missing files {missing}")
+            return None
+        return outputs
+
+    def save(self, stage: str, outputs: Dict[str, Any]) -> None:
+        self.backend.set(self._stage_key(stage), outputs)
+
+    def clear(self, stages: Iterable[str]) -> None:
+        "Delete the saved outputs of `stages`."
+        for stage in stages:
+            self.backend.delete(self._stage_key(stage))
+
+
+class CheckpointStore:
+    """
+    Checkpoints on local disk, one per pipeline and document.
+
+    A document is identified by its inputs and options, with files referenced by
+    :class:`pathlib.Path` inputs identified by content. Only stage outputs are saved, so
+    artifacts such as audio files are kept as references rather than copied.
+
+    Checkpoints older than `max_age` seconds are removed, and the least recently used ones are
+    removed while the store is larger than `max_bytes`. As with
+    :class:`papercast.cache.DiskBackend`, the directory is only scanned once the bytes saved go
+    over `max_bytes`, or every `evict_interval` seconds, rather than for every stage.
+
+    Example:
+        >>> pipeline = Pipeline("default", checkpoint_store=CheckpointStore("data/checkpoints"))
+
+    Args:
+        checkpoint_dir (str): The directory to store checkpoints in.
+        max_bytes (int): The maximum total size of the checkpoints.
+        max_age (Optional[float]): The maximum age of a checkpoint, in seconds.
+        evict_interval (float): Seconds between scans for expired checkpoints.
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir: str,
+        max_bytes: int = 256 << 20,
+        max_age: Optional[float] = 7 * 24 * 3600,
+        evict_interval: float = 60.0,
+    ):
+        self.backend = DiskBackend(
+            checkpoint_dir, max_bytes=max_bytes, max_age=max_age, evict_interval=evict_interval
+        )
+
+    def checkpoint(self, pipeline: str, entry: str, inputs: Dict[str, Any]) -> StoredCheckpoint:
+        """
+        Get the checkpoint of a document.
+
+        Args:
+            pipeline (str): The name of the pipeline.
+            entry (str): The collector or subscriber the document enters the pipeline through.
+            inputs (Dict[str, Any]): The document's inputs and options.
+        """
+        return StoredCheckpoint(self.backend, stable_hash((pipeline, entry, inputs)))
+
+    def gc(self) -> None:
+        "Remove expired checkpoints, then the least recently used ones until under `max_bytes`."
+        self.backend.evict()
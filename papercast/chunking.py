@@ -0,0 +1,108 @@
+"""
+Splitting text into chunks that can be narrated in parallel, see :mod:`papercast.streams`.
+"""
+import hashlib
+import re
+from typing import Iterator, List
+
+from papercast.base import BaseProcessor
+from papercast.production import Production
+
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+_SENTENCES = re.compile(r"(?<=[.!?])\s+")
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    "Split a paragraph longer than `max_chars` at sentence ends, or at spaces if need be."
+    pieces = []
+    for sentence in _SENTENCES.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars + 1)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def _ends_chunk(piece: str, target: int) -> bool:
+    """
+    Whether a chunk ends after `piece`, decided by a hash of its contents with a probability
+    of ``len(piece) / target``, so that chunks average about `target` characters.
+    """
+    digest = hashlib.blake2b(piece.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") < len(piece) / target * 2**64
+
+
+def split_text(text: str, max_chars: int = 2000) -> List[str]:
+    """
+    Split text into chunks of at most `max_chars` characters, at section and sentence ends.
+
+    Paragraphs longer than `max_chars` are split at sentence ends, and sentences longer than
+    that at spaces. Consecutive paragraphs are grouped into chunks of about half `max_chars`
+    on average. Where a chunk ends is decided by the contents of the paragraph it ends with,
+    rather than by how much text came before, so editing a paragraph only changes its chunk
+    and at most the next few. The other chunks stay the same between the two versions of
+    the text, and their narrations can be taken from a cache.
+
+    Args:
+        text (str): The text.
+        max_chars (int): The maximum length of a chunk.
+
+    Returns:
+        List[str]: The chunks, in order. Paragraphs in a chunk are separated by a blank line.
+    """
+    if max_chars < 1:
+        raise ValueError(f"Expected max_chars of at least 1, got {max_chars}")
+    target = max(1, max_chars // 2)
+    chunks: List[str] = []
+    current: List[str] = []
+    length = 0
+    for paragraph in _PARAGRAPHS.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        pieces = [paragraph] if len(paragraph) <= max_chars else _split_long(paragraph, max_chars)
+        for piece in pieces:
+            added = len(piece) + (2 if current else 0)
+            if current and length + added > max_chars:
+                chunks.append("\n\n".join(current))
+                current, length = [], 0
+                added = len(piece)
+            current.append(piece)
+            length += added
+            if _ends_chunk(piece, target):
+                chunks.append("\n\n".join(current))
+                current, length = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class TextChunker(BaseProcessor):
+    """
+    Streams a text field in chunks made by :func:`split_text`.
+
+    Narrators added after it with ``chunk_workers`` then narrate several chunks at once, and
+    stages reading their audio whole get the narrations joined in order. Stages reading the
+    text whole get the chunks joined with the blank lines between them.
+
+    Args:
+        max_chars (int): The maximum length of a chunk.
+        field (str): The text field to split, which is also the streamed output.
+    """
+
+    chunk_separator = "\n\n"
+
+    def __init__(self, max_chars: int = 2000, field: str = "text"):
+        super().__init__()
+        self.max_chars = max_chars
+        self.field = field
+        self.input_types = {field: str}
+        self.output_types = {field: str}
+
+    def process(self, input: Production) -> Iterator[Production]:
+        for chunk in split_text(getattr(input, self.field), self.max_chars):
+            yield Production(**{self.field: chunk})
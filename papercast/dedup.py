@@ -0,0 +1,303 @@
+"""
+Deduplication of submitted documents, so that a paper arriving from several subscribers or
+submitted twice is only processed and published once.
+"""
+import asyncio
+import hashlib
+import math
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+_ARXIV_ID = re.compile(
+    r"(?:arxiv\.org/(?:abs|pdf)/|arxiv:)?"
+    r"(\d{4}\.\d{4,5}|[a-z][a-z\-]*(?:\.[a-z]{2})?/\d{7})"
+    r"(?:v\d+)?(?:\.pdf)?/?$",
+    re.IGNORECASE,
+)
+_DOI = re.compile(r"(?:https?://(?:dx\.)?doi\.org/|doi:)?\s*(10\.\d{4,9}/\S+)$", re.IGNORECASE)
+
+
+def normalize_arxiv_id(value: Any) -> Optional[str]:
+    """
+    Get the arXiv identifier of a paper from its ID or URL, without its version.
+
+    ``arXiv:2301.00001v2``, ``https://arxiv.org/abs/2301.00001`` and
+    ``https://arxiv.org/pdf/2301.00001v1.pdf`` all give ``2301.00001``.
+
+    Returns:
+        Optional[str]: The identifier, or None if `value` is not an arXiv ID or URL.
+    """
+    if not isinstance(value, str):
+        return None
+    match = _ARXIV_ID.search(value.strip())
+    return match.group(1).lower() if match else None
+
+
+def normalize_doi(value: Any) -> Optional[str]:
+    """
+    Get a DOI in lower case, without a ``doi:`` or ``https://doi.org/`` prefix.
+
+    Returns:
+        Optional[str]: The DOI, or None if `value` is not a DOI.
+    """
+    if not isinstance(value, str):
+        return None
+    match = _DOI.match(value.strip())
+    return match.group(1).lower() if match else None
+
+
+def content_hash(value: Any) -> Optional[str]:
+    """
+    Get the SHA-256 digest of a file's contents.
+
+    Args:
+        value (Any): Bytes, a path, or an object with a ``path`` attribute such as
+            :class:`papercast.types.PDFFile`.
+
+    Returns:
+        Optional[str]: The hex digest, or None if `value` is not a readable file or bytes.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(value).hexdigest()
+    path = getattr(value, "path", value)
+    if not isinstance(path, (str, Path)):
+        return None
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def document_identity(inputs: Dict[str, Any]) -> Optional[str]:
+    """
+    Identify the paper a document's inputs refer to, however it was submitted.
+
+    The arXiv ID is used if any of ``arxiv_id``, ``arxiv_url`` or ``url`` gives one, then the
+    DOI from ``doi`` or ``url``, then the hash of the contents of ``pdf`` or ``pdf_path``.
+
+    Returns:
+        Optional[str]: ``arxiv:<id>``, ``doi:<doi>`` or ``sha256:<digest>``, or None if the
+        paper cannot be identified, in which case the document is not deduplicated.
+    """
+    for key in ("arxiv_id", "arxiv_url", "url"):
+        arxiv_id = normalize_arxiv_id(inputs.get(key))
+        if arxiv_id:
+            return f"arxiv:{arxiv_id}"
+    for key in ("doi", "url"):
+        doi = normalize_doi(inputs.get(key))
+        if doi:
+            return f"doi:{doi}"
+    for key in ("pdf", "pdf_path"):
+        if key in inputs:
+            digest = content_hash(inputs[key])
+            if digest:
+                return f"sha256:{digest}"
+    return None
+
+
+class BloomFilter:
+    """
+    A set of strings that can tell for certain that a string was never added.
+
+    Membership tests may give false positives at about `error_rate` while fewer than
+    `capacity` strings have been added, but never false negatives. A filter for a million
+    strings at a 0.1% error rate takes 1.8 MB.
+
+    Args:
+        capacity (int): The number of strings the filter is sized for.
+        error_rate (float): The false positive rate at capacity.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001):
+        if capacity < 1:
+            raise ValueError(f"Expected a capacity of at least 1, got {capacity}")
+        if not 0 < error_rate < 1:
+            raise ValueError(f"Expected an error rate between 0 and 1, got {error_rate}")
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # Double hashing: k positions from two independent 64-bit hashes.
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen (
+    identity TEXT PRIMARY KEY,
+    published_at REAL NOT NULL
+);
+"""
+
+
+class SeenStore:
+    """
+    The papers that have been published, in a SQLite database.
+
+    A :class:`BloomFilter` of the stored identities is kept in memory, so that papers never
+    seen before, the common case, are recognized without querying the database. The filter
+    is rebuilt from the database when the store is opened.
+
+    Args:
+        path (str): The database file, created if it does not exist. ``":memory:"`` keeps
+            the store in memory only.
+        capacity (int): The number of papers the Bloom filter is sized for. Beyond it, more
+            new papers go on to query the database.
+        error_rate (float): The false positive rate of the Bloom filter at capacity.
+    """
+
+    def __init__(
+        self, path: str = ":memory:", capacity: int = 1_000_000, error_rate: float = 0.001
+    ):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._filter = BloomFilter(capacity, error_rate)
+        for (identity,) in self._db.execute("SELECT identity FROM seen"):
+            self._filter.add(identity)
+
+    def published_at(self, identity: str) -> Optional[float]:
+        "When the paper was last published, as a Unix timestamp, or None if it never was."
+        if identity not in self._filter:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT published_at FROM seen WHERE identity = ?", (identity,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add(self, identity: str, published_at: Optional[float] = None) -> None:
+        "Record that the paper was published, at `published_at` or now."
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO seen (identity, published_at) VALUES (?, ?)",
+                (identity, time.time() if published_at is None else published_at),
+            )
+        self._filter.add(identity)
+
+    def prune(self, before: float) -> None:
+        """
+        Forget papers published before the Unix timestamp `before`.
+
+        They stay in the Bloom filter until the store is opened again, where they only cost a
+        database query when they are submitted again.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM seen WHERE published_at < ?", (before,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class Deduplicator:
+    """
+    Skips documents about papers that were already published, and runs concurrent
+    submissions of the same paper once.
+
+    Submissions are identified by `identity`, so the same paper submitted by arXiv ID, arXiv
+    URL or DOI is recognized. While a paper is being processed, further submissions of it wait
+    for that run and share its result (single-flight). Once a run succeeds the paper is
+    recorded in `store`, and submissions within `window` seconds are skipped.
+
+    Args:
+        store (Optional[SeenStore]): The published papers. Defaults to a store in memory.
+        window (Optional[float]): Seconds after publication during which a paper is skipped,
+            or None to always skip papers that were published.
+        identity (Callable[[Dict[str, Any]], Optional[str]]): Identifies the paper from a
+            document's inputs, or returns None for documents that should never be skipped.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SeenStore] = None,
+        window: Optional[float] = None,
+        identity: Callable[[Dict[str, Any]], Optional[str]] = document_identity,
+    ):
+        self.store = store if store is not None else SeenStore()
+        self.window = window
+        self.identity = identity
+        self.coalesced = 0
+        self.skipped = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def published(self, identity: str, now: Optional[float] = None) -> bool:
+        "Whether the paper was published recently enough to be skipped."
+        published_at = self.store.published_at(identity)
+        if published_at is None:
+            return False
+        if self.window is not None and (now or time.time()) - published_at > self.window:
+            return False
+        return True
+
+    def in_flight(self, identity: str) -> bool:
+        "Whether the paper is being processed."
+        return identity in self._in_flight
+
+    async def run(self, identity: str, run: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `run` for the paper, or wait for the run already in progress and get its result.
+
+        The paper is recorded as published if the run succeeds. A failed run is not shared
+        with submissions made after it failed.
+        """
+        future = self._in_flight.get(identity)
+        if future is not None and future.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+            logger.info(f"Waiting for the run of {identity} already in progress")
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[identity] = future
+        try:
+            result = await run()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Mark the error as retrieved, in case no submission was waiting for it.
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self.store.add(identity)
+            return result
+        finally:
+            if self._in_flight.get(identity) is future:
+                del self._in_flight[identity]
@@ -0,0 +1,370 @@
+"""
+Processing the documents of a server on other machines, by workers that lease jobs from it
+over HTTP and exchange files with it by content hash.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import requests
+from loguru import logger
+
+from papercast import types as file_types
+from papercast.workers import QueuedJob, Worker
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+_ARTIFACT = "__artifact__"
+
+
+def file_digest(path: os.PathLike) -> str:
+    "The SHA-256 digest of a file's contents, in hex."
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """
+    Files stored by the SHA-256 digest of their contents, as ``<directory>/<digest>/<name>``.
+
+    A file is stored once however many documents refer to it, and a file that is already
+    stored does not need to be transferred again.
+
+    Args:
+        directory (str): The directory of the store, created if it does not exist.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _check(digest: str) -> None:
+        if not _DIGEST.match(digest):
+            raise ValueError(f"Expected a SHA-256 hex digest, got {digest!r}")
+
+    def path(self, digest: str) -> Optional[Path]:
+        "The stored file with the digest, or None if there is none."
+        self._check(digest)
+        directory = self.directory / digest
+        if not directory.is_dir():
+            return None
+        return next(directory.iterdir(), None)
+
+    def _place(self, digest: str, name: str, source: Path, move: bool) -> Path:
+        directory = self.directory / digest
+        with self._lock:
+            existing = self.path(digest)
+            if existing is not None:
+                if move:
+                    source.unlink()
+                return existing
+            directory.mkdir(exist_ok=True)
+            # Keep the file name, so that stored files keep their extensions.
+            name = Path(name).name
+            target = directory / (name if name not in ("", ".", "..") else digest)
+            if move:
+                os.replace(source, target)
+            else:
+                shutil.copyfile(source, target)
+            return target
+
+    def add(self, path: os.PathLike) -> str:
+        """
+        Store a copy of a file.
+
+        Returns:
+            str: Its digest.
+        """
+        digest = file_digest(path)
+        self._place(digest, Path(path).name, Path(path), move=False)
+        return digest
+
+    def write(self, digest: str, name: str, chunks: Iterable[bytes]) -> Path:
+        """
+        Store a file from chunks of bytes, checking that they have the expected digest.
+
+        Raises:
+            ValueError: If the contents do not match `digest`.
+        """
+        self._check(digest)
+        actual = hashlib.sha256()
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    actual.update(chunk)
+                    f.write(chunk)
+            if actual.hexdigest() != digest:
+                raise ValueError(f"Expected contents with digest {digest}, got {actual.hexdigest()}")
+            return self._place(digest, name, Path(temp), move=True)
+        finally:
+            if os.path.exists(temp):
+                os.unlink(temp)
+
+
+def _under(path: str, directory: Optional[str]) -> bool:
+    "Whether `path` is an existing file inside `directory`, following symbolic links."
+    if directory is None:
+        return False
+    root = os.path.realpath(directory)
+    path = os.path.realpath(path)
+    return os.path.commonpath([root, path]) == root and os.path.isfile(path)
+
+
+def encode_inputs(
+    inputs: Dict[str, Any], store: ArtifactStore, input_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Prepare the inputs of a document for a remote worker.
+
+    Files, that is :class:`pathlib.Path` values and the file types of :mod:`papercast.types`,
+    are added to `store` and replaced by their digest, for the worker to download. Strings may
+    come from clients, so they are only read as files if they are inputs ending in ``_path``
+    that name a file inside `input_dir`. Other strings are sent as they are.
+
+    Args:
+        inputs (Dict[str, Any]): The inputs of the document.
+        store (ArtifactStore): Where the files are added.
+        input_dir (Optional[str]): The directory of the files that strings may name.
+
+    Raises:
+        ValueError: If an input is neither JSON nor a file.
+    """
+    encoded = {}
+    for key, value in inputs.items():
+        if isinstance(value, str):
+            path = value if key.endswith("_path") and _under(value, input_dir) else None
+        else:
+            path = value if isinstance(value, Path) else getattr(value, "path", None)
+        if isinstance(path, (str, Path)):
+            encoded[key] = {
+                _ARTIFACT: store.add(path),
+                "name": Path(path).name,
+                "type": None if isinstance(value, Path) else type(value).__name__,
+            }
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            raise ValueError(
+                f"Input {key} of type {type(value).__name__} cannot be sent to a remote worker"
+            )
+        encoded[key] = value
+    return encoded
+
+
+def decode_inputs(inputs: Dict[str, Any], fetch: Callable[[str, str], Path]) -> Dict[str, Any]:
+    """
+    Restore the inputs of a document prepared by :func:`encode_inputs`.
+
+    Args:
+        inputs (Dict[str, Any]): The encoded inputs.
+        fetch (Callable[[str, str], Path]): Gets a local copy of a file from its digest and name.
+    """
+    decoded = {}
+    for key, value in inputs.items():
+        if isinstance(value, dict) and _ARTIFACT in value:
+            path = fetch(value[_ARTIFACT], value["name"])
+            # Only the file types of papercast.types are restored, anything else is a Path.
+            file_type = getattr(file_types, value.get("type") or "", None)
+            if value.get("type") == "str":
+                value = str(path)
+            elif isinstance(file_type, type) and file_type.__module__ == file_types.__name__:
+                value = file_type(path)
+            else:
+                value = path
+        decoded[key] = value
+    return decoded
+
+
+class RemoteQueue:
+    """
+    The jobs of a :class:`papercast.server.Server` with remote workers, leased over HTTP.
+
+    It can be used as the queue of a :class:`papercast.workers.Worker`, so a worker runs the
+    same way whether its jobs come from a local database or a server on another machine. Files
+    in the inputs of jobs are downloaded into `artifacts_dir`, once per digest. Output files
+    are uploaded when the server does not already have them.
+
+    Args:
+        url (str): The URL of the server, such as ``http://papercast:8000``.
+        artifacts_dir (Optional[str]): Where downloaded files are kept. Defaults to a new
+            temporary directory.
+        timeout (float): Seconds to wait for each HTTP request.
+        token (Optional[str]): The server's ``worker_token``, sent as a bearer token.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        artifacts_dir: Optional[str] = None,
+        timeout: float = 30.0,
+        token: Optional[str] = None,
+    ):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._headers = {"Authorization": f"Bearer {token}"} if token is not None else {}
+        self.artifacts = ArtifactStore(
+            artifacts_dir or tempfile.mkdtemp(prefix="papercast-artifacts-")
+        )
+        self._session = requests.Session()
+        self._session.headers.update(self._headers)
+        self._registration: Dict[str, Any] = {}
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        response = self._session.request(
+            method, f"{self.url}{path}", timeout=self.timeout, **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def register(
+        self,
+        name: Optional[str] = None,
+        pipelines: Optional[List[str]] = None,
+        worker_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Register a worker with the server.
+
+        Args:
+            name (Optional[str]): A name shown in ``/workers``. Defaults to the host name.
+            pipelines (Optional[List[str]]): The pipelines the worker can run. Defaults to all.
+            worker_id (Optional[str]): The ID of a worker registering again.
+
+        Returns:
+            Dict[str, Any]: The ``worker_id``, and the ``heartbeat_interval`` and
+            ``lease_timeout`` in seconds.
+        """
+        self._registration = {
+            "name": name or socket.gethostname(),
+            "pipelines": pipelines,
+            "worker_id": worker_id,
+        }
+        registration = self._request("POST", "/workers/register", json=self._registration).json()
+        self._registration["worker_id"] = registration["worker_id"]
+        return registration
+
+    def claim(self, worker: str) -> Optional[QueuedJob]:
+        "Lease the next job, or get None if no job is waiting."
+        try:
+            response = self._request("POST", f"/workers/{worker}/lease")
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            # The server forgot the worker, such as after a restart.
+            logger.warning(f"Registering worker {worker} again")
+            self.register(
+                self._registration.get("name"), self._registration.get("pipelines"), worker
+            )
+            response = self._request("POST", f"/workers/{worker}/lease")
+        job = response.json()["job"]
+        if job is None:
+            return None
+        return QueuedJob(
+            job["id"],
+            job["pipeline"],
+            decode_inputs(job["inputs"], self._fetch),
+            job["start"],
+            job["attempts"],
+        )
+
+    def _fetch(self, digest: str, name: str) -> Path:
+        path = self.artifacts.path(digest)
+        if path is not None:
+            return path
+        with self._request("GET", f"/artifacts/{digest}", stream=True) as response:
+            return self.artifacts.write(digest, name, response.iter_content(1 << 20))
+
+    def _upload(self, path: str) -> Dict[str, str]:
+        digest = file_digest(path)
+        name = Path(path).name
+        exists = self._session.head(f"{self.url}/artifacts/{digest}", timeout=self.timeout)
+        if exists.status_code == 404:
+            with open(path, "rb") as f:
+                self._request("PUT", f"/artifacts/{digest}", params={"name": name}, data=f)
+        else:
+            exists.raise_for_status()
+        return {"digest": digest, "name": name}
+
+    def heartbeat(self, worker: str) -> None:
+        # Sent from the worker's heartbeat thread, so not through the shared session.
+        response = requests.post(
+            f"{self.url}/workers/{worker}/heartbeat", headers=self._headers, timeout=self.timeout
+        )
+        response.raise_for_status()
+
+    def finish(
+        self,
+        job_id: str,
+        worker: str,
+        outputs: Optional[Dict[str, str]] = None,
+        timings: Optional[Dict[str, float]] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """
+        Upload the output files of a job, and report that it finished.
+
+        Returns:
+            bool: False if the job's lease expired and it was leased again, in which case the
+            result is ignored.
+        """
+        files = {}
+        if error is None:
+            try:
+                files = {key: self._upload(path) for key, path in (outputs or {}).items()}
+            except (OSError, requests.RequestException) as e:
+                error = f"{type(e).__name__}: failed to upload outputs: {e}"
+        body = {
+            "outputs": files if error is None else {},
+            "timings": timings or {},
+            "error": error,
+        }
+        response = self._request("POST", f"/workers/{worker}/jobs/{job_id}", json=body)
+        return response.json()["accepted"]
+
+    def close(self) -> None:
+        self._session.close()
+
+
+def run_remote_worker(
+    url: str,
+    pipelines: Dict[str, Any],
+    name: Optional[str] = None,
+    artifacts_dir: Optional[str] = None,
+    poll_interval: float = 1.0,
+    token: Optional[str] = None,
+) -> None:
+    """
+    Register with a server and run its jobs until the process receives SIGTERM.
+
+    Args:
+        url (str): The URL of the server.
+        pipelines (Dict[str, papercast.pipelines.Pipeline]): The pipelines, by the names the
+            server gives them. Only jobs of these pipelines are leased.
+        name (Optional[str]): A name shown in the server's ``/workers``.
+        artifacts_dir (Optional[str]): Where downloaded input files are kept.
+        poll_interval (float): Seconds to wait before asking for a job again when none are
+            waiting.
+        token (Optional[str]): The server's ``worker_token``.
+    """
+    queue = RemoteQueue(url, artifacts_dir, token=token)
+    registration = queue.register(name, list(pipelines))
+    Worker(
+        pipelines,
+        queue,
+        registration["worker_id"],
+        poll_interval=poll_interval,
+        heartbeat_interval=registration["heartbeat_interval"],
+    ).run()
@@ -0,0 +1,433 @@
+import bisect
+import contextvars
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+# Offset from time.perf_counter() to the Unix epoch, for exporting timestamps.
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+
+def to_epoch(perf_time: float) -> float:
+    "Convert a :func:`time.perf_counter` reading to seconds since the Unix epoch."
+    return perf_time + _EPOCH_OFFSET
+
+
+def value_size(value: Any) -> int:
+    """
+    Estimate the size in bytes of a production field.
+
+    Strings and bytes count their length, objects referring to files count the file size, and
+    anything else falls back to :func:`sys.getsizeof`.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value)
+    path = value if isinstance(value, Path) else getattr(value, "path", None)
+    if isinstance(path, (str, Path)):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return 0
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+@dataclass
+class StageEvent:
+    """
+    A record of one unit of work in a pipeline.
+
+    Attributes:
+        pipeline (str): The name of the pipeline.
+        stage (str): The processor or subscriber name, or the entry point for documents.
+        kind (str): ``"process"`` for a processor invocation, ``"subscribe"`` for the time a
+            subscriber took to yield a production, and ``"document"`` for a whole document.
+        start (float): When the work started, in seconds since the epoch.
+        end (float): When the work ended, in seconds since the epoch.
+        queued (float): Seconds spent waiting for a resource pool or an executor worker
+            before the work started. Not included in the duration.
+        error (Optional[str]): The exception that ended the work, if any.
+        cached (bool): Whether the outputs came from a result cache.
+        input_size (Optional[int]): Estimated bytes of the processor's inputs.
+        output_size (Optional[int]): Estimated bytes of the processor's outputs.
+        trace_id (Optional[str]): Shared by all events of one document. None when no sink
+            records traces.
+        span_id (Optional[str]): Unique to this event. None when no sink records traces.
+        parent_id (Optional[str]): The span of the document this event belongs to.
+    """
+
+    pipeline: str
+    stage: str
+    kind: str
+    start: float
+    end: float
+    queued: float = 0.0
+    error: Optional[str] = None
+    cached: bool = False
+    input_size: Optional[int] = None
+    output_size: Optional[int] = None
+    trace_id: Optional[str] = field(default_factory=lambda: uuid.uuid4().hex)
+    span_id: Optional[str] = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@dataclass(frozen=True)
+class TraceContext:
+    "The IDs of a document's trace and of the span covering the whole document."
+
+    trace_id: Optional[str]
+    span_id: Optional[str]
+
+    @classmethod
+    def new(cls, ids: bool = True) -> "TraceContext":
+        "A new trace, with no IDs if `ids` is False."
+        if not ids:
+            return cls(None, None)
+        return cls(uuid.uuid4().hex, uuid.uuid4().hex[:16])
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar(
+    "papercast_trace", default=None
+)
+
+
+def current_trace() -> Optional[TraceContext]:
+    "The trace of the document being processed in the current task, if any."
+    return _current_trace.get()
+
+
+def start_trace(ids: bool = True) -> Tuple[TraceContext, contextvars.Token]:
+    "Start a trace for a new document in the current context, with no IDs if `ids` is False."
+    context = TraceContext.new(ids)
+    return context, _current_trace.set(context)
+
+
+def end_trace(token: contextvars.Token) -> None:
+    _current_trace.reset(token)
+
+
+class Sink(ABC):
+    """
+    Receives :class:`StageEvent` objects from :class:`Instrumentation`.
+
+    Sinks that do not use the input and output sizes of events set `record_sizes` to False,
+    so that they are not computed when no sink needs them. Likewise, sinks that do not use the
+    trace and span IDs of events set `record_traces` to False.
+    """
+
+    record_sizes: bool = True
+    record_traces: bool = True
+
+    @abstractmethod
+    def emit(self, event: StageEvent) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+    float("inf"),
+)
+
+
+class Histogram:
+    """
+    Counts of observations in cumulative-style buckets, as in Prometheus.
+
+    Args:
+        buckets (Sequence[float]): Increasing upper bounds, ending with infinity.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        "Estimate a quantile as the upper bound of the bucket that contains it."
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def asdict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip(map(str, self.buckets), self.counts)),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class HistogramSink(Sink):
+    """
+    Aggregates processing and queueing times in memory, by pipeline, stage and kind.
+    """
+
+    record_sizes = False
+    record_traces = False
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.bucket_bounds = tuple(buckets)
+        self.durations: Dict[Tuple[str, str, str], Histogram] = {}
+        self.queued: Dict[Tuple[str, str, str], Histogram] = {}
+        self.errors: Dict[Tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, event: StageEvent) -> None:
+        key = (event.pipeline, event.stage, event.kind)
+        with self._lock:
+            if key not in self.durations:
+                self.durations[key] = Histogram(self.bucket_bounds)
+                self.queued[key] = Histogram(self.bucket_bounds)
+                self.errors[key] = 0
+            self.durations[key].observe(event.duration)
+            self.queued[key].observe(event.queued)
+            if event.error is not None:
+                self.errors[key] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        "Summaries of every histogram, keyed by ``pipeline.stage.kind``."
+        with self._lock:
+            return {
+                ".".join(key): {
+                    "duration": self.durations[key].asdict(),
+                    "queued": self.queued[key].asdict(),
+                    "errors": self.errors[key],
+                }
+                for key in self.durations
+            }
+
+
+class JSONLinesSink(Sink):
+    "Appends each event as one JSON object per line to a file."
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def emit(self, event: StageEvent) -> None:
+        line = json.dumps(asdict(event))
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class OTLPSpanSink(Sink):
+    """
+    Exports events as OpenTelemetry spans to a collector, using OTLP over HTTP with JSON.
+
+    Spans are sent in batches from a background thread, so the pipeline never waits on the
+    collector. If the collector cannot keep up, events beyond `max_queue_size` are dropped.
+
+    Args:
+        endpoint (str): The collector's traces endpoint.
+        service_name (str): The ``service.name`` resource attribute.
+        batch_size (int): The maximum number of spans per request.
+        interval (float): The maximum number of seconds between requests.
+        max_queue_size (int): The maximum number of spans waiting to be sent.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = "http://localhost:4318/v1/traces",
+        service_name: str = "papercast",
+        batch_size: int = 512,
+        interval: float = 5.0,
+        max_queue_size: int = 10000,
+    ):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[StageEvent]]" = queue.Queue(max_queue_size)
+        self._thread = threading.Thread(
+            target=self._export_loop, name="papercast-otlp", daemon=True
+        )
+        self._thread.start()
+
+    def emit(self, event: StageEvent) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def to_span(self, event: StageEvent) -> Dict[str, Any]:
+        "Convert an event to an OTLP JSON span."
+        attributes = {
+            "papercast.pipeline": event.pipeline,
+            "papercast.stage": event.stage,
+            "papercast.kind": event.kind,
+            "papercast.queued_s": event.queued,
+            "papercast.cached": event.cached,
+        }
+        if event.input_size is not None:
+            attributes["papercast.input_size"] = event.input_size
+        if event.output_size is not None:
+            attributes["papercast.output_size"] = event.output_size
+        span = {
+            "traceId": event.trace_id,
+            "spanId": event.span_id,
+            "name": f"{event.pipeline}.{event.stage}",
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(int(event.start * 1e9)),
+            "endTimeUnixNano": str(int(event.end * 1e9)),
+            "attributes": [self._attribute(k, v) for k, v in attributes.items()],
+            "status": {"code": 2, "message": event.error}
+            if event.error is not None
+            else {"code": 1},
+        }
+        if event.parent_id is not None:
+            span["parentSpanId"] = event.parent_id
+        return span
+
+    def to_request(self, events: Iterable[StageEvent]) -> Dict[str, Any]:
+        "Build an OTLP export request body for a batch of events."
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [self._attribute("service.name", self.service_name)]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "papercast"},
+                            "spans": [self.to_span(event) for event in events],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def _send(self, events: List[StageEvent]) -> None:
+        import requests
+
+        try:
+            response = requests.post(
+                self.endpoint, json=self.to_request(events), timeout=10
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Failed to export {len(events)} spans to {self.endpoint}: {e}")
+
+    def _export_loop(self) -> None:
+        while True:
+            batch: List[StageEvent] = []
+            deadline = time.monotonic() + self.interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    event = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if event is None:
+                    stop = True
+                    break
+                batch.append(event)
+            if batch:
+                self._send(batch)
+            if stop:
+                return
+
+    def close(self) -> None:
+        "Send the remaining spans and stop the background thread."
+        self._queue.put(None)
+        self._thread.join()
+
+
+class Instrumentation:
+    """
+    Sends events about pipeline work to a set of sinks.
+
+    Errors raised by sinks are logged and never interrupt processing.
+    """
+
+    def __init__(self, sinks: Optional[List[Sink]] = None):
+        self.sinks: List[Sink] = list(sinks or [])
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sinks)
+
+    @property
+    def record_sizes(self) -> bool:
+        return any(sink.record_sizes for sink in self.sinks)
+
+    @property
+    def record_traces(self) -> bool:
+        return any(sink.record_traces for sink in self.sinks)
+
+    def add_sink(self, sink: Sink) -> None:
+        self.sinks.append(sink)
+
+    def emit(self, event: StageEvent) -> None:
+        for sink in self.sinks:
+            try:
+                sink.emit(event)
+            except Exception as e:
+                logger.warning(f"Instrumentation sink {sink} failed: {e}")
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,504 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Union,
+)
+
+from loguru import logger
+
+from papercast.production import Production
+from papercast.scheduling import (
+    DEFAULT_PRIORITY,
+    FairScheduler,
+    Priority,
+    PriorityItems,
+    priority_level,
+)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class WorkQueue:
+    """
+    A bounded queue of submitted documents, consumed by a fixed number of worker tasks.
+
+    Items are taken in order of priority class, then of submission, with the aging of
+    :class:`papercast.scheduling.PriorityItems`. With a scheduler, each worker also waits for a
+    slot shared with the other queues of the scheduler, as the queues of a server's pipelines do,
+    and takes the next item once it has one.
+
+    Must be created and used from within a running event loop.
+
+    Args:
+        name (str): A name used in log messages, usually the pipeline name. It is also the
+            flow the queue's items are scheduled in.
+        handler (Callable[[Any], Awaitable[None]]): Coroutine function called with each item.
+        max_size (int): The maximum number of items waiting in the queue.
+        workers (int): The number of items handled concurrently.
+        aging (Optional[float]): Seconds an item waits before it is promoted one priority class.
+        scheduler (Optional[papercast.scheduling.FairScheduler]): Shares worker slots between
+            this queue and others.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[None]],
+        max_size: int = 100,
+        workers: int = 2,
+        aging: Optional[float] = 60.0,
+        scheduler: Optional[FairScheduler] = None,
+    ):
+        if workers < 1:
+            raise ValueError(f"Expected at least one worker, got {workers}")
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.scheduler = scheduler
+        self.in_flight = 0
+        self._items = PriorityItems(aging)
+        self._tasks: List[asyncio.Task] = []
+        self._closed = False
+        # Items submitted and not yet handled, and events for the states workers wait for.
+        self._unfinished = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._nonempty = asyncio.Event()
+        self._room = asyncio.Event()
+
+    @property
+    def depth(self) -> int:
+        "The number of items waiting to be picked up by a worker."
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def start(self):
+        "Start the worker tasks, if they are not already running."
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._work(i)) for i in range(self.workers)
+        ]
+
+    def _push(self, item: Any, level: int) -> None:
+        self._items.push(item, level)
+        self._unfinished += 1
+        self._idle.clear()
+        self._nonempty.set()
+
+    def submit(self, item: Any, priority: Optional[Priority] = None) -> None:
+        """
+        Add an item to the queue without waiting.
+
+        Args:
+            item (Any): The item.
+            priority (Optional[papercast.scheduling.Priority]): Its priority class.
+
+        Raises:
+            QueueFullError: If the queue is full or has been closed.
+        """
+        self.submit_many([item], priority)
+
+    def submit_many(self, items: List[Any], priority: Optional[Priority] = None) -> None:
+        """
+        Add several items to the queue without waiting, either all of them or none.
+
+        Raises:
+            QueueFullError: If the queue does not have room for every item, or has been closed.
+        """
+        level = priority_level(priority)
+        if self._closed:
+            raise QueueFullError(f"Queue {self.name} is shutting down")
+        if self.max_size > 0 and self.depth + len(items) > self.max_size:
+            if len(items) == 1:
+                raise QueueFullError(f"Queue {self.name} is full ({self.max_size} items)")
+            raise QueueFullError(
+                f"Queue {self.name} does not have room for {len(items)} items "
+                f"({self.depth} of {self.max_size} used)"
+            )
+        for item in items:
+            self._push(item, level)
+        self.start()
+
+    async def put(self, item: Any, priority: Optional[Priority] = None) -> None:
+        """
+        Add an item to the queue, waiting for room if it is full.
+
+        Raises:
+            QueueFullError: If the queue has been closed.
+        """
+        level = priority_level(priority)
+        if self._closed:
+            raise QueueFullError(f"Queue {self.name} is shutting down")
+        self.start()
+        while self.max_size > 0 and self.depth >= self.max_size:
+            self._room.clear()
+            await self._room.wait()
+        self._push(item, level)
+
+    async def _wait_for_items(self) -> None:
+        while not self._items:
+            self._nonempty.clear()
+            await self._nonempty.wait()
+
+    def _take(self) -> Any:
+        item = self._items.pop()
+        self._room.set()
+        return item
+
+    async def _work(self, worker_id: int):
+        while True:
+            await self._wait_for_items()
+            if self.scheduler is None:
+                await self._run(worker_id, self._take())
+                continue
+            # Wait for a slot before taking an item, so that the item taken is the most urgent
+            # one when the slot is granted, not when the worker started waiting. The slot is
+            # asked for at the level of the item that would be taken now, with its aging.
+            level, _ = self._items.head()
+            async with self.scheduler.slot(self.name, level):
+                if not self._items:
+                    # Another worker of this queue took the last item meanwhile.
+                    continue
+                await self._run(worker_id, self._take())
+
+    async def _run(self, worker_id: int, item: Any) -> None:
+        self.in_flight += 1
+        try:
+            await self.handler(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Worker {worker_id} of {self.name} failed on {item}")
+        finally:
+            self.in_flight -= 1
+            self._unfinished -= 1
+            if not self._unfinished:
+                self._idle.set()
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop accepting items, wait for queued and in-flight items to finish, then stop the workers.
+
+        Args:
+            timeout (Optional[float]): The maximum number of seconds to wait. Items still pending
+                after the timeout are abandoned.
+
+        Returns:
+            bool: True if every item finished before the timeout.
+        """
+        self._closed = True
+        finished = True
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                finished = False
+                logger.warning(
+                    f"Abandoning {self.depth} queued and {self.in_flight} in-flight "
+                    f"items in {self.name} after {timeout}s"
+                )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        return finished
+
+
+class SubscriberMux:
+    """
+    Feeds the documents of several subscribers to a shared pool of worker tasks.
+
+    Each subscriber is read by a task of its own into a buffer of up to `prefetch` documents,
+    so that it fetches its next documents while earlier ones are being processed, and is not
+    read further while its buffer is full. Workers take the next document from the subscribers
+    with buffered documents in turn, so a subscriber producing many documents cannot starve
+    the others.
+
+    Must be created and used from within a running event loop.
+
+    Args:
+        name (str): A name used in log messages, usually the pipeline name.
+        handler (Callable[[str, Any], Awaitable[None]]): Coroutine function called with the
+            name of the subscriber and each of its documents.
+        workers (int): The number of documents handled concurrently, across subscribers.
+        prefetch (int): The maximum number of documents buffered per subscriber.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[str, Any], Awaitable[None]],
+        workers: int = 1,
+        prefetch: int = 1,
+    ):
+        if workers < 1:
+            raise ValueError(f"Expected at least one worker, got {workers}")
+        if prefetch < 1:
+            raise ValueError(f"Expected a prefetch depth of at least one, got {prefetch}")
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.prefetch = prefetch
+        self.in_flight = 0
+        self._buffers: Dict[str, Deque[Any]] = {}
+        # Subscribers with buffered documents, in the order they get their next turn.
+        self._ready: Deque[str] = deque()
+        self._reading = 0
+        self._changed = asyncio.Condition()
+
+    @property
+    def depth(self) -> int:
+        "The number of buffered documents waiting for a worker."
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    async def run(self, subscriptions: Dict[str, AsyncIterator[Any]]) -> None:
+        """
+        Read every subscription and handle its documents until all of them are exhausted.
+
+        Args:
+            subscriptions (Dict[str, AsyncIterator[Any]]): The documents of each subscriber,
+                by subscriber name.
+        """
+        self._buffers = {name: deque() for name in subscriptions}
+        self._reading = len(subscriptions)
+        tasks = [
+            asyncio.create_task(self._read(name, documents))
+            for name, documents in subscriptions.items()
+        ]
+        tasks += [asyncio.create_task(self._work(i)) for i in range(self.workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _read(self, name: str, documents: AsyncIterator[Any]) -> None:
+        buffer = self._buffers[name]
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: len(buffer) < self.prefetch)
+                try:
+                    document = await documents.__anext__()
+                except StopAsyncIteration:
+                    return
+                async with self._changed:
+                    buffer.append(document)
+                    if name not in self._ready:
+                        self._ready.append(name)
+                    self._changed.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Subscriber {name} of {self.name} failed")
+        finally:
+            self._reading -= 1
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def _work(self, worker_id: int) -> None:
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self._ready or not self._reading)
+                if not self._ready:
+                    return
+                name = self._ready.popleft()
+                buffer = self._buffers[name]
+                document = buffer.popleft()
+                if buffer:
+                    self._ready.append(name)
+                # The subscriber has room in its buffer again.
+                self._changed.notify_all()
+            self.in_flight += 1
+            try:
+                await self.handler(name, document)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(
+                    f"Worker {worker_id} of {self.name} failed on {document} from {name}"
+                )
+            finally:
+                self.in_flight -= 1
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+def output_paths(production: Production) -> Dict[str, str]:
+    """
+    Find the fields of a production that refer to files.
+
+    These are :class:`pathlib.Path` values, objects with a ``path`` attribute such as
+    :class:`papercast.types.MP3File`, and strings in fields whose names end in ``_path``.
+
+    Returns:
+        Dict[str, str]: The file paths, by field name.
+    """
+    paths = {}
+    for key, value in vars(production).items():
+        if isinstance(value, Path):
+            paths[key] = str(value)
+        elif isinstance(getattr(value, "path", None), (str, Path)):
+            paths[key] = str(value.path)
+        elif isinstance(value, str) and key.endswith("_path"):
+            paths[key] = value
+    return paths
+
+
+@dataclass
+class Job:
+    """
+    A document submitted to a pipeline, and its progress.
+
+    Attributes:
+        id (str): The job ID returned to the client.
+        pipeline (str): The name of the pipeline the document was submitted to.
+        inputs (Dict[str, Any]): The submitted inputs and options.
+        status (JobStatus): The current state of the job.
+        stages (Set[str]): The stages currently running.
+        timings (Dict[str, float]): The duration of each finished stage, in seconds.
+        outputs (Dict[str, str]): File paths produced by the pipeline, by field name.
+        error (Optional[str]): The error that failed the job.
+        priority (str): The priority class of the job, see :data:`papercast.scheduling.PRIORITIES`.
+    """
+
+    pipeline: str
+    inputs: Dict[str, Any]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.QUEUED
+    stages: Set[str] = field(default_factory=set)
+    timings: Dict[str, float] = field(default_factory=dict)
+    outputs: Dict[str, str] = field(default_factory=dict)
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    priority: str = DEFAULT_PRIORITY
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+    def on_stage(self, name: str, timing) -> None:
+        """
+        Record stage progress, for use as the ``on_stage`` callback of
+        :meth:`papercast.pipelines.Pipeline.run`.
+        """
+        with self._lock:
+            if timing is None:
+                self.stages.add(name)
+            else:
+                self.stages.discard(name)
+                self.timings[name] = timing.duration
+
+    def start(self) -> None:
+        self.status = JobStatus.RUNNING
+        self.started_at = time.time()
+
+    def succeed(self, production: Production) -> None:
+        self.outputs = output_paths(production)
+        self.status = JobStatus.DONE
+        self.finished_at = time.time()
+
+    def fail(self, error: Union[BaseException, str]) -> None:
+        "Mark the job failed, with an error or its description, such as from a worker process."
+        self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+        self.status = JobStatus.FAILED
+        self.finished_at = time.time()
+
+    def asdict(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = sorted(self.stages)
+            timings = dict(self.timings)
+        return {
+            "id": self.id,
+            "pipeline": self.pipeline,
+            "priority": self.priority,
+            "status": self.status.value,
+            "stages": stages,
+            "timings": timings,
+            "outputs": self.outputs,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobStore:
+    """
+    An in-memory store of jobs.
+
+    Finished jobs are kept for `retention` seconds, and at most `max_jobs` jobs are kept;
+    the oldest finished jobs are dropped first. Pruning runs when jobs are added, at most once
+    per `prune_interval` seconds unless the store is over `max_jobs`.
+    """
+
+    def __init__(
+        self, max_jobs: int = 10000, retention: float = 3600, prune_interval: float = 1
+    ):
+        self.max_jobs = max_jobs
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._last_prune = 0.0
+
+    def add(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        now = time.time()
+        if len(self._jobs) > self.max_jobs or now - self._last_prune > self.prune_interval:
+            self.prune(now)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self, status: Optional[JobStatus] = None) -> List[Job]:
+        return [
+            job for job in self._jobs.values() if status is None or job.status == status
+        ]
+
+    def prune(self, now: Optional[float] = None) -> None:
+        "Drop finished jobs past the retention window, then the oldest finished jobs over `max_jobs`."
+        now = time.time() if now is None else now
+        self._last_prune = now
+        excess = len(self._jobs) - self.max_jobs
+        for job in list(self._jobs.values()):
+            if not job.finished:
+                continue
+            if excess > 0 or now - job.finished_at > self.retention:
+                del self._jobs[job.id]
+                excess -= 1
+
+    def __len__(self):
+        return len(self._jobs)
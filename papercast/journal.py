@@ -0,0 +1,191 @@
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from papercast.checkpoints import Checkpoint
+from papercast.jobs import Job, JobStatus
+from papercast.scheduling import DEFAULT_PRIORITY
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    pipeline TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    submitted_at REAL NOT NULL,
+    finished_at REAL,
+    priority TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    outputs BLOB NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+"""
+
+
+class JobJournal:
+    """
+    A durable record of submitted jobs and their finished stages, in a SQLite database.
+
+    The server records each accepted submission and the outputs of each stage as it finishes.
+    On startup, jobs that had not finished are submitted again and resume after their last
+    finished stages instead of starting over.
+
+    The database uses write-ahead logging, so each record is a short append that does not block
+    readers. Stage outputs are pickled; outputs that cannot be pickled are not recorded, and
+    their stage runs again on resume.
+
+    Args:
+        path (str): The database file, created if it does not exist.
+        retention (float): Seconds to keep finished jobs in the journal, for auditing.
+    """
+
+    def __init__(self, path: str, retention: float = 24 * 3600):
+        self.path = path
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Survives process crashes; only an OS crash can lose the last few records.
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "priority" not in columns:
+            # Journals written before priorities were recorded resume in the default class.
+            self._db.execute("ALTER TABLE jobs ADD COLUMN priority TEXT")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def record_submitted(self, jobs: List[Job]) -> None:
+        "Record accepted jobs, all at once."
+        rows = [
+            (
+                job.id,
+                job.pipeline,
+                json.dumps(job.inputs),
+                JobStatus.QUEUED.value,
+                job.submitted_at,
+                job.priority,
+            )
+            for job in jobs
+        ]
+        with self._transaction():
+            self._db.executemany(
+                "INSERT OR REPLACE INTO jobs "
+                "(id, pipeline, inputs, status, submitted_at, priority) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def record_started(self, job: Job) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ? WHERE id = ?", (JobStatus.RUNNING.value, job.id)
+            )
+
+    def record_stage(self, job_id: str, stage: str, outputs: Dict[str, Any]) -> None:
+        "Record the outputs of a finished stage."
+        try:
+            payload = pickle.dumps(outputs, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.warning(f"Not journaling unpicklable outputs of {stage} for job {job_id}: {e}")
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO stages (job_id, stage, outputs) VALUES (?, ?, ?)",
+                (job_id, stage, payload),
+            )
+
+    def record_finished(self, job: Job) -> None:
+        "Record the final status of a job. Its stage outputs are no longer needed."
+        with self._transaction():
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (job.status.value, job.error, job.finished_at, job.id),
+            )
+            self._db.execute("DELETE FROM stages WHERE job_id = ?", (job.id,))
+
+    def stages(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        "Get the recorded outputs of the finished stages of a job, by stage name."
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT stage, outputs FROM stages WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        stages = {}
+        for stage, payload in rows:
+            try:
+                stages[stage] = pickle.loads(payload)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable outputs of {stage} for job {job_id}: {e}")
+        return stages
+
+    def unfinished(self) -> List[Job]:
+        "Get the jobs that were queued or running, oldest first, as new queued jobs."
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, pipeline, inputs, submitted_at, priority FROM jobs "
+                "WHERE status IN (?, ?) ORDER BY submitted_at",
+                (JobStatus.QUEUED.value, JobStatus.RUNNING.value),
+            ).fetchall()
+        return [
+            Job(
+                pipeline=pipeline,
+                inputs=json.loads(inputs),
+                id=job_id,
+                submitted_at=submitted_at,
+                priority=priority or DEFAULT_PRIORITY,
+            )
+            for job_id, pipeline, inputs, submitted_at, priority in rows
+        ]
+
+    def checkpoint(self, job_id: str) -> "JournalCheckpoint":
+        "Get a checkpoint that resumes the job and records its stages in the journal."
+        return JournalCheckpoint(self, job_id)
+
+    def prune(self, now: Optional[float] = None) -> None:
+        "Delete finished jobs older than `retention`."
+        now = time.time() if now is None else now
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (now - self.retention,),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class JournalCheckpoint(Checkpoint):
+    "The stages of one job recorded in a :class:`JobJournal`."
+
+    def __init__(self, journal: JobJournal, job_id: str):
+        self.journal = journal
+        self.job_id = job_id
+        self._completed = journal.stages(job_id)
+
+    def get(self, stage: str) -> Optional[Dict[str, Any]]:
+        return self._completed.get(stage)
+
+    def save(self, stage: str, outputs: Dict[str, Any]) -> None:
+        self.journal.record_stage(self.job_id, stage, outputs)
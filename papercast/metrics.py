@@ -0,0 +1,358 @@
+"""
+Metrics for :class:`papercast.server.Server`, in the Prometheus text exposition format.
+"""
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from papercast.instrumentation import DEFAULT_BUCKETS, Histogram, Sink, StageEvent
+from papercast.policies import CircuitBreaker
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _header(lines: List[str], name: str, kind: str, help: str) -> None:
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _render_stats(
+    lines: List[str],
+    rows: Sequence[Tuple[str, Any]],
+    families: Sequence[Tuple[str, str, str, Callable[[Any], float]]],
+) -> None:
+    "Render one family per (name, type, help, getter), with a sample per (labels, stats) row."
+    for metric, kind, help, value in families:
+        _header(lines, metric, kind, help)
+        for row_labels, stats in rows:
+            lines.append(f"{metric}{{{row_labels}}} {value(stats)}")
+
+
+class _StageSeries:
+    """
+    The metrics of one processor in one pipeline.
+
+    Label strings are rendered once, when the series is created, so recording an event only
+    updates numbers in place.
+    """
+
+    __slots__ = ("labels", "bucket_labels", "latency", "succeeded", "failed", "queued")
+
+    def __init__(self, pipeline: str, processor: str, buckets: Sequence[float]):
+        self.labels = f'pipeline="{_escape(pipeline)}",processor="{_escape(processor)}"'
+        self.bucket_labels = [
+            f'{self.labels},le="{_format_bound(bound)}"' for bound in buckets
+        ]
+        self.latency = Histogram(buckets)
+        self.succeeded = 0
+        self.failed = 0
+        self.queued = 0.0
+
+
+class MetricsSink(Sink):
+    """
+    Aggregates the processor latencies and outcomes of one pipeline for the ``/metrics`` endpoint.
+
+    Events are recorded without locking: they are emitted from the event loop, and a lost
+    increment under contention from a second loop is acceptable for metrics. Only creating the
+    series for a new processor takes a lock.
+
+    Args:
+        pipeline (str): The ``pipeline`` label, the name the pipeline is served under.
+        buckets (Sequence[float]): Upper bounds of the latency histogram buckets, in seconds.
+    """
+
+    record_sizes = False
+    record_traces = False
+
+    def __init__(self, pipeline: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.pipeline = pipeline
+        self.buckets = tuple(buckets)
+        self._series: Dict[str, _StageSeries] = {}
+        self._lock = threading.Lock()
+
+    def series(self, processor: str) -> _StageSeries:
+        series = self._series.get(processor)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(
+                    processor, _StageSeries(self.pipeline, processor, self.buckets)
+                )
+        return series
+
+    def emit(self, event: StageEvent) -> None:
+        if event.kind != "process":
+            return
+        series = self.series(event.stage)
+        if event.error is not None:
+            series.failed += 1
+            return
+        series.succeeded += 1
+        series.queued += event.queued
+        if not event.cached:
+            series.latency.observe(event.duration)
+
+
+def _render_processors(lines: List[str], sinks: Sequence[MetricsSink]) -> None:
+    series = [s for sink in sinks for s in list(sink._series.values())]
+
+    _header(
+        lines,
+        "papercast_processor_duration_seconds",
+        "histogram",
+        "Time processors took to run, excluding cache hits and failures.",
+    )
+    for s in series:
+        cumulative = 0
+        for labels, count in zip(s.bucket_labels, s.latency.counts):
+            cumulative += count
+            lines.append(
+                f"papercast_processor_duration_seconds_bucket{{{labels}}} {cumulative}"
+            )
+        lines.append(
+            f"papercast_processor_duration_seconds_sum{{{s.labels}}} {s.latency.sum}"
+        )
+        lines.append(
+            f"papercast_processor_duration_seconds_count{{{s.labels}}} {s.latency.count}"
+        )
+
+    _header(
+        lines,
+        "papercast_processor_queued_seconds_total",
+        "counter",
+        "Time processors waited for resource pools and executor workers.",
+    )
+    for s in series:
+        lines.append(f"papercast_processor_queued_seconds_total{{{s.labels}}} {s.queued}")
+
+    _header(
+        lines,
+        "papercast_processor_runs_total",
+        "counter",
+        "Processor invocations, by outcome.",
+    )
+    for s in series:
+        lines.append(
+            f'papercast_processor_runs_total{{{s.labels},outcome="success"}} {s.succeeded}'
+        )
+        lines.append(
+            f'papercast_processor_runs_total{{{s.labels},outcome="failure"}} {s.failed}'
+        )
+
+
+class ServerMetrics:
+    """
+    Collects the metrics exposed by :class:`papercast.server.Server` at ``/metrics``.
+
+    Queue, executor and cache metrics are read from the pipelines when the endpoint is
+    scraped; processor metrics come from a :class:`MetricsSink` added to every pipeline
+    with :meth:`sink`.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.sinks: Dict[str, MetricsSink] = {}
+        # Per pipeline: jobs running, done and failed.
+        self._jobs: Dict[str, List[int]] = {}
+
+    def sink(self, pipeline: str) -> MetricsSink:
+        "Get the sink for the pipeline served under the name `pipeline`."
+        if pipeline not in self.sinks:
+            self.sinks[pipeline] = MetricsSink(pipeline, self.buckets)
+        return self.sinks[pipeline]
+
+    def _job_counts(self, pipeline: str) -> List[int]:
+        counts = self._jobs.get(pipeline)
+        if counts is None:
+            counts = self._jobs.setdefault(pipeline, [0, 0, 0])
+        return counts
+
+    def jobs_started(self, pipeline: str, count: int = 1) -> None:
+        self._job_counts(pipeline)[0] += count
+
+    def job_finished(self, pipeline: str, succeeded: bool) -> None:
+        counts = self._job_counts(pipeline)
+        counts[0] -= 1
+        counts[1 if succeeded else 2] += 1
+
+    def render(
+        self, pipelines: Dict, queues: Dict, depths: Optional[Dict[str, int]] = None
+    ) -> str:
+        """
+        Render every metric.
+
+        Args:
+            pipelines (Dict[str, papercast.pipelines.Pipeline]): The served pipelines, by name.
+            queues (Dict[str, papercast.jobs.WorkQueue]): Their work queues, by pipeline name.
+            depths (Optional[Dict[str, int]]): The number of jobs waiting by pipeline name,
+                for pipelines whose jobs are queued elsewhere, such as for worker processes.
+
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+        lines: List[str] = []
+        labels = {name: f'pipeline="{_escape(name)}"' for name in pipelines}
+
+        _header(
+            lines,
+            "papercast_queue_depth",
+            "gauge",
+            "Submissions waiting for a worker.",
+        )
+        for name in pipelines:
+            queue = queues.get(name)
+            depth = queue.depth if queue else (depths or {}).get(name, 0)
+            lines.append(f"papercast_queue_depth{{{labels[name]}}} {depth}")
+
+        _header(lines, "papercast_jobs_in_flight", "gauge", "Documents being processed.")
+        for name in pipelines:
+            lines.append(
+                f"papercast_jobs_in_flight{{{labels[name]}}} {self._job_counts(name)[0]}"
+            )
+
+        _header(lines, "papercast_jobs_total", "counter", "Finished documents, by status.")
+        for name in pipelines:
+            _, done, failed = self._job_counts(name)
+            lines.append(f'papercast_jobs_total{{{labels[name]},status="done"}} {done}')
+            lines.append(f'papercast_jobs_total{{{labels[name]},status="failed"}} {failed}')
+
+        _header(
+            lines,
+            "papercast_executor_workers",
+            "gauge",
+            "Maximum number of workers of the pipeline executor.",
+        )
+        for name, pipeline in pipelines.items():
+            lines.append(
+                f"papercast_executor_workers{{{labels[name]}}} {pipeline.executor_workers}"
+            )
+
+        _header(
+            lines,
+            "papercast_executor_tasks",
+            "gauge",
+            "Calls submitted to the pipeline executor that have not returned, running or queued.",
+        )
+        for name, pipeline in pipelines.items():
+            lines.append(
+                f"papercast_executor_tasks{{{labels[name]}}} {pipeline.executor_tasks}"
+            )
+
+        _header(
+            lines,
+            "papercast_executor_busy_seconds_total",
+            "counter",
+            "Time processors spent running on the pipeline executor. Utilization is its rate "
+            "divided by papercast_executor_workers.",
+        )
+        for name, pipeline in pipelines.items():
+            lines.append(
+                f"papercast_executor_busy_seconds_total{{{labels[name]}}} "
+                f"{pipeline.executor_busy_time}"
+            )
+
+        cache_stats = []
+        policies = []
+        for name, pipeline in pipelines.items():
+            for processor, cache in pipeline.caches.items():
+                stats = cache.stats.get(processor)
+                if stats is not None:
+                    cache_stats.append(
+                        (f'{labels[name]},processor="{_escape(processor)}"', stats)
+                    )
+            for processor, policy in pipeline.policies.items():
+                policies.append(
+                    (f'{labels[name]},processor="{_escape(processor)}"', policy)
+                )
+        _render_stats(
+            lines,
+            cache_stats,
+            (
+                ("papercast_cache_hits_total", "counter", "Result cache hits.", lambda s: s.hits),
+                (
+                    "papercast_cache_misses_total",
+                    "counter",
+                    "Result cache misses.",
+                    lambda s: s.misses,
+                ),
+                (
+                    "papercast_cache_hit_ratio",
+                    "gauge",
+                    "Fraction of result cache lookups that hit.",
+                    lambda s: s.hit_rate,
+                ),
+            ),
+        )
+        _render_stats(
+            lines,
+            policies,
+            (
+                (
+                    "papercast_processor_retries_total",
+                    "counter",
+                    "Failed attempts that were retried.",
+                    lambda p: p.stats.retries,
+                ),
+                (
+                    "papercast_processor_timeouts_total",
+                    "counter",
+                    "Attempts that exceeded the processor's timeout.",
+                    lambda p: p.stats.timeouts,
+                ),
+                (
+                    "papercast_processor_circuit_rejections_total",
+                    "counter",
+                    "Calls failed fast by an open circuit breaker.",
+                    lambda p: p.stats.rejections,
+                ),
+            ),
+        )
+        _render_stats(
+            lines,
+            [
+                (labels[name], pipeline.dedup)
+                for name, pipeline in pipelines.items()
+                if getattr(pipeline, "dedup", None) is not None
+            ],
+            (
+                (
+                    "papercast_dedup_coalesced_total",
+                    "counter",
+                    "Submissions that joined a run of the same paper already in progress.",
+                    lambda d: d.coalesced,
+                ),
+                (
+                    "papercast_dedup_skipped_total",
+                    "counter",
+                    "Submissions skipped because their paper was already published.",
+                    lambda d: d.skipped,
+                ),
+            ),
+        )
+        breakers = [
+            (policy_labels, policy.circuit_breaker.state)
+            for policy_labels, policy in policies
+            if policy.circuit_breaker is not None
+        ]
+        _header(
+            lines,
+            "papercast_circuit_breaker_state",
+            "gauge",
+            "1 for the current state of each circuit breaker, 0 for the others.",
+        )
+        for breaker_labels, current in breakers:
+            for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN):
+                lines.append(
+                    f'papercast_circuit_breaker_state{{{breaker_labels},state="{state}"}} '
+                    f"{int(state == current)}"
+                )
+
+        _render_processors(lines, list(self.sinks.values()))
+        return "\n".join(lines) + "\n"
@@ -1,10 +1,51 @@
-from papercast.base import BaseProcessor, BaseSubscriber, BasePipelineComponent
+from papercast.base import (
+    BaseProcessor,
+    BasePublisher,
+    BaseSubscriber,
+    BasePipelineComponent,
+    is_async_processor,
+)
 from papercast.production import Production
-from typing import Iterable, Dict, Any
-from collections import defaultdict
+from papercast.dedup import Deduplicator
+from papercast.jobs import SubscriberMux
+from papercast.plan import ExecutionPlan, Routes
+from papercast.cache import ResultCache
+from papercast.checkpoints import Checkpoint, CheckpointStore, StoredCheckpoint
+from papercast.resources import ResourcePool, resource_pool
+from papercast.policies import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    StagePolicy,
+    StageTimeoutError,
+)
+from papercast.streams import Stream, has_streams
+from papercast.instrumentation import (
+    Instrumentation,
+    StageEvent,
+    TraceContext,
+    current_trace,
+    end_trace,
+    start_trace,
+    to_epoch,
+    value_size,
+)
+from typing import AsyncContextManager, AsyncIterator, Awaitable, Iterable, Dict, Any
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Any, get_origin, get_args, Union
+import inspect
+import os
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Deque, List, Any, Optional, Sequence, Tuple, get_origin, get_args, Union
 from inspect import isclass
 from loguru import logger
 
@@ -13,15 +54,282 @@ class InvalidPipelineComponentError(Exception):
     pass
 
 
+SCHEDULERS = ("sequential", "concurrent")
+EXECUTOR_TYPES = ("thread", "process")
+
+
+@dataclass
+class StageTiming:
+    """
+    Wall-clock timing of a single processor invocation.
+
+    Times are taken from :func:`time.perf_counter` in the process that ran the stage.
+    `queued` is the time the stage waited for its resource pool and a free executor worker
+    before it started, and is not part of its duration.
+    """
+
+    name: str
+    start: float
+    end: float
+    cached: bool = False
+    queued: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@dataclass
+class ProcessingReport:
+    """
+    Summary of a single run of :meth:`Pipeline.process`.
+
+    Attributes:
+        production (Production): The production after all stages have run.
+        timings (Dict[str, StageTiming]): Per-stage timings, keyed by processor name.
+        wall_time (float): Elapsed time for the whole document.
+        critical_path (List[str]): The chain of dependent stages with the largest summed duration.
+        critical_path_time (float): The summed duration of the stages on the critical path.
+        error (Optional[BaseException]): The error that stopped the production, for reports
+            returned by :meth:`Pipeline.run_many`.
+        duplicate (bool): Whether the document was skipped because its paper was already
+            published, see :class:`papercast.dedup.Deduplicator`. The production then only
+            has the document's inputs.
+    """
+
+    production: Production
+    timings: Dict[str, StageTiming] = field(default_factory=dict)
+    wall_time: float = 0.0
+    critical_path: List[str] = field(default_factory=list)
+    critical_path_time: float = 0.0
+    error: Optional[BaseException] = None
+    duplicate: bool = False
+
+    def prepend(self, timing: StageTiming) -> None:
+        "Add a stage that ran before every other stage, such as the collector."
+        self.timings = {timing.name: timing, **self.timings}
+        self.wall_time += timing.duration
+        self.critical_path.insert(0, timing.name)
+        self.critical_path_time += timing.duration
+
+
+StageCallback = Callable[[str, Optional[StageTiming]], None]
+"""
+Called with a stage name and None when the stage starts, and with its timing when it finishes.
+"""
+
+
+def _discard_result(task: asyncio.Future) -> None:
+    # Retrieve the outcome of an abandoned call so that asyncio does not log it as unhandled.
+    if not task.cancelled():
+        task.exception()
+
+
+async def _in_thread(func: Callable[..., Any], *args) -> Any:
+    "Run blocking disk I/O, such as reading a checkpoint, on the default executor."
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+# The tasks feeding the streams started while processing the current document or batch.
+_stream_pumps: ContextVar[Optional[List[asyncio.Task]]] = ContextVar(
+    "papercast_stream_pumps", default=None
+)
+
+# Returned by next() on an exhausted generator.
+_EXHAUSTED = object()
+
+
+class _DrainedChunks(list):
+    """
+    The chunks a generator processor yielded in a worker process, which cannot send the
+    generator itself back. They are streamed once the processor has finished.
+    """
+
+
+def _timed_process(
+    processor, production: Production, options: Dict[str, Any], drain: bool = False
+):
+    # Module-level so that it can be pickled and sent to a process pool.
+    start = time.perf_counter()
+    result = processor.process(production, **options)
+    if drain and inspect.isgenerator(result):
+        result = _DrainedChunks(result)
+    return result, start, time.perf_counter()
+
+
+def _timed_process_batch(
+    processor, productions: List[Production], options: Dict[str, Any]
+):
+    # Module-level so that it can be pickled and sent to a process pool.
+    start = time.perf_counter()
+    results = processor.process_batch(productions, **options)
+    return results, start, time.perf_counter()
+
+
+# Processors of the pipeline that created a process pool worker, set by its initializer.
+_worker_processors: Dict[str, BasePipelineComponent] = {}
+
+
+def _init_process_worker(processors: Dict[str, BasePipelineComponent]):
+    _worker_processors.update(processors)
+
+
+def _warm_up_process_worker() -> int:
+    return os.getpid()
+
+
+def _process_in_worker(
+    name: str,
+    inputs: Dict[str, Any],
+    output_keys: List[str],
+    options: Dict[str, Any],
+) -> Tuple[Union[Dict[str, Any], _DrainedChunks], float, float]:
+    """
+    Run a CPU-bound processor in a process pool worker.
+
+    Only the processor's inputs are sent to the worker and only its outputs are sent back, so
+    fields such as extracted text or audio that other stages use are not pickled each time.
+    The chunks of a generator processor are all sent back once it finishes.
+    """
+    processor = _worker_processors[name]
+    production = Production(**inputs)
+    start = time.perf_counter()
+    result = processor.process(production, **options)
+    if inspect.isgenerator(result):
+        chunks = _DrainedChunks(
+            {
+                k: v
+                for k, v in (vars(chunk) if isinstance(chunk, Production) else chunk).items()
+                if not output_keys or k in output_keys
+            }
+            for chunk in result
+        )
+        return chunks, start, time.perf_counter()
+    end = time.perf_counter()
+    if result is None:
+        result = production
+    # Read the fields directly, so that lazy values are sent back unloaded.
+    fields = vars(result)
+    return {k: fields[k] for k in output_keys or fields if k in fields}, start, end
+
+
+def _process_batch_in_worker(
+    name: str,
+    inputs: List[Dict[str, Any]],
+    output_keys: List[str],
+    options: Dict[str, Any],
+) -> Tuple[List[Dict[str, Any]], float, float]:
+    "Run the ``process_batch`` of a CPU-bound processor in a process pool worker."
+    processor = _worker_processors[name]
+    productions = [Production(**fields) for fields in inputs]
+    start = time.perf_counter()
+    results = processor.process_batch(productions, **options)
+    end = time.perf_counter()
+    if len(results) != len(productions):
+        raise ValueError(
+            f"{name}.process_batch returned {len(results)} results for {len(productions)} inputs"
+        )
+    outputs = []
+    for production, result in zip(productions, results):
+        fields = vars(production if result is None else result)
+        outputs.append({k: fields[k] for k in output_keys or fields if k in fields})
+    return outputs, start, end
+
+
 class Pipeline:
-    def __init__(self, name: str):
+    def __init__(
+        self,
+        name: str,
+        scheduler: str = "sequential",
+        executor_type: str = "thread",
+        max_workers: Optional[int] = None,
+        process_workers: Optional[int] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        checkpoint_store: Optional[CheckpointStore] = None,
+        release_fields: bool = False,
+        keep_fields: Iterable[str] = (),
+        subscriber_workers: Optional[int] = None,
+        subscriber_prefetch: int = 1,
+        dedup: Optional[Deduplicator] = None,
+    ):
+        """
+        Args:
+            name (str): The name of the pipeline.
+            scheduler (str): ``"sequential"`` runs processors one at a time in topological order.
+                ``"concurrent"`` dispatches every processor whose upstream processors have finished
+                onto the pipeline's executor, so independent branches run in parallel.
+            executor_type (str): ``"thread"`` or ``"process"``, the kind of pool synchronous
+                processors run on. Async processors run on the event loop.
+            max_workers (Optional[int]): The maximum number of workers in the executor.
+            process_workers (Optional[int]): The number of worker processes for processors that
+                set ``cpu_bound``. Defaults to the number of CPUs.
+            instrumentation (Optional[papercast.instrumentation.Instrumentation]): Receives an
+                event for every processor invocation, subscriber wait and document. Sinks can
+                also be added later with ``pipeline.instrumentation.add_sink``.
+            checkpoint_store (Optional[papercast.checkpoints.CheckpointStore]): Save the outputs
+                of each stage, so that running the pipeline again on a document that failed
+                resumes at the stage that failed. Checkpoints are removed when a document
+                succeeds. Ignored when a checkpoint is passed to :meth:`run`.
+            release_fields (bool): Remove each connected output from a production once every
+                stage it is connected to has finished, so that large intermediate values such
+                as extracted text are freed while the rest of the document is processed.
+                Released fields are missing from the production in the report.
+            keep_fields (Iterable[str]): Fields never to release, such as those read from
+                the report.
+            subscriber_workers (Optional[int]): The number of productions from subscribers
+                processed at once, across subscribers. Defaults to one per subscriber.
+            subscriber_prefetch (int): The number of productions each subscriber is read
+                ahead of processing. A subscriber is not read further while that many of its
+                productions are waiting for a worker.
+            dedup (Optional[papercast.dedup.Deduplicator]): Skip documents from :meth:`run`
+                and subscribers about papers that were already published, and run concurrent
+                documents about the same paper once.
+
+        Raises:
+            ValueError: If `scheduler` or `executor_type` is not recognised.
+        """
+        if scheduler not in SCHEDULERS:
+            raise ValueError(
+                f"Unknown scheduler {scheduler}, expected one of {SCHEDULERS}"
+            )
+        if executor_type not in EXECUTOR_TYPES:
+            raise ValueError(
+                f"Unknown executor type {executor_type}, expected one of {EXECUTOR_TYPES}"
+            )
+
         self.name = name
+        self.scheduler = scheduler
         self.connections = defaultdict(list)
         self.processors = {}
         self.collectors = {}
         self.subscribers = {}
         self.downstream_processors = {}
-        self.executor = ThreadPoolExecutor()
+        self.caches: Dict[str, ResultCache] = {}
+        self.limits: Dict[str, ResourcePool] = {}
+        self.policies: Dict[str, StagePolicy] = {}
+        self.chunk_workers: Dict[str, int] = {}
+        self._plans: Dict[str, ExecutionPlan] = {}
+        self._input_collectors: Optional[Dict[str, str]] = None
+        self.max_workers = max_workers
+        self.process_workers = process_workers
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self.instrumentation = (
+            instrumentation if instrumentation is not None else Instrumentation()
+        )
+        self.checkpoint_store = checkpoint_store
+        self.release_fields = release_fields
+        self.keep_fields = frozenset(keep_fields)
+        self.subscriber_workers = subscriber_workers
+        self.subscriber_prefetch = subscriber_prefetch
+        self.dedup = dedup
+        if executor_type == "process":
+            self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Calls submitted to the executor and not yet returned, and the summed time
+        # processors spent running on it, for utilization metrics.
+        self.executor_tasks = 0
+        self.executor_busy_time = 0.0
         self.logger = logger
 
     def _validate_name(self, name: str):
@@ -37,21 +345,82 @@ class Pipeline:
         if name in [p.name for p in self.processors.values()]:
             raise ValueError(f"Processor with name {name} already exists")
 
-    def add_processor(self, name: str, processor: BasePipelineComponent):
+    def add_processor(
+        self,
+        name: str,
+        processor: BasePipelineComponent,
+        cache: Optional[ResultCache] = None,
+        limit: Optional[Union[int, str, ResourcePool]] = None,
+        timeout: Optional[float] = None,
+        retry: Optional[Union[int, RetryPolicy]] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        chunk_workers: Optional[int] = None,
+    ):
         """
         Adds a processor to the pipeline.
 
         Args:
             name (str): The name of the processor to be added.
             processor (papercast.base.BasePipelineComponent): The processor to be added.
+            cache (Optional[papercast.cache.ResultCache]): Memoize the processor's outputs in this
+                cache. On a hit the processor is skipped.
+            limit (Optional[Union[int, str, papercast.resources.ResourcePool]]): Limit how many
+                documents the processor works on at once: a number for a limit of its own, or
+                a :class:`papercast.resources.ResourcePool`, or the name of one created with
+                :func:`papercast.resources.resource_pool`, to share a limit with other processors.
+            timeout (Optional[float]): Fail an attempt that takes longer than this many seconds
+                with :class:`papercast.policies.StageTimeoutError`.
+            retry (Optional[Union[int, papercast.policies.RetryPolicy]]): Retry failed attempts,
+                either up to a number of attempts with the default backoff, or as configured.
+            circuit_breaker (Optional[papercast.policies.CircuitBreaker]): Fail fast with
+                :class:`papercast.policies.CircuitOpenError` while the processor keeps failing.
+            chunk_workers (Optional[int]): Run the processor on each chunk of its streamed
+                inputs, with up to this many chunks in flight, as if it set ``chunked``. Its
+                outputs are streamed in the order of the chunks, and with `cache` each chunk
+                is cached separately.
 
         Raises:
-            ValueError: If a processor with the given name already exists in the pipeline.
+            ValueError: If a processor with the given name already exists in the pipeline, or
+                if a processor that streams its outputs does not declare `output_types`.
+            KeyError: If `limit` names a resource pool that does not exist.
         """
         self._validate_name(name)
+        if chunk_workers is not None and chunk_workers < 1:
+            raise ValueError(f"Expected at least one chunk worker, got {chunk_workers}")
+        streams = (
+            chunk_workers is not None
+            or getattr(processor, "chunked", False)
+            or inspect.isgeneratorfunction(getattr(processor, "process", None))
+            or inspect.isasyncgenfunction(getattr(processor, "aprocess", None))
+        )
+        if streams and not getattr(processor, "output_types", None):
+            raise ValueError(
+                f"Processor {name} streams its outputs, so it must declare output_types"
+            )
         setattr(processor, "name", name)
+        self._invalidate_plans()
+        if getattr(processor, "cpu_bound", False) and self._process_pool is not None:
+            # Workers are initialized with the CPU-bound processors, so start new ones.
+            self._process_pool.shutdown(wait=False)
+            self._process_pool = None
 
         self.processors[name] = processor
+        if cache is not None:
+            self.caches[name] = cache
+        if isinstance(limit, int):
+            self.limits[name] = ResourcePool(limit, name=f"{self.name}.{name}")
+        elif isinstance(limit, str):
+            self.limits[name] = resource_pool(limit)
+        elif limit is not None:
+            self.limits[name] = limit
+        if isinstance(retry, int):
+            retry = RetryPolicy(attempts=retry)
+        if timeout is not None or retry is not None or circuit_breaker is not None:
+            if circuit_breaker is not None and circuit_breaker.name is None:
+                circuit_breaker.name = f"{self.name}.{name}"
+            self.policies[name] = StagePolicy(timeout, retry, circuit_breaker)
+        if chunk_workers is not None:
+            self.chunk_workers[name] = chunk_workers
 
         if isinstance(processor, BaseProcessor):
             self.collectors[name] = processor
@@ -124,6 +493,43 @@ class Pipeline:
             )
 
         self.connections[a_name].append((a_output, b_name, b_input))
+        self._invalidate_plans()
+
+    def _invalidate_plans(self):
+        "Discard compiled plans after the graph has changed."
+        self._plans = {}
+        self._input_collectors = None
+
+    def compile(self, collector_subscriber_name: str) -> ExecutionPlan:
+        """
+        Get the execution plan for productions coming from a collector or subscriber.
+
+        Plans are built once and cached until the graph is changed with :meth:`add_processor`
+        or :meth:`connect`. Mutating :attr:`connections` directly does not invalidate the cache.
+
+        Args:
+            collector_subscriber_name (str): The name of the collector or subscriber.
+
+        Returns:
+            papercast.plan.ExecutionPlan: The compiled plan.
+
+        Raises:
+            ValueError: If the collector or subscriber is not connected to any downstream processors.
+        """
+        plan = self._plans.get(collector_subscriber_name)
+        if plan is None:
+            processing_graph = self.get_downstream_processors(collector_subscriber_name)
+            plan = ExecutionPlan.build(
+                collector_subscriber_name,
+                self._topological_sort(processing_graph),
+                self.connections,
+                {
+                    name: getattr(self.processors[name], "input_types", None) or ()
+                    for name in processing_graph
+                },
+            )
+            self._plans[collector_subscriber_name] = plan
+        return plan
 
     def _topological_sort(self, processor_names: Iterable[str]) -> Iterable[str]:
         visited = set()
@@ -156,9 +562,20 @@ class Pipeline:
             input_types.update(processor.input_types)
         return input_types
 
+    def _collector_index(self) -> Dict[str, str]:
+        "Map each pipeline input name to the first collector that accepts it."
+        if self._input_collectors is None:
+            index = {}
+            for name, processor in self.collectors.items():
+                for input_key in processor.input_types:
+                    index.setdefault(input_key, name)
+            self._input_collectors = index
+        return self._input_collectors
+
     def _validate_run_kwargs(self, kwargs):
-        input_kwargs = {k: v for k, v in kwargs.items() if k in self.input_types}
-        options_kwargs = {k: v for k, v in kwargs.items() if k not in self.input_types}
+        index = self._collector_index()
+        input_kwargs = {k: v for k, v in kwargs.items() if k in index}
+        options_kwargs = {k: v for k, v in kwargs.items() if k not in index}
 
         if len(input_kwargs) == 0:
             raise InvalidPipelineComponentError(
@@ -173,11 +590,15 @@ class Pipeline:
         input_key = list(input_kwargs.keys())[0]
         input_value = list(input_kwargs.values())[0]
 
-        collector = [
-            tuple(c) for c in self.collectors.items() if input_key in c[1].input_types
-        ][0]
+        collector_name = index[input_key]
 
-        return collector[0], collector[1], input_key, input_value, options_kwargs
+        return (
+            collector_name,
+            self.collectors[collector_name],
+            input_key,
+            input_value,
+            options_kwargs,
+        )
 
     def get_downstream_processors(
         self, collector_subscriber_name: str
@@ -210,52 +631,1426 @@ class Pipeline:
 
         return downstream_processors
 
+    async def _subscription(self, subscriber_name: str) -> AsyncIterator[Production]:
+        "The productions of a subscriber, recording the time spent waiting for each."
+        productions = self.subscribers[subscriber_name].subscribe().__aiter__()
+        while True:
+            # Time spent waiting for the subscriber is recorded apart from processing time.
+            start = time.perf_counter()
+            try:
+                production = await productions.__anext__()
+            except StopAsyncIteration:
+                return
+            if self.instrumentation.enabled:
+                self.instrumentation.emit(
+                    StageEvent(
+                        pipeline=self.name,
+                        stage=subscriber_name,
+                        kind="subscribe",
+                        start=to_epoch(start),
+                        end=to_epoch(time.perf_counter()),
+                        **self._trace_ids(None),
+                    )
+                )
+            yield production
+
+    async def _run_subscribers(
+        self,
+        subscriber_names: Sequence[str],
+        slot: Optional[Callable[[Optional[str]], AsyncContextManager[None]]] = None,
+        submit: Optional[Callable[[str, Production], Awaitable[Any]]] = None,
+    ):
+        """
+        Process the productions of subscribers until they are exhausted.
+
+        Subscribers are read ahead into buffers of ``subscriber_prefetch`` productions and
+        processed by ``subscriber_workers`` workers, taking turns between subscribers; see
+        :class:`papercast.jobs.SubscriberMux`.
+
+        Args:
+            subscriber_names (Sequence[str]): The subscribers to run.
+            slot (Optional[Callable]): Called with a subscriber's priority class, gives a
+                context to hold while one of its productions is processed, such as
+                :meth:`papercast.scheduling.FairScheduler.slot`.
+            submit (Optional[Callable]): Called with the subscriber name and each production
+                instead of processing it here, such as to queue it for worker processes.
+        """
+        for name in subscriber_names:
+            self.compile(name)
+
+        async def handle(name: str, production: Production):
+            if submit is not None:
+                return await submit(name, production)
+            process = lambda: self.aprocess(production, name)
+            if slot is None:
+                return await self._deduplicated(vars(production), process)
+            async with slot(getattr(self.subscribers[name], "priority", None)):
+                return await self._deduplicated(vars(production), process)
+
+        mux = SubscriberMux(
+            self.name,
+            handle,
+            workers=self.subscriber_workers or max(1, len(subscriber_names)),
+            prefetch=self.subscriber_prefetch,
+        )
+        await mux.run({name: self._subscription(name) for name in subscriber_names})
+
     async def _run_subscriber(self, subscriber_name: str):
-        subscriber = self.subscribers[subscriber_name]
-        loop = asyncio.get_event_loop()
-        processing_graph = self.get_downstream_processors(subscriber_name)
-        sorted_processors = self._topological_sort(processing_graph)
-        async for production in subscriber.subscribe():
-            await loop.run_in_executor(
-                None, self.process, production, sorted_processors
-            )
+        await self._run_subscribers([subscriber_name])
 
-    async def _run_in_server(self):
+    async def _run_in_server(
+        self,
+        slot: Optional[Callable[[Optional[str]], AsyncContextManager[None]]] = None,
+        submit: Optional[Callable[[str, Production], Awaitable[Any]]] = None,
+    ):
         """
         Runs all subscribers in the pipeline asynchronously.
 
-        This method starts a new event loop and runs each subscriber in a separate task. The subscribers
-        are executed in parallel using the `asyncio.gather` function. This function is
-        used in :class:`papercast.server.Server` to run the pipeline in a separate thread.
+        Each subscriber is read in a task of its own, and their productions are processed by
+        a shared pool of workers that take turns between subscribers. This function is
+        used in :class:`papercast.server.Server` to run the pipeline in a separate thread,
+        with `slot` sharing the server's workers by priority class, or `submit` queueing the
+        productions for its worker processes.
         """
-        await asyncio.gather(*[self._run_subscriber(name) for name in self.subscribers])
+        await self._run_subscribers(list(self.subscribers), slot, submit)
 
-    def process(
-        self, production: Production, collector_subscriber_name: str, **options
+    def _collect_outputs(
+        self, name: str, result: Optional[Production]
+    ) -> Dict[str, Any]:
+        """
+        Get the outputs of processor `name` from the production it returned.
+
+        Only the processor's declared `output_types` are collected when it declares any, so that
+        branches running in parallel do not overwrite each other's fields. Lazy values are
+        collected unloaded.
+        """
+        if result is None:
+            return {}
+        fields = vars(result)
+        output_keys = getattr(self.processors[name], "output_types", None) or fields
+        return {key: fields[key] for key in output_keys if key in fields}
+
+    def _merge_outputs(
+        self, production: Production, name: str, result: Optional[Production]
     ) -> None:
         """
-        Run the pipeline synchronously on a production, from a collector or subscriber.
+        Copy the outputs of processor `name` from `result` onto `production`.
+
+        Processors may mutate and return the production they were given, or return a new one.
+        Fields the production does not have yet are always copied; existing fields are only
+        overwritten by the processor's outputs, so that stale copies of fields returned by
+        parallel branches or process pools do not clobber newer values.
         """
-        self.logger.info(f"Processing production {production}...")
-        processing_graph = self.get_downstream_processors(collector_subscriber_name)
-        sorted_processors = self._topological_sort(processing_graph)
+        if result is None or result is production:
+            return
+        outputs = self._collect_outputs(name, result)
+        fields = vars(production)
+        for key, value in vars(result).items():
+            if key in outputs or key not in fields:
+                fields[key] = value
+
+    async def _lookup_cached(
+        self, production: Production, name: str
+    ) -> Tuple[Optional[str], Optional[StageTiming]]:
+        """
+        Look up the outputs of processor `name` in its cache, if it has one.
+
+        On a hit the cached outputs are copied onto `production`.
+
+        Returns:
+            Tuple[Optional[str], Optional[StageTiming]]: The cache key, or None if the processor is
+            not cached, and the timing of the cache hit, or None on a miss.
+        """
+        cache = self.caches.get(name)
+        if cache is None:
+            return None, None
+        start = time.perf_counter()
+        key, outputs = await cache.alookup(name, self.processors[name], production)
+        if outputs is None:
+            return key, None
+        self.logger.info(f"Using cached outputs of {name} for production {production}")
+        for output_key, value in outputs.items():
+            setattr(production, output_key, value)
+        return key, StageTiming(name, start, time.perf_counter(), cached=True)
+
+    async def _finish_stage(
+        self,
+        production: Production,
+        name: str,
+        result: Optional[Production],
+        cache_key: Optional[str],
+    ) -> None:
+        self._merge_outputs(production, name, result)
+        if cache_key is not None:
+            outputs = self._collect_outputs(name, production if result is None else result)
+            if not any(isinstance(value, Stream) for value in outputs.values()):
+                await self.caches[name].aset(cache_key, outputs)
+
+    async def _call_processor(
+        self, name: str, production: Production, options: Dict[str, Any]
+    ) -> Tuple[Optional[Production], float, float]:
+        """
+        Run processor `name` on `production`.
+
+        Processors with an ``async def aprocess`` are awaited on the event loop; others run
+        ``process`` on the pipeline's executor. Waiting for the processor's resource pool is
+        not included in the times. The processor's timeout, retry and circuit breaker policy
+        is applied if it has one.
+
+        Returns:
+            Tuple[Optional[Production], float, float]: The result, and the start and end times
+            of the last attempt.
+        """
+        processor = self.processors[name]
+        return await self._call_with_policy(
+            name,
+            f"production {production}",
+            lambda: self._invoke_processor(name, production, options),
+            is_async_processor(processor) and not getattr(processor, "cpu_bound", False),
+        )
+
+    async def _call_with_policy(
+        self,
+        name: str,
+        subject: str,
+        invoke: Callable[[], Awaitable[Tuple[Any, float, float]]],
+        cancellable: bool,
+    ) -> Tuple[Any, float, float]:
+        """
+        Call `invoke`, which runs processor `name` once, within the processor's resource pool
+        and its timeout, retry and circuit breaker policy.
+
+        Args:
+            subject (str): What the processor is run on, for logging.
+            cancellable (bool): Whether the call can be cancelled when it times out, which
+                calls on executor threads and processes cannot.
+        """
+        policy = self.policies.get(name)
+        if policy is None:
+            return await self._call_limited(name, invoke, cancellable)
+
+        breaker = policy.circuit_breaker
+        attempt = 0
+        while True:
+            if breaker is not None:
+                try:
+                    breaker.before_call()
+                except CircuitOpenError:
+                    policy.stats.rejections += 1
+                    raise
+            try:
+                outcome = await self._call_limited(name, invoke, cancellable, policy.timeout)
+            except asyncio.CancelledError:
+                if breaker is not None:
+                    breaker.record_cancelled()
+                raise
+            except Exception as e:
+                if isinstance(e, StageTimeoutError):
+                    policy.stats.timeouts += 1
+                if breaker is not None:
+                    breaker.record_failure()
+                if policy.retry is None or not policy.retry.should_retry(e, attempt):
+                    raise
+                delay = policy.retry.delay(attempt)
+                self.logger.warning(
+                    f"{name} failed on {subject} ({type(e).__name__}: {e}), "
+                    f"retrying in {delay:.1f}s"
+                )
+                policy.stats.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return outcome
+
+    async def _call_limited(
+        self,
+        name: str,
+        invoke: Callable[[], Awaitable[Tuple[Any, float, float]]],
+        cancellable: bool,
+        timeout: Optional[float] = None,
+    ) -> Tuple[Any, float, float]:
+        "Call `invoke` once, within the resource pool of processor `name` and `timeout`."
+        pool = self.limits.get(name)
+        if timeout is None:
+            if pool is None:
+                return await invoke()
+            async with pool:
+                return await invoke()
+
+        if pool is not None:
+            await pool.acquire()
+        task = asyncio.ensure_future(invoke())
+        if pool is not None:
+            task.add_done_callback(lambda _: pool.release())
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            if cancellable:
+                task.cancel()
+            else:
+                # Threads and processes cannot be interrupted: the call keeps its worker and
+                # its resource pool slot until it returns, and its result is discarded.
+                task.add_done_callback(_discard_result)
+            raise StageTimeoutError(
+                f"{name} did not finish within {timeout}s"
+            ) from None
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+    @property
+    def executor_workers(self) -> int:
+        "The maximum number of workers of the pipeline's executor."
+        return self.executor._max_workers
+
+    async def _run_in_executor(self, func: Callable[[], Any]) -> Any:
+        "Run `func` on the pipeline's executor, counting it in :attr:`executor_tasks`."
+        loop = asyncio.get_running_loop()
+        self.executor_tasks += 1
+        try:
+            return await loop.run_in_executor(self.executor, func)
+        finally:
+            self.executor_tasks -= 1
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        "Get the pool that CPU-bound processors run on, starting it on first use."
+        if self._process_pool is None:
+            cpu_bound = {
+                name: processor
+                for name, processor in self.processors.items()
+                if getattr(processor, "cpu_bound", False)
+            }
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                initializer=_init_process_worker,
+                initargs=(cpu_bound,),
+            )
+        return self._process_pool
+
+    def warm_up(self) -> None:
+        """
+        Start the worker processes of the pipeline's process pools, so that the first document
+        does not pay for spawning them. Does nothing if no processor is CPU-bound and the
+        executor is a thread pool.
+        """
+        pools = []
+        if any(getattr(p, "cpu_bound", False) for p in self.processors.values()):
+            pools.append((self._get_process_pool(), self.process_workers))
+        if isinstance(self.executor, ProcessPoolExecutor):
+            pools.append((self.executor, self.max_workers))
+        for pool, workers in pools:
+            # Submitting one task per worker before any finishes makes the pool spawn them all.
+            futures = [
+                pool.submit(_warm_up_process_worker)
+                for _ in range(workers or os.cpu_count() or 1)
+            ]
+            pids = {future.result() for future in futures}
+            self.logger.info(f"Warmed up {len(pids)} worker processes for {self.name}")
+
+    async def _invoke_processor(
+        self, name: str, production: Production, options: Dict[str, Any]
+    ) -> Tuple[Optional[Production], float, float]:
+        processor = self.processors[name]
+        if inspect.isgeneratorfunction(
+            getattr(processor, "process", None)
+        ) or inspect.isasyncgenfunction(getattr(processor, "aprocess", None)):
+            # Generators run after their output streams are set on the production, so give
+            # them their own copy, in which a streamed output does not replace an input.
+            production = Production(**vars(production))
+        if inspect.isasyncgenfunction(getattr(processor, "aprocess", None)):
+            start = time.perf_counter()
+            result = self._start_stream(name, processor.aprocess(production, **options))
+            return result, start, time.perf_counter()
+        if getattr(processor, "cpu_bound", False):
+            fields = vars(production)
+            inputs = {k: fields[k] for k in processor.input_types if k in fields}
+            loop = asyncio.get_running_loop()
+            outputs, start, end = await loop.run_in_executor(
+                self._get_process_pool(),
+                partial(
+                    _process_in_worker,
+                    name,
+                    inputs,
+                    list(processor.output_types),
+                    options,
+                ),
+            )
+            if isinstance(outputs, _DrainedChunks):
+                return self._start_stream(name, outputs), start, end
+            return Production(**outputs), start, end
+        if is_async_processor(processor):
+            start = time.perf_counter()
+            result = await processor.aprocess(production, **options)
+            return result, start, time.perf_counter()
+        # Generators cannot be sent back from a worker process, so they are drained there.
+        drain = isinstance(self.executor, ProcessPoolExecutor)
+        result, start, end = await self._run_in_executor(
+            partial(_timed_process, processor, production, options, drain)
+        )
+        self.executor_busy_time += end - start
+        if inspect.isgenerator(result) or isinstance(result, _DrainedChunks):
+            result = self._start_stream(name, result)
+        return result, start, end
+
+    async def _invoke_batch(
+        self, name: str, productions: List[Production], options: Dict[str, Any]
+    ) -> Tuple[List[Optional[Production]], float, float]:
+        """
+        Run the ``process_batch`` of processor `name` once, the way :meth:`_invoke_processor`
+        runs ``process``: awaited if it is a coroutine, in the process pool if the processor
+        is CPU-bound, and otherwise on the pipeline's executor.
+        """
+        processor = self.processors[name]
+        if getattr(processor, "cpu_bound", False):
+            inputs = [
+                {k: vars(p)[k] for k in processor.input_types if k in vars(p)}
+                for p in productions
+            ]
+            loop = asyncio.get_running_loop()
+            outputs, start, end = await loop.run_in_executor(
+                self._get_process_pool(),
+                partial(
+                    _process_batch_in_worker,
+                    name,
+                    inputs,
+                    list(processor.output_types),
+                    options,
+                ),
+            )
+            return [Production(**fields) for fields in outputs], start, end
+        if inspect.iscoroutinefunction(processor.process_batch):
+            start = time.perf_counter()
+            results = await processor.process_batch(productions, **options)
+            return results, start, time.perf_counter()
+        results, start, end = await self._run_in_executor(
+            partial(_timed_process_batch, processor, productions, options)
+        )
+        self.executor_busy_time += end - start
+        return results, start, end
+
+    def _spawn_pump(self, coroutine) -> None:
+        "Run a task feeding streams, and have the current document or batch wait for it."
+        task = asyncio.ensure_future(coroutine)
+        pumps = _stream_pumps.get()
+        if pumps is None:
+            task.add_done_callback(_discard_result)
+        else:
+            pumps.append(task)
+
+    @staticmethod
+    def _put_chunk(streams: Dict[str, Stream], chunk: Any) -> None:
+        fields = vars(chunk) if isinstance(chunk, Production) else chunk
+        for key, value in fields.items():
+            if key in streams:
+                streams[key].put(value)
+
+    @staticmethod
+    def _close_streams(
+        streams: Dict[str, Stream], error: Optional[BaseException] = None
+    ) -> None:
+        for stream in streams.values():
+            stream.close(error)
+
+    def _start_stream(self, name: str, chunks) -> Production:
+        """
+        Feed the outputs of processor `name` from the chunks its generator yields, in the
+        background, or at once from the chunks drained in a worker process.
+
+        Returns:
+            Production: The processor's outputs, as streams.
+        """
+        separator = getattr(self.processors[name], "chunk_separator", "")
+        streams = {
+            key: Stream(separator=separator) for key in self.processors[name].output_types
+        }
+        if isinstance(chunks, _DrainedChunks):
+            for chunk in chunks:
+                self._put_chunk(streams, chunk)
+            self._close_streams(streams)
+        else:
+            self._spawn_pump(self._pump_generator(name, chunks, streams))
+        return Production(**streams)
+
+    async def _pump_generator(self, name: str, chunks, streams: Dict[str, Stream]):
+        try:
+            if inspect.isasyncgen(chunks):
+                async for chunk in chunks:
+                    self._put_chunk(streams, chunk)
+            else:
+                # Each step of a synchronous generator may block, so run it on the executor.
+                while True:
+                    chunk = await self._run_in_executor(partial(next, chunks, _EXHAUSTED))
+                    if chunk is _EXHAUSTED:
+                        break
+                    self._put_chunk(streams, chunk)
+        except asyncio.CancelledError:
+            self._close_streams(streams, RuntimeError(f"{name} stopped streaming"))
+            raise
+        except Exception as e:
+            self._close_streams(streams, e)
+            raise
+        self._close_streams(streams)
+
+    def _start_chunked(
+        self, name: str, production: Production, options: Dict[str, Any]
+    ) -> Production:
+        """
+        Run chunked processor `name` on each chunk of the streams on `production`, in the
+        background.
+
+        Output streams are joined with the processor's ``chunk_separator``, or else with the
+        separator of the input stream of the same name.
+
+        Returns:
+            Production: The processor's outputs, as streams.
+        """
+        fields = vars(production)
+        separator = getattr(self.processors[name], "chunk_separator", None)
+        streams = {}
+        for key in self.processors[name].output_types:
+            source = fields.get(key)
+            if separator is None and isinstance(source, Stream):
+                streams[key] = Stream(separator=source.separator)
+            else:
+                streams[key] = Stream(separator=separator or "")
+        self._spawn_pump(self._pump_chunked(name, dict(vars(production)), options, streams))
+        return Production(**streams)
+
+    async def _pump_chunked(
+        self,
+        name: str,
+        fields: Dict[str, Any],
+        options: Dict[str, Any],
+        streams: Dict[str, Stream],
+    ):
+        inputs = {
+            key: value.__aiter__()
+            for key, value in fields.items()
+            if isinstance(value, Stream)
+        }
+        workers = self.chunk_workers.get(name, 1)
+        # Chunks being processed, oldest first, so that outputs are streamed in order.
+        running: Deque[asyncio.Future] = deque()
+        try:
+            while True:
+                # Streamed inputs are read in lockstep: one chunk of each per call.
+                chunk = dict(fields)
+                ended = set()
+                for key, chunks in inputs.items():
+                    try:
+                        chunk[key] = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        ended.add(key)
+                if ended:
+                    if len(ended) < len(inputs):
+                        raise ValueError(
+                            f"The streamed inputs of {name} have different numbers of chunks"
+                        )
+                    break
+                running.append(
+                    asyncio.ensure_future(self._process_chunk(name, chunk, options))
+                )
+                while running and (len(running) >= workers or running[0].done()):
+                    self._put_chunk(streams, await running.popleft())
+            while running:
+                self._put_chunk(streams, await running.popleft())
+        except asyncio.CancelledError:
+            self._close_streams(streams, RuntimeError(f"{name} stopped streaming"))
+            raise
+        except Exception as e:
+            self._close_streams(streams, e)
+            raise
+        finally:
+            for task in running:
+                task.cancel()
+                task.add_done_callback(_discard_result)
+        self._close_streams(streams)
 
-        for name in sorted_processors:
+    async def _process_chunk(
+        self, name: str, fields: Dict[str, Any], options: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        "Run processor `name` on one chunk, using its cache if it has one, and get its outputs."
+        production = Production(**fields)
+        cache_key, timing = await self._lookup_cached(production, name)
+        if timing is None:
+            submitted = time.perf_counter()
+            try:
+                result, start, end = await self._call_processor(name, production, options)
+            except Exception as e:
+                self._record_stage(
+                    name,
+                    production,
+                    StageTiming(name, submitted, time.perf_counter()),
+                    error=e,
+                )
+                raise
+            await self._finish_stage(production, name, result, cache_key)
+            timing = StageTiming(name, start, end, queued=max(0.0, start - submitted))
+        self._record_stage(name, production, timing)
+        return self._collect_outputs(name, production)
+
+    @staticmethod
+    async def _join_streams(production: Production) -> None:
+        "Wait for the streams on `production` to complete, and replace them with their values."
+        fields = vars(production)
+        for key, value in list(fields.items()):
+            if isinstance(value, Stream):
+                fields[key] = await value.join()
+
+    @asynccontextmanager
+    async def _streaming(self, raise_errors: bool = True):
+        """
+        Wait at the end of the block for the streams started within it to complete.
+
+        Does nothing within another such block, which waits instead. If the block fails, the
+        streams still being fed are stopped.
+
+        Args:
+            raise_errors (bool): Raise the error of the first stream that failed. Streams that
+                failed have also failed the stages reading them.
+        """
+        if _stream_pumps.get() is not None:
+            yield
+            return
+        pumps: List[asyncio.Task] = []
+        token = _stream_pumps.set(pumps)
+        try:
+            yield
+            if pumps:
+                await asyncio.gather(*pumps, return_exceptions=not raise_errors)
+        finally:
+            _stream_pumps.reset(token)
+            for pump in pumps:
+                if not pump.done():
+                    pump.cancel()
+                pump.add_done_callback(_discard_result)
+
+    async def _resume_stage(
+        self, production: Production, name: str, checkpoint: Optional[Checkpoint]
+    ) -> Optional[StageTiming]:
+        """
+        Copy the outputs of stage `name` saved in `checkpoint` onto `production`.
+
+        Returns:
+            Optional[StageTiming]: The timing of the restore, or None if the stage has no
+            saved outputs.
+        """
+        if checkpoint is None:
+            return None
+        start = time.perf_counter()
+        outputs = await _in_thread(checkpoint.get, name)
+        if outputs is None:
+            return None
+        self.logger.info(f"Resuming production {production} after {name}")
+        for key, value in outputs.items():
+            setattr(production, key, value)
+        return StageTiming(name, start, time.perf_counter(), cached=True)
+
+    async def _save_stage(
+        self, production: Production, name: str, checkpoint: Optional[Checkpoint]
+    ) -> None:
+        if checkpoint is None:
+            return
+        outputs = self._collect_outputs(name, production)
+        if not any(isinstance(value, Stream) for value in outputs.values()):
+            await _in_thread(checkpoint.save, name, outputs)
+
+    async def _stored_checkpoint(
+        self, entry: str, inputs: Dict[str, Any]
+    ) -> Optional[StoredCheckpoint]:
+        """
+        Get the checkpoint of a document in the pipeline's checkpoint store, if it has one.
+
+        Documents whose inputs cannot be hashed are processed without a checkpoint.
+        """
+        if self.checkpoint_store is None:
+            return None
+        try:
+            return await _in_thread(self.checkpoint_store.checkpoint, self.name, entry, inputs)
+        except (TypeError, ValueError) as e:
+            self.logger.warning(f"Not checkpointing a document from {entry}: {e}")
+            return None
+
+    async def _execute_stage(
+        self,
+        name: str,
+        production: Production,
+        options: Dict[str, Any],
+        on_stage: Optional[StageCallback] = None,
+        checkpoint: Optional[Checkpoint] = None,
+        routes: Optional[Routes] = None,
+    ) -> StageTiming:
+        """
+        Run one stage on `production`, skipping it if `checkpoint` has its outputs and using
+        the stage's cache if it has one.
+
+        With `routes`, `production` is the document: the stage runs on a production of its
+        own holding only its routed inputs, and its outputs are then copied onto the document.
+        """
+        if routes is None:
+            return await self._run_stage(name, production, options, on_stage, checkpoint)
+        inputs = routes.inputs(name, vars(production))
+        stage_production = Production(**inputs)
+        timing = await self._run_stage(
+            name, stage_production, options, on_stage, checkpoint
+        )
+        self._finish_routed(production, name, stage_production, inputs, routes)
+        return timing
+
+    async def _run_stage(
+        self,
+        name: str,
+        production: Production,
+        options: Dict[str, Any],
+        on_stage: Optional[StageCallback],
+        checkpoint: Optional[Checkpoint],
+    ) -> StageTiming:
+        if on_stage:
+            on_stage(name, None)
+        timing = await self._resume_stage(production, name, checkpoint)
+        if timing is not None:
+            if on_stage:
+                on_stage(name, timing)
+            return timing
+        if has_streams(production):
+            if name in self.chunk_workers or getattr(
+                self.processors[name], "chunked", False
+            ):
+                start = time.perf_counter()
+                self._merge_outputs(
+                    production, name, self._start_chunked(name, production, options)
+                )
+                timing = StageTiming(name, start, time.perf_counter())
+                if on_stage:
+                    on_stage(name, timing)
+                return timing
+            await self._join_streams(production)
+        cache_key, timing = await self._lookup_cached(production, name)
+        if timing is None:
             self.logger.info(f"Processing production {production} with {name}...")
-            production = self.processors[name].process(production, **options)
+            submitted = time.perf_counter()
+            try:
+                result, start, end = await self._call_processor(
+                    name, production, options
+                )
+            except Exception as e:
+                self._record_stage(
+                    name,
+                    production,
+                    StageTiming(name, submitted, time.perf_counter()),
+                    error=e,
+                )
+                raise
+            await self._finish_stage(production, name, result, cache_key)
+            timing = StageTiming(name, start, end, queued=max(0.0, start - submitted))
+        await self._save_stage(production, name, checkpoint)
+        self._record_stage(name, production, timing)
+        if on_stage:
+            on_stage(name, timing)
+        return timing
+
+    def _record_stage(
+        self,
+        name: str,
+        production: Production,
+        timing: StageTiming,
+        error: Optional[BaseException] = None,
+        trace: Optional[TraceContext] = None,
+    ) -> None:
+        "Send an event for a finished or failed stage to the pipeline's instrumentation."
+        if not self.instrumentation.enabled:
+            return
+        trace = trace or current_trace()
+        input_size = output_size = None
+        if self.instrumentation.record_sizes:
+            fields = vars(production)
+            input_size = sum(
+                value_size(fields[key])
+                for key in self.processors[name].input_types
+                if key in fields
+            )
+        if error is None and input_size is not None:
+            output_size = sum(
+                value_size(value)
+                for value in self._collect_outputs(name, production).values()
+            )
+        self.instrumentation.emit(
+            StageEvent(
+                pipeline=self.name,
+                stage=name,
+                kind="process",
+                start=to_epoch(timing.start),
+                end=to_epoch(timing.end),
+                queued=timing.queued,
+                error=None if error is None else f"{type(error).__name__}: {error}",
+                cached=timing.cached,
+                input_size=input_size,
+                output_size=output_size,
+                **self._trace_ids(trace),
+            )
+        )
+
+    def _trace_ids(self, trace: Optional[TraceContext]) -> Dict[str, Optional[str]]:
+        "The IDs of an event in `trace`. New IDs are only made when a sink records traces."
+        if not self.instrumentation.record_traces:
+            return {"trace_id": None, "span_id": None}
+        if trace is None:
+            return {}
+        return {"trace_id": trace.trace_id, "parent_id": trace.span_id}
 
-    def run(self, **kwargs):
+    def _record_document(
+        self,
+        entry: str,
+        trace: TraceContext,
+        start: float,
+        end: float,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        self.instrumentation.emit(
+            StageEvent(
+                pipeline=self.name,
+                stage=entry,
+                kind="document",
+                start=to_epoch(start),
+                end=to_epoch(end),
+                error=None if error is None else f"{type(error).__name__}: {error}",
+                trace_id=trace.trace_id,
+                span_id=trace.span_id,
+            )
+        )
+
+    @contextmanager
+    def _document_trace(self, entry: str):
         """
-        Run the pipeline synchronously, from kwargs.
+        Trace the document processed within the block, unless it is already being traced.
+
+        Stage events emitted within the block share the document's trace ID, and an event
+        for the whole document is emitted at the end.
+        """
+        if not self.instrumentation.enabled or current_trace() is not None:
+            yield
+            return
+        trace, token = start_trace(self.instrumentation.record_traces)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            end_trace(token)
+            self._record_document(entry, trace, start, time.perf_counter(), error)
+
+    def _routes(self, plan: ExecutionPlan) -> Routes:
+        return Routes(plan, self.release_fields, self.keep_fields)
+
+    def _finish_routed(
+        self,
+        document: Production,
+        name: str,
+        production: Production,
+        inputs: Dict[str, Any],
+        routes: Routes,
+    ) -> None:
+        """
+        Copy the outputs of stage `name` from its own `production` onto the document.
+
+        For processors that do not declare `output_types`, every field that is not one of the
+        stage's `inputs` unchanged is an output.
+        """
+        if getattr(self.processors[name], "output_types", None):
+            outputs = self._collect_outputs(name, production)
+        else:
+            outputs = {
+                key: value
+                for key, value in vars(production).items()
+                if key not in inputs or inputs[key] is not value
+            }
+        vars(document).update(outputs)
+        routes.finish(name, outputs, vars(document))
+
+    async def _process_sequential(
+        self,
+        production: Production,
+        plan: ExecutionPlan,
+        options: Dict[str, Any],
+        on_stage: Optional[StageCallback] = None,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> Dict[str, StageTiming]:
+        timings = {}
+        routes = self._routes(plan)
+        for name in plan.stages:
+            timings[name] = await self._execute_stage(
+                name, production, options, on_stage, checkpoint, routes
+            )
+        return timings
+
+    async def _process_concurrent(
+        self,
+        production: Production,
+        plan: ExecutionPlan,
+        options: Dict[str, Any],
+        on_stage: Optional[StageCallback] = None,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> Dict[str, StageTiming]:
+        remaining = {name: len(plan.upstream[name]) for name in plan.stages}
+        running: Dict[asyncio.Future, str] = {}
+        timings = {}
+        routes = self._routes(plan)
+
+        def dispatch(names):
+            for name in names:
+                task = asyncio.ensure_future(
+                    self._execute_stage(
+                        name, production, options, on_stage, checkpoint, routes
+                    )
+                )
+                running[task] = name
+
+        dispatch([name for name in plan.stages if not remaining[name]])
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, return_when=FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    timings[name] = task.result()
+                    ready = []
+                    for next_name in plan.downstream[name]:
+                        remaining[next_name] -= 1
+                        if not remaining[next_name]:
+                            ready.append(next_name)
+                    dispatch(ready)
+        finally:
+            for task in running:
+                task.cancel()
+
+        return timings
+
+    def _critical_path(
+        self, plan: ExecutionPlan, timings: Dict[str, StageTiming]
+    ) -> Tuple[List[str], float]:
+        """
+        Find the chain of dependent stages with the largest summed duration.
+
+        Args:
+            plan (papercast.plan.ExecutionPlan): The plan that was run.
+            timings (Dict[str, StageTiming]): Per-stage timings for the stages that ran.
+
+        Returns:
+            Tuple[List[str], float]: The stage names on the critical path, in execution order,
+            and their summed duration.
+        """
+        path_time = {}
+        previous = {}
+        for name in plan.stages:
+            if name not in timings:
+                continue
+            upstream = [n for n in plan.upstream[name] if n in path_time]
+            best = max(upstream, key=lambda n: path_time[n], default=None)
+            previous[name] = best
+            path_time[name] = timings[name].duration + (
+                path_time[best] if best is not None else 0.0
+            )
+
+        if not path_time:
+            return [], 0.0
+
+        last = max(path_time, key=lambda n: path_time[n])
+        total = path_time[last]
+        path = []
+        while last is not None:
+            path.append(last)
+            last = previous[last]
+        return path[::-1], total
+
+    def _run_sync(self, coroutine):
+        """
+        Run a coroutine to completion from synchronous code.
+
+        If the calling thread already runs an event loop, the coroutine runs on a fresh loop in
+        a helper thread, blocking the caller as a synchronous call would.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        with ThreadPoolExecutor(max_workers=1) as helper:
+            return helper.submit(asyncio.run, coroutine).result()
+
+    async def aprocess(
+        self,
+        production: Production,
+        collector_subscriber_name: str,
+        on_stage: Optional[StageCallback] = None,
+        checkpoint: Optional[Checkpoint] = None,
+        **options,
+    ) -> ProcessingReport:
+        """
+        Run the pipeline on a production, from a collector or subscriber, on the running event loop.
+
+        Async processors are awaited directly and synchronous ones run on the pipeline's executor.
+
+        Args:
+            production (Production): The production to process.
+            collector_subscriber_name (str): The collector or subscriber the production came from.
+            on_stage (Optional[StageCallback]): Called when each stage starts and finishes.
+            checkpoint (Optional[papercast.checkpoints.Checkpoint]): Skip the stages saved in this
+                checkpoint, and save the outputs of the others to it.
+            **options: Extra keyword arguments passed to every processor.
+
+        Returns:
+            ProcessingReport: The processed production with per-stage and critical-path timings.
+        """
+        self.logger.info(f"Processing production {production}...")
+        plan = self.compile(collector_subscriber_name)
+        stored = None
+        if checkpoint is None:
+            stored = checkpoint = await self._stored_checkpoint(
+                collector_subscriber_name, {**vars(production), **options}
+            )
+
+        start = time.perf_counter()
+        with self._document_trace(collector_subscriber_name):
+            async with self._streaming():
+                if self.scheduler == "concurrent":
+                    timings = await self._process_concurrent(
+                        production, plan, options, on_stage, checkpoint
+                    )
+                else:
+                    timings = await self._process_sequential(
+                        production, plan, options, on_stage, checkpoint
+                    )
+                await self._join_streams(production)
+        wall_time = time.perf_counter() - start
+        if stored is not None:
+            await _in_thread(stored.clear, plan.stages)
+
+        critical_path, critical_path_time = self._critical_path(plan, timings)
+        self.logger.info(
+            f"Processed production {production} in {wall_time:.3f}s "
+            f"(critical path {' -> '.join(critical_path)}: {critical_path_time:.3f}s)"
+        )
+        return ProcessingReport(
+            production=production,
+            timings=timings,
+            wall_time=wall_time,
+            critical_path=critical_path,
+            critical_path_time=critical_path_time,
+        )
+
+    def process(
+        self,
+        production: Production,
+        collector_subscriber_name: str,
+        on_stage: Optional[StageCallback] = None,
+        checkpoint: Optional[Checkpoint] = None,
+        **options,
+    ) -> ProcessingReport:
         """
+        Run the pipeline synchronously on a production, from a collector or subscriber.
+
+        See :meth:`aprocess`.
+        """
+        return self._run_sync(
+            self.aprocess(
+                production, collector_subscriber_name, on_stage, checkpoint, **options
+            )
+        )
+
+    async def _deduplicated(
+        self,
+        inputs: Dict[str, Any],
+        run: Callable[[], Awaitable[ProcessingReport]],
+    ) -> ProcessingReport:
+        "Call `run` unless the pipeline's deduplicator skips or coalesces the document."
+        identity = self.dedup.identity(inputs) if self.dedup is not None else None
+        if identity is None:
+            return await run()
+        if self.dedup.published(identity):
+            self.dedup.skipped += 1
+            self.logger.info(f"Skipping {identity}, which was already published")
+            return ProcessingReport(production=Production(**inputs), duplicate=True)
+        return await self.dedup.run(identity, run)
+
+    async def arun(
+        self,
+        on_stage: Optional[StageCallback] = None,
+        checkpoint: Optional[Checkpoint] = None,
+        **kwargs,
+    ) -> ProcessingReport:
+        """
+        Run the pipeline from kwargs, on the running event loop.
+
+        The collector that accepts the input is included in the report's timings and critical path.
+        With a deduplicator, a document about a paper that was already published is skipped,
+        and one about a paper being processed gets the report of that run.
+
+        Args:
+            on_stage (Optional[StageCallback]): Called when each stage starts and finishes.
+            checkpoint (Optional[papercast.checkpoints.Checkpoint]): Skip the stages saved in this
+                checkpoint, and save the outputs of the others to it.
+            **kwargs: Exactly one pipeline input, plus options passed to every processor.
+
+        Returns:
+            ProcessingReport: The processed production with per-stage and critical-path timings.
+        """
+        return await self._deduplicated(
+            kwargs, lambda: self._arun(on_stage, checkpoint, **kwargs)
+        )
+
+    async def _arun(
+        self,
+        on_stage: Optional[StageCallback],
+        checkpoint: Optional[Checkpoint],
+        **kwargs,
+    ) -> ProcessingReport:
         self.logger.info(f"Running pipeline with kwargs {kwargs}...")
         (
             collector_name,
-            collector,
+            _,
             param,
             value,
             options,
         ) = self._validate_run_kwargs(kwargs)
         production = Production(**{param: value})
-        production = collector.process(production, **options)
-        self.process(production, collector_subscriber_name=collector_name, **options)
+        stored = None
+        if checkpoint is None:
+            stored = checkpoint = await self._stored_checkpoint(
+                collector_name, {param: value, **options}
+            )
+        with self._document_trace(collector_name):
+            async with self._streaming():
+                collector_timing = await self._execute_stage(
+                    collector_name, production, options, on_stage, checkpoint
+                )
+
+                report = await self.aprocess(
+                    production,
+                    collector_subscriber_name=collector_name,
+                    on_stage=on_stage,
+                    checkpoint=checkpoint,
+                    **options,
+                )
+        if stored is not None:
+            stages = (collector_name,) + self.compile(collector_name).stages
+            await _in_thread(stored.clear, stages)
+        report.prepend(collector_timing)
+        return report
+
+    def run(
+        self,
+        on_stage: Optional[StageCallback] = None,
+        checkpoint: Optional[Checkpoint] = None,
+        **kwargs,
+    ) -> ProcessingReport:
+        """
+        Run the pipeline synchronously, from kwargs.
+
+        See :meth:`arun`.
+        """
+        return self._run_sync(self.arun(on_stage, checkpoint, **kwargs))
+
+    @staticmethod
+    def _implements_batch(processor: BasePipelineComponent) -> bool:
+        method = getattr(type(processor), "process_batch", None)
+        return method not in (
+            None,
+            BaseProcessor.process_batch,
+            BasePublisher.process_batch,
+        )
+
+    async def _run_stage_batch(
+        self,
+        name: str,
+        productions: List[Production],
+        pending: List[Tuple[int, Optional[str]]],
+        timings: List[Dict[str, StageTiming]],
+        errors: List[Optional[BaseException]],
+        options: Dict[str, Any],
+        traces: List[Optional[TraceContext]],
+    ) -> None:
+        """
+        Run stage `name` on the productions at the indices in `pending`.
+
+        Uses the processor's ``process_batch`` when it implements one, and otherwise runs the
+        processor on each production, concurrently when the scheduler is concurrent.
+        Errors are recorded per production in `errors` instead of being raised.
+        """
+        processor = self.processors[name]
+
+        if self._implements_batch(processor):
+            self.logger.info(f"Processing {len(pending)} productions with {name}...")
+            batch = [productions[i] for i, _ in pending]
+            submitted = time.perf_counter()
+            try:
+                results, start, end = await self._call_with_policy(
+                    name,
+                    f"a batch of {len(batch)} productions",
+                    lambda: self._invoke_batch(name, batch, options),
+                    inspect.iscoroutinefunction(processor.process_batch)
+                    and not getattr(processor, "cpu_bound", False),
+                )
+                if len(results) != len(pending):
+                    raise ValueError(
+                        f"{name}.process_batch returned {len(results)} results for {len(pending)} inputs"
+                    )
+            except Exception as e:
+                self.logger.exception(f"Batch of {len(pending)} failed in {name}")
+                failed = StageTiming(name, submitted, time.perf_counter())
+                for i, _ in pending:
+                    errors[i] = e
+                    self._record_stage(
+                        name, productions[i], failed, error=e, trace=traces[i]
+                    )
+                return
+            for (i, cache_key), result in zip(pending, results):
+                await self._finish_stage(productions[i], name, result, cache_key)
+                timings[i][name] = StageTiming(
+                    name, start, end, queued=max(0.0, start - submitted)
+                )
+                self._record_stage(
+                    name, productions[i], timings[i][name], trace=traces[i]
+                )
+            return
+
+        submitted = time.perf_counter()
+        calls = [self._call_processor(name, productions[i], options) for i, _ in pending]
+        if self.scheduler == "concurrent":
+            outcomes = await asyncio.gather(*calls, return_exceptions=True)
+        else:
+            outcomes = []
+            for call in calls:
+                try:
+                    outcomes.append(await call)
+                except Exception as e:
+                    outcomes.append(e)
+
+        for (i, cache_key), outcome in zip(pending, outcomes):
+            if isinstance(outcome, BaseException):
+                self.logger.opt(exception=outcome).error(
+                    f"Production {productions[i]} failed in {name}"
+                )
+                errors[i] = outcome
+                self._record_stage(
+                    name,
+                    productions[i],
+                    StageTiming(name, submitted, time.perf_counter()),
+                    error=outcome,
+                    trace=traces[i],
+                )
+                continue
+            result, start, end = outcome
+            await self._finish_stage(productions[i], name, result, cache_key)
+            timings[i][name] = StageTiming(
+                name, start, end, queued=max(0.0, start - submitted)
+            )
+            self._record_stage(name, productions[i], timings[i][name], trace=traces[i])
+
+    async def arun_many(
+        self,
+        inputs: Sequence[Dict[str, Any]],
+        on_stage: Optional[Sequence[Optional[StageCallback]]] = None,
+        checkpoints: Optional[Sequence[Optional[Checkpoint]]] = None,
+        **options,
+    ) -> List[ProcessingReport]:
+        """
+        Run the pipeline on several documents, one stage at a time across all of them.
+
+        Processors that implement ``process_batch`` are called once per stage with every
+        document that reached it; other processors are called once per document. A document
+        that fails is dropped from later stages without stopping the others.
+
+        Args:
+            inputs (Sequence[Dict[str, Any]]): One dictionary of kwargs per document, each with
+                exactly one pipeline input, as for :meth:`run`. Any options they contain must
+                be the same for every document.
+            on_stage (Optional[Sequence[Optional[StageCallback]]]): One callback per document,
+                called when each stage starts and finishes for that document.
+            checkpoints (Optional[Sequence[Optional[papercast.checkpoints.Checkpoint]]]): One
+                checkpoint per document, as for :meth:`run`.
+            **options: Options passed to every processor.
+
+        Returns:
+            List[ProcessingReport]: One report per document, in order. Failed documents have
+            their `error` set.
+
+        Raises:
+            ValueError: If a document does not have exactly one input, or documents have
+                different options.
+        """
+        callbacks = list(on_stage) if on_stage is not None else [None] * len(inputs)
+        stored = checkpoints is None and self.checkpoint_store is not None
+        if checkpoints is None:
+            checkpoints = [None] * len(inputs)
+        else:
+            checkpoints = list(checkpoints)
+        groups = defaultdict(list)
+        shared_options = None
+        for i, kwargs in enumerate(inputs):
+            (
+                collector_name,
+                _,
+                param,
+                value,
+                item_options,
+            ) = self._validate_run_kwargs({**kwargs, **options})
+            if shared_options is None:
+                shared_options = item_options
+            elif item_options != shared_options:
+                raise ValueError(
+                    f"All documents in a batch must have the same options, got {item_options} and {shared_options}"
+                )
+            groups[collector_name].append((i, Production(**{param: value})))
+            if stored:
+                checkpoints[i] = await self._stored_checkpoint(
+                    collector_name, {param: value, **item_options}
+                )
+
+        reports: List[Optional[ProcessingReport]] = [None] * len(inputs)
+        for collector_name, members in groups.items():
+            self.logger.info(
+                f"Running pipeline on {len(members)} documents from {collector_name}..."
+            )
+            indices = [i for i, _ in members]
+            productions = [production for _, production in members]
+            group_reports = await self._run_batch(
+                collector_name,
+                productions,
+                [callbacks[i] for i in indices],
+                shared_options or {},
+                [checkpoints[i] for i in indices],
+            )
+            for i, report in zip(indices, group_reports):
+                reports[i] = report
+                if stored and checkpoints[i] is not None and report.error is None:
+                    await _in_thread(
+                        checkpoints[i].clear,
+                        (collector_name,) + self.compile(collector_name).stages,
+                    )
+        return reports
+
+    def run_many(
+        self,
+        inputs: Sequence[Dict[str, Any]],
+        on_stage: Optional[Sequence[Optional[StageCallback]]] = None,
+        checkpoints: Optional[Sequence[Optional[Checkpoint]]] = None,
+        **options,
+    ) -> List[ProcessingReport]:
+        """
+        Run the pipeline synchronously on several documents.
+
+        See :meth:`arun_many`.
+        """
+        return self._run_sync(self.arun_many(inputs, on_stage, checkpoints, **options))
+
+    async def _run_batch(
+        self,
+        collector_name: str,
+        productions: List[Production],
+        callbacks: List[Optional[StageCallback]],
+        options: Dict[str, Any],
+        checkpoints: List[Optional[Checkpoint]],
+    ) -> List[ProcessingReport]:
+        plan = self.compile(collector_name)
+        timings: List[Dict[str, StageTiming]] = [{} for _ in productions]
+        errors: List[Optional[BaseException]] = [None] * len(productions)
+        traces: List[Optional[TraceContext]] = [
+            TraceContext.new(self.instrumentation.record_traces)
+            if self.instrumentation.enabled
+            else None
+            for _ in productions
+        ]
+        routes = [self._routes(plan) for _ in productions]
+
+        start = time.perf_counter()
+        async with self._streaming(raise_errors=False):
+            for name in (collector_name,) + plan.stages:
+                # The collector runs on the documents, and every other stage on its routed inputs.
+                stage_productions = list(productions)
+                stage_inputs: List[Dict[str, Any]] = [{} for _ in productions]
+                pending = []
+                for i, document in enumerate(productions):
+                    if errors[i] is not None:
+                        continue
+                    if name != collector_name:
+                        stage_inputs[i] = routes[i].inputs(name, vars(document))
+                        stage_productions[i] = Production(**stage_inputs[i])
+                    production = stage_productions[i]
+                    if has_streams(production):
+                        # Batches run stage by stage, so streams are joined before each stage.
+                        try:
+                            await self._join_streams(production)
+                        except Exception as e:
+                            errors[i] = e
+                            continue
+                    if callbacks[i]:
+                        callbacks[i](name, None)
+                    resumed = await self._resume_stage(production, name, checkpoints[i])
+                    if resumed is not None:
+                        timings[i][name] = resumed
+                        if callbacks[i]:
+                            callbacks[i](name, resumed)
+                        continue
+                    cache_key, hit = await self._lookup_cached(production, name)
+                    if hit is not None:
+                        timings[i][name] = hit
+                        await self._save_stage(production, name, checkpoints[i])
+                        self._record_stage(name, production, hit, trace=traces[i])
+                        if callbacks[i]:
+                            callbacks[i](name, hit)
+                    else:
+                        pending.append((i, cache_key))
+                if pending:
+                    await self._run_stage_batch(
+                        name, stage_productions, pending, timings, errors, options, traces
+                    )
+                for i, _ in pending:
+                    if errors[i] is not None:
+                        continue
+                    await self._save_stage(stage_productions[i], name, checkpoints[i])
+                    if callbacks[i]:
+                        callbacks[i](name, timings[i][name])
+                if name != collector_name:
+                    for i, document in enumerate(productions):
+                        if errors[i] is None:
+                            self._finish_routed(
+                                document,
+                                name,
+                                stage_productions[i],
+                                stage_inputs[i],
+                                routes[i],
+                            )
+            for i, document in enumerate(productions):
+                if errors[i] is None:
+                    try:
+                        await self._join_streams(document)
+                    except Exception as e:
+                        errors[i] = e
+        end = time.perf_counter()
+        wall_time = end - start
+        for trace, error in zip(traces, errors):
+            if trace is not None:
+                self._record_document(collector_name, trace, start, end, error)
+
+        reports = []
+        for production, stage_timings, error in zip(productions, timings, errors):
+            collector_timing = stage_timings.pop(collector_name, None)
+            critical_path, critical_path_time = self._critical_path(
+                plan, stage_timings
+            )
+            report = ProcessingReport(
+                production=production,
+                timings=stage_timings,
+                wall_time=wall_time,
+                critical_path=critical_path,
+                critical_path_time=critical_path_time,
+                error=error,
+            )
+            if collector_timing is not None:
+                report.prepend(collector_timing)
+                report.wall_time = wall_time
+            reports.append(report)
+        return reports
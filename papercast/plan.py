@@ -0,0 +1,189 @@
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Binding:
+    """
+    A single connection between two processors in a compiled plan.
+
+    Attributes:
+        source (str): The name of the upstream processor.
+        output (str): The name of the output on the upstream processor.
+        target (str): The name of the downstream processor.
+        input (str): The name of the input on the downstream processor.
+    """
+
+    source: str
+    output: str
+    target: str
+    input: str
+
+
+@dataclass(frozen=True)
+class ExecutionPlan:
+    """
+    An immutable, precomputed view of the processors downstream of one collector or subscriber.
+
+    Plans are built by :meth:`papercast.pipelines.Pipeline.compile` and cached on the pipeline
+    until the graph is changed with ``add_processor`` or ``connect``.
+
+    Attributes:
+        entry (str): The collector or subscriber the plan starts from.
+        stages (Tuple[str, ...]): The downstream processors, in topological order.
+        upstream (Mapping[str, FrozenSet[str]]): For each stage, the stages it takes inputs from.
+        downstream (Mapping[str, Tuple[str, ...]]): For each stage, the stages it fans out to.
+        bindings (Mapping[str, Tuple[Binding, ...]]): For each stage, the connections feeding its inputs.
+        unbound (Mapping[str, Tuple[str, ...]]): For each stage, the inputs it declares that
+            are not connected, read from the document's fields of the same name.
+        consumers (Mapping[Tuple[str, str], int]): For each connected output, as a
+            ``(source, output)`` pair, the number of stages it is connected to.
+    """
+
+    entry: str
+    stages: Tuple[str, ...]
+    upstream: Mapping[str, FrozenSet[str]]
+    downstream: Mapping[str, Tuple[str, ...]]
+    bindings: Mapping[str, Tuple[Binding, ...]]
+    unbound: Mapping[str, Tuple[str, ...]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    consumers: Mapping[Tuple[str, str], int] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+
+    @classmethod
+    def build(
+        cls,
+        entry: str,
+        stages: Iterable[str],
+        connections: Mapping[str, List[Tuple[str, str, str]]],
+        inputs: Optional[Mapping[str, Iterable[str]]] = None,
+    ) -> "ExecutionPlan":
+        """
+        Build a plan from topologically sorted stages and the pipeline's connections.
+
+        Args:
+            entry (str): The collector or subscriber the plan starts from.
+            stages (Iterable[str]): The downstream processors, in topological order.
+            connections (Mapping[str, List[Tuple[str, str, str]]]): The pipeline's connections,
+                as recorded by :meth:`papercast.pipelines.Pipeline.connect`.
+            inputs (Optional[Mapping[str, Iterable[str]]]): For each stage, the names of the
+                inputs it declares.
+
+        Returns:
+            ExecutionPlan: The compiled plan.
+        """
+        stages = tuple(stages)
+        members = set(stages)
+        upstream: Dict[str, set] = {name: set() for name in stages}
+        downstream: Dict[str, list] = {name: [] for name in stages}
+        bindings: Dict[str, list] = {name: [] for name in stages}
+
+        for source in (entry,) + stages:
+            for output, target, input in connections.get(source, ()):
+                if target not in members:
+                    continue
+                bindings[target].append(Binding(source, output, target, input))
+                if source in members:
+                    upstream[target].add(source)
+                    if target not in downstream[source]:
+                        downstream[source].append(target)
+
+        unbound = {}
+        consumers: Dict[Tuple[str, str], int] = {}
+        for name in stages:
+            bound = {binding.input for binding in bindings[name]}
+            unbound[name] = tuple(
+                input for input in (inputs or {}).get(name, ()) if input not in bound
+            )
+            for source_output in {(b.source, b.output) for b in bindings[name]}:
+                consumers[source_output] = consumers.get(source_output, 0) + 1
+
+        return cls(
+            entry=entry,
+            stages=stages,
+            upstream=MappingProxyType({k: frozenset(v) for k, v in upstream.items()}),
+            downstream=MappingProxyType({k: tuple(v) for k, v in downstream.items()}),
+            bindings=MappingProxyType({k: tuple(v) for k, v in bindings.items()}),
+            unbound=MappingProxyType(unbound),
+            consumers=MappingProxyType(consumers),
+        )
+
+
+class Routes:
+    """
+    The outputs of one document's finished stages, routed along the bindings of a plan.
+
+    Each stage reads only its own inputs: the outputs connected to them, under the stage's
+    input names, and its unconnected inputs from the document's fields of the same name. The
+    entry's outputs are the document's fields. A stage's outputs are dropped once every stage
+    connected to them has finished, and with `release` are also removed from the document.
+
+    Args:
+        plan (ExecutionPlan): The plan the document is processed with.
+        release (bool): Remove outputs from the document once their last consumer finishes.
+        keep (FrozenSet[str]): Fields never to remove from the document.
+    """
+
+    def __init__(
+        self, plan: ExecutionPlan, release: bool = False, keep: FrozenSet[str] = frozenset()
+    ):
+        self.plan = plan
+        self.release = release
+        self.keep = keep
+        self.outputs: Dict[str, Dict[str, Any]] = {}
+        self.remaining = dict(plan.consumers)
+
+    def inputs(self, stage: str, document: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        Get the inputs of `stage`.
+
+        Args:
+            stage (str): The stage about to run.
+            document (Mapping[str, Any]): The fields of the document's production.
+
+        Returns:
+            Dict[str, Any]: The stage's inputs, by input name.
+        """
+        inputs = {name: document[name] for name in self.plan.unbound[stage] if name in document}
+        for binding in self.plan.bindings[stage]:
+            source = (
+                document
+                if binding.source == self.plan.entry
+                else self.outputs.get(binding.source, {})
+            )
+            if binding.output in source:
+                inputs[binding.input] = source[binding.output]
+        return inputs
+
+    def finish(
+        self, stage: str, outputs: Dict[str, Any], document: Dict[str, Any]
+    ) -> None:
+        """
+        Record the outputs of a finished stage, and drop the outputs it was the last to read.
+
+        Args:
+            stage (str): The stage that finished.
+            outputs (Dict[str, Any]): Its outputs, by output name.
+            document (Dict[str, Any]): The fields of the document's production.
+        """
+        self.outputs[stage] = outputs
+        for source_output in {(b.source, b.output) for b in self.plan.bindings[stage]}:
+            self.remaining[source_output] -= 1
+            if self.remaining[source_output]:
+                continue
+            del self.remaining[source_output]
+            source, output = source_output
+            if source == self.plan.entry:
+                value = document.get(output)
+            else:
+                value = self.outputs.get(source, {}).pop(output, None)
+            if (
+                self.release
+                and output not in self.keep
+                and output in document
+                and document[output] is value
+            ):
+                del document[output]
@@ -1,6 +1,15 @@
 from papercast.base import BasePipelineComponent
+import functools
+import hashlib
 import importlib.metadata
+import json
+import os
+import sys
 from importlib import import_module
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from loguru import logger
 
 
 def validate_base_pipeline_component(plugin_module):
@@ -29,26 +38,166 @@ def validate_process_method(plugin_module):
         raise TypeError(f"Plugin {plugin_module.__name__} should have a process method")
 
 
-def load_plugins(plugin_type: str):
-    plugins = {}
-    for entry_point in importlib.metadata.entry_points().get(
-        f"papercast.{plugin_type}", []
-    ):
-        plugin_module = entry_point.load()
+_VALIDATORS = {
+    "subscribers": (validate_base_pipeline_component, validate_output_types),
+    "publishers": (validate_base_pipeline_component, validate_input_types),
+    "processors": (
+        validate_base_pipeline_component,
+        validate_input_types,
+        validate_output_types,
+    ),
+}
+
+
+def _index_path() -> Path:
+    "Where the plugin index is cached: ``$PAPERCAST_PLUGIN_INDEX``, or the user cache directory."
+    path = os.environ.get("PAPERCAST_PLUGIN_INDEX")
+    if path:
+        return Path(path)
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "papercast" / "plugins.json"
+
+
+def _environment_key() -> str:
+    """
+    Fingerprint the places distributions are installed, so that the cached index is rebuilt
+    when a package is installed, upgraded or removed.
+
+    Installing a distribution adds a metadata directory to an entry of `sys.path`, which
+    changes the modification time of that entry; reading the times is much cheaper than
+    reading the metadata of every installed distribution.
+    """
+    entries = []
+    for entry in sys.path:
+        try:
+            entries.append((entry, os.stat(entry or ".").st_mtime_ns))
+        except OSError:
+            entries.append((entry, None))
+    return hashlib.sha256(json.dumps([sys.version, entries]).encode()).hexdigest()
 
-        if plugin_type == "subscribers":
-            validate_base_pipeline_component(plugin_module)
-            validate_output_types(plugin_module)
 
-        elif plugin_type == "publishers":
-            validate_base_pipeline_component(plugin_module)
-            validate_input_types(plugin_module)
+def _scan_entry_points() -> Dict[str, Dict[str, str]]:
+    "Read the entry points of every installed distribution in the ``papercast.*`` groups."
+    index: Dict[str, Dict[str, str]] = {}
+    seen = set()
+    for distribution in importlib.metadata.distributions():
+        # Like importlib.metadata.entry_points, only the first of several installed copies of a
+        # distribution on sys.path counts.
+        name = (distribution.metadata["Name"] or "").lower().replace("_", "-")
+        if name in seen:
+            continue
+        seen.add(name)
+        for entry_point in distribution.entry_points:
+            group, _, plugin_type = entry_point.group.partition(".")
+            if group == "papercast" and plugin_type:
+                index.setdefault(plugin_type, {})[entry_point.name] = entry_point.value
+    return index
 
-        elif plugin_type == "processors":
-            validate_base_pipeline_component(plugin_module)
-            validate_input_types(plugin_module)
-            validate_output_types(plugin_module)
 
-        plugins[entry_point.name] = plugin_module
+@functools.lru_cache(maxsize=None)
+def plugin_index() -> Dict[str, Dict[str, str]]:
+    """
+    The installed plugins, without importing them.
 
+    Enumerating entry points reads the metadata of every installed distribution, which is
+    slow in large environments, so the index is cached on disk and only rebuilt when the
+    installed distributions change. Set ``PAPERCAST_PLUGIN_INDEX`` to move the cache file.
+
+    Returns:
+        Dict[str, Dict[str, str]]: Per plugin type (``"processors"``, ``"subscribers"``,
+        ``"publishers"``...), the entry point of each plugin by name, as ``module:attribute``.
+    """
+    path = _index_path()
+    key = _environment_key()
+    try:
+        cached = json.loads(path.read_text())
+        if cached.get("key") == key:
+            return cached["plugins"]
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    plugins = _scan_entry_points()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so that concurrent processes never read a partial index.
+        temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temp.write_text(json.dumps({"key": key, "plugins": plugins}))
+        os.replace(temp, path)
+    except OSError as e:
+        logger.debug(f"Could not cache the plugin index at {path}: {e}")
     return plugins
+
+
+def refresh_plugin_index() -> Dict[str, Dict[str, str]]:
+    """
+    Rebuild the plugin index, for plugins installed in ways the cache does not notice, such as
+    editing the entry points of a package installed in development mode.
+    """
+    plugin_index.cache_clear()
+    try:
+        _index_path().unlink()
+    except OSError:
+        pass
+    return plugin_index()
+
+
+def load_plugin(plugin_type: str, name: str):
+    """
+    Import and validate one plugin.
+
+    Args:
+        plugin_type (str): ``"processors"``, ``"subscribers"`` or ``"publishers"``.
+        name (str): The name of the plugin's entry point.
+
+    Raises:
+        KeyError: If no such plugin is installed.
+        TypeError: If the plugin is not a valid component of its type.
+    """
+    value = plugin_index().get(plugin_type, {})[name]
+    plugin_module = importlib.metadata.EntryPoint(
+        name=name, value=value, group=f"papercast.{plugin_type}"
+    ).load()
+    for validate in _VALIDATORS.get(plugin_type, ()):
+        validate(plugin_module)
+    return plugin_module
+
+
+def load_plugins(plugin_type: str):
+    "Import and validate every installed plugin of `plugin_type`, by name."
+    return {
+        name: load_plugin(plugin_type, name)
+        for name in plugin_index().get(plugin_type, {})
+    }
+
+
+def lazy_plugins(
+    plugin_type: str, namespace: Dict[str, Any]
+) -> Tuple[Callable[[str], Any], Callable[[], List[str]]]:
+    """
+    Make the module-level ``__getattr__`` and ``__dir__`` of a package exposing plugins.
+
+    Plugins are imported the first time they are accessed as attributes of the package, so
+    that ``from papercast.processors import PDFProcessor`` imports that plugin only, and then
+    stored in `namespace` so later accesses are plain lookups. The package's ``__all__`` lists
+    every installed plugin, so ``from papercast.processors import *`` still imports them all.
+
+    Args:
+        plugin_type (str): The type of the plugins, the suffix of their entry point group.
+        namespace (Dict[str, Any]): The ``globals()`` of the package.
+    """
+    module = namespace["__name__"]
+
+    def __getattr__(name: str):
+        if name == "__all__":
+            return sorted(plugin_index().get(plugin_type, {}))
+        try:
+            plugin = load_plugin(plugin_type, name)
+        except KeyError:
+            raise AttributeError(f"module {module!r} has no attribute {name!r}") from None
+        namespace[name] = plugin
+        return plugin
+
+    def __dir__() -> List[str]:
+        return sorted(set(namespace) | set(plugin_index().get(plugin_type, {})))
+
+    return __getattr__, __dir__
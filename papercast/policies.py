@@ -0,0 +1,182 @@
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Tuple, Type
+
+
+class StageTimeoutError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Retry a failed stage with exponential backoff and jitter.
+
+    The delay before retry ``n`` (starting at 0) is ``backoff * multiplier ** n``, capped at
+    `max_backoff`, then reduced by a random fraction of up to `jitter` so that documents that
+    failed together do not retry together.
+
+    Attributes:
+        attempts (int): The maximum number of attempts, including the first.
+        backoff (float): The delay before the first retry, in seconds.
+        multiplier (float): The factor the delay grows by after each retry.
+        max_backoff (float): The maximum delay, in seconds.
+        jitter (float): The maximum fraction of the delay removed at random, from 0 to 1.
+        retry_on (Tuple[Type[BaseException], ...]): The exceptions that are retried.
+    """
+
+    attempts: int = 3
+    backoff: float = 1.0
+    multiplier: float = 2.0
+    max_backoff: float = 60.0
+    jitter: float = 0.5
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,)
+
+    def __post_init__(self):
+        if self.attempts < 1:
+            raise ValueError(f"Expected at least one attempt, got {self.attempts}")
+        if not 0 <= self.jitter <= 1:
+            raise ValueError(f"Expected a jitter between 0 and 1, got {self.jitter}")
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        "Whether to retry after attempt number `attempt` (starting at 0) failed with `error`."
+        return (
+            attempt + 1 < self.attempts
+            and isinstance(error, self.retry_on)
+            and not isinstance(error, CircuitOpenError)
+        )
+
+    def delay(self, attempt: int) -> float:
+        "The number of seconds to wait after attempt number `attempt` (starting at 0) failed."
+        delay = min(self.max_backoff, self.backoff * self.multiplier**attempt)
+        return delay * (1 - random.uniform(0, self.jitter))
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing service for a while, failing fast instead.
+
+    After `failure_threshold` consecutive failures the breaker opens, and calls fail with
+    :class:`CircuitOpenError` without being attempted. After `reset_timeout` seconds one trial
+    call is let through: if it succeeds the breaker closes, otherwise it opens again.
+
+    Like :class:`papercast.resources.ResourcePool`, a breaker can be shared by processors in
+    different pipelines that call the same service.
+
+    Args:
+        failure_threshold (int): The number of consecutive failures that opens the breaker.
+        reset_timeout (float): The number of seconds to stay open before a trial call.
+        name (Optional[str]): A name for log messages and metrics.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        name: Optional[str] = None,
+    ):
+        if failure_threshold < 1:
+            raise ValueError(
+                f"Expected a failure threshold of at least 1, got {failure_threshold}"
+            )
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if (
+                self._state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout
+            ):
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self) -> None:
+        """
+        Check that a call may be made.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or a trial call is already running.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN:
+                remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+                if remaining > 0:
+                    raise CircuitOpenError(
+                        f"Circuit {self.name} is open for another {remaining:.1f}s"
+                    )
+                self._state = self.HALF_OPEN
+                self._trial_running = False
+            if self._trial_running:
+                raise CircuitOpenError(f"Circuit {self.name} is waiting for a trial call")
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._state = self.CLOSED
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+    def record_cancelled(self) -> None:
+        "Neither a success nor a failure; lets another trial call through if this was one."
+        with self._lock:
+            self._trial_running = False
+
+    def __repr__(self):
+        return f"CircuitBreaker(name={self.name!r}, state={self.state!r})"
+
+
+@dataclass
+class PolicyStats:
+    "Counts of policy outcomes for one processor."
+
+    retries: int = 0
+    timeouts: int = 0
+    rejections: int = 0
+
+
+@dataclass
+class StagePolicy:
+    """
+    How a pipeline handles slow and failing calls to one processor.
+
+    Attributes:
+        timeout (Optional[float]): Seconds an attempt may take before it fails with
+            :class:`StageTimeoutError`.
+        retry (Optional[RetryPolicy]): How failed attempts are retried.
+        circuit_breaker (Optional[CircuitBreaker]): Fails calls fast while the processor's
+            service is failing.
+        stats (PolicyStats): Outcome counts, exposed in the server's metrics.
+    """
+
+    timeout: Optional[float] = None
+    retry: Optional[RetryPolicy] = None
+    circuit_breaker: Optional[CircuitBreaker] = None
+    stats: PolicyStats = field(default_factory=PolicyStats)
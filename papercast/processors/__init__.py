@@ -1,6 +1,4 @@
-from papercast.plugin_utils import load_plugins
+from papercast.plugin_utils import lazy_plugins
 
-_installed_plugins = load_plugins("processors")
-
-for name, plugin in _installed_plugins.items():
-    globals()[name] = plugin
+# Plugins are imported when first accessed, e.g. by ``from papercast.processors import Name``.
+__getattr__, __dir__ = lazy_plugins("processors", globals())
@@ -1,8 +1,158 @@
-from dataclasses import dataclass
+import mmap
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from reprlib import Repr
+from typing import Any, Dict, Optional, Union
+
+_repr = Repr()
+_repr.maxstring = 60
+_repr.maxother = 60
+
+
+class LazyValue(ABC):
+    """
+    A production field whose value is loaded when a processor reads it.
+
+    Large payloads such as extracted text or audio can stay on disk and be referenced from a
+    production, so that they are only held in memory by the processor reading them. Reading
+    the field as an attribute returns the loaded value; the pipeline itself copies, caches and
+    checkpoints the reference.
+    """
+
+    @abstractmethod
+    def load(self) -> Any:
+        "Load the value."
+        raise NotImplementedError
+
+
+class FileValue(LazyValue):
+    """
+    A value stored in a file, read from it each time the field is read.
+
+    Args:
+        path (Union[str, Path]): The file.
+        encoding (Optional[str]): Decode the contents as text with this encoding, or return
+            bytes if None.
+    """
+
+    def __init__(self, path: Union[str, Path], encoding: Optional[str] = None):
+        self.path = Path(path)
+        self.encoding = encoding
+
+    def load(self) -> Union[str, bytes]:
+        if self.encoding is None:
+            return self.path.read_bytes()
+        return self.path.read_text(encoding=self.encoding)
+
+    def __repr__(self):
+        return f"FileValue({str(self.path)!r})"
+
+
+class MappedValue(LazyValue):
+    """
+    A file mapped read-only into memory, for large binary payloads such as audio.
+
+    Reading the field returns a :class:`memoryview` of the file without copying it: the OS
+    pages it in as it is read, and can drop those pages again under memory pressure. The file
+    is mapped on first read and unmapped when the value is garbage collected.
+
+    Args:
+        path (Union[str, Path]): The file.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._map: Optional[mmap.mmap] = None
+
+    def load(self) -> memoryview:
+        if self._map is None:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return memoryview(b"")
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._map = None
+
+    def __repr__(self):
+        return f"MappedValue({str(self.path)!r})"
+
+
+def spill(value: Union[str, bytes], directory: Union[str, Path]) -> LazyValue:
+    """
+    Write a large value to a new file and get a lazy reference to it.
+
+    Text is read back as a :class:`FileValue`, and bytes as a :class:`MappedValue`. The file
+    is not deleted when the reference is; clean up `directory` as its contents expire.
+
+    Args:
+        value (Union[str, bytes]): The value.
+        directory (Union[str, Path]): The directory to write the file to, created if needed.
+
+    Returns:
+        LazyValue: The reference to set on the production instead of `value`.
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    text = isinstance(value, str)
+    fd, path = tempfile.mkstemp(suffix=".txt" if text else ".bin", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(value.encode("utf-8") if text else value)
+    return FileValue(path, encoding="utf-8") if text else MappedValue(path)
 
 
-@dataclass
 class Production:
+    """
+    One document as it passes through a pipeline: the pipeline's inputs and the outputs of
+    each processor, read and written as attributes.
+
+    Fields are kept in a single table with no per-instance ``__dict__`` besides it, and
+    ``vars(production)`` returns that table itself. Fields set to a :class:`LazyValue` are
+    loaded each time they are read as attributes, while ``vars(production)`` holds the
+    unloaded references. Fields no longer needed can be removed with ``del``, as pipelines
+    created with ``release_fields=True`` do once the last stage reading a field has finished.
+    """
+
+    __slots__ = ("_fields",)
 
     def __init__(self, **kwargs) -> None:
-        self.__dict__.update(kwargs)
\ No newline at end of file
+        object.__setattr__(self, "_fields", kwargs)
+
+    @property
+    def __dict__(self) -> Dict[str, Any]:
+        return self._fields
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for names that are not slots or class attributes, i.e. fields.
+        try:
+            value = object.__getattribute__(self, "_fields")[name]
+        except (KeyError, AttributeError):
+            raise AttributeError(f"Production has no field {name!r}") from None
+        if isinstance(value, LazyValue):
+            return value.load()
+        return value
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        self._fields[name] = value
+
+    def __delattr__(self, name: str) -> None:
+        try:
+            del self._fields[name]
+        except KeyError:
+            raise AttributeError(f"Production has no field {name!r}") from None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return self._fields
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        object.__setattr__(self, "_fields", state)
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={_repr.repr(v)}" for k, v in self._fields.items())
+        return f"Production({fields})"
@@ -1,8 +1,4 @@
-from papercast.plugin_utils import load_plugins
-
-_installed_plugins = load_plugins("publishers")
-
-for name, plugin in _installed_plugins.items():
-    globals()[name] = plugin
-
+from papercast.plugin_utils import lazy_plugins
 
+# Plugins are imported when first accessed, e.g. by ``from papercast.publishers import Name``.
+__getattr__, __dir__ = lazy_plugins("publishers", globals())
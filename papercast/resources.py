@@ -0,0 +1,127 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+class ResourcePool:
+    """
+    A limit on how many stages may use a resource at the same time.
+
+    Unlike :class:`asyncio.Semaphore`, a pool can be shared between pipelines running on
+    different event loops and threads, such as synchronous :meth:`papercast.pipelines.Pipeline.run`
+    calls and the server's loop. Waiting stages are granted slots in the order they asked.
+
+    Example:
+        >>> async with pool:
+        ...     await call_grobid()
+
+    Args:
+        limit (int): The maximum number of concurrent holders.
+        name (Optional[str]): A name for log messages and metrics.
+    """
+
+    def __init__(self, limit: int, name: Optional[str] = None):
+        if limit < 1:
+            raise ValueError(f"Expected a limit of at least 1, got {limit}")
+        self.limit = limit
+        self.name = name
+        self._available = limit
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def in_use(self) -> int:
+        return self.limit - self._available
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        "Wait for a slot."
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._available > 0 and not self._waiters:
+                self._available -= 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+
+        future = waiter[1]
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove(waiter)
+                    granted = False
+                except ValueError:
+                    granted = True
+            # A slot handed over before the cancellation landed must be passed on.
+            # If the hand-over is still scheduled, _grant passes it on instead.
+            if granted and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def _grant(self, future: asyncio.Future) -> None:
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self) -> None:
+        "Give a slot back, handing it to the longest waiting stage if there is one."
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                if loop.is_closed():
+                    continue
+                loop.call_soon_threadsafe(self._grant, future)
+                return
+            self._available += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def __repr__(self):
+        return f"ResourcePool(name={self.name!r}, limit={self.limit}, in_use={self.in_use})"
+
+
+_named_pools: Dict[str, ResourcePool] = {}
+_named_pools_lock = threading.Lock()
+
+
+def resource_pool(name: str, limit: Optional[int] = None) -> ResourcePool:
+    """
+    Get the process-wide pool called `name`, creating it if `limit` is given.
+
+    Named pools let processors in different pipelines share one limit, for example on a
+    single GROBID server.
+
+    Args:
+        name (str): The name of the pool.
+        limit (Optional[int]): The limit of a new pool. If the pool exists, it must match.
+
+    Returns:
+        ResourcePool: The pool.
+
+    Raises:
+        KeyError: If the pool does not exist and no limit is given.
+        ValueError: If the pool exists with a different limit.
+    """
+    with _named_pools_lock:
+        pool = _named_pools.get(name)
+        if pool is None:
+            if limit is None:
+                raise KeyError(f"No resource pool named {name}; pass a limit to create it")
+            pool = _named_pools[name] = ResourcePool(limit, name=name)
+        elif limit is not None and limit != pool.limit:
+            raise ValueError(
+                f"Resource pool {name} already exists with limit {pool.limit}, not {limit}"
+            )
+        return pool
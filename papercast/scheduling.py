@@ -0,0 +1,215 @@
+"""
+Priority classes and fair scheduling of documents across the pipelines of a server.
+"""
+import asyncio
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple, Union
+
+PRIORITIES = {"interactive": 0, "normal": 1, "bulk": 2}
+"""
+The priority classes, by name. Documents of a lower class run first, such as interactive
+submissions ahead of backfills.
+"""
+
+DEFAULT_PRIORITY = "normal"
+
+Priority = Union[int, str]
+
+
+def priority_level(priority: Optional[Priority]) -> int:
+    """
+    Get the level of a priority class: its number in :data:`PRIORITIES`, lower first.
+
+    Args:
+        priority (Optional[Priority]): A class name, a level, or None for the default class.
+
+    Raises:
+        ValueError: If `priority` is not a class name or level.
+    """
+    if priority is None:
+        priority = DEFAULT_PRIORITY
+    if isinstance(priority, str) and priority in PRIORITIES:
+        return PRIORITIES[priority]
+    if isinstance(priority, int) and not isinstance(priority, bool):
+        if priority in PRIORITIES.values():
+            return priority
+    raise ValueError(f"Unknown priority {priority!r}, expected one of {list(PRIORITIES)}")
+
+
+def effective_level(level: int, waited: float, aging: Optional[float]) -> int:
+    "The level of an item after waiting `waited` seconds: one class higher per `aging` seconds."
+    if not aging:
+        return level
+    return max(0, level - int(waited // aging))
+
+
+class PriorityItems:
+    """
+    Items waiting to run, taken in order of priority class and then of submission.
+
+    Items that have waited are promoted one class every `aging` seconds, so that low priority
+    items still run while higher priority ones keep arriving. Each class is kept in submission
+    order, so only the oldest item of each class is a candidate and taking an item is O(1).
+
+    Args:
+        aging (Optional[float]): Seconds of waiting per class of promotion, or None for no aging.
+    """
+
+    def __init__(self, aging: Optional[float] = 60.0):
+        self.aging = aging
+        self._levels: Dict[int, Deque[Tuple[int, float, Any]]] = {
+            level: deque() for level in sorted(set(PRIORITIES.values()))
+        }
+        self._sequence = itertools.count()
+
+    def push(self, item: Any, level: int) -> None:
+        self._levels[level].append((next(self._sequence), time.monotonic(), item))
+
+    def _next(self, now: Optional[float]) -> Optional[Tuple[Tuple[int, int], int]]:
+        now = time.monotonic() if now is None else now
+        best = None
+        for level, items in self._levels.items():
+            if items:
+                sequence, submitted, _ = items[0]
+                key = (effective_level(level, now - submitted, self.aging), sequence)
+                if best is None or key < best[0]:
+                    best = (key, level)
+        return best
+
+    def head(self, now: Optional[float] = None) -> Optional[Tuple[int, int]]:
+        """
+        The sort key of the item that would be taken next, or None if there are none.
+
+        Returns:
+            Optional[Tuple[int, int]]: Its effective level and submission sequence number.
+        """
+        best = self._next(now)
+        return None if best is None else best[0]
+
+    def pop(self, now: Optional[float] = None) -> Any:
+        "Take the next item."
+        best = self._next(now)
+        if best is None:
+            raise IndexError("pop from empty PriorityItems")
+        return self._levels[best[1]].popleft()[2]
+
+    def clear(self) -> List[Any]:
+        "Remove every item, and get them."
+        items = [item for level in self._levels.values() for _, _, item in level]
+        for level in self._levels.values():
+            level.clear()
+        return items
+
+    def __len__(self):
+        return sum(len(items) for items in self._levels.values())
+
+
+class FairScheduler:
+    """
+    Shares a number of worker slots between flows of work, such as the pipelines of a server.
+
+    Work waits for a slot with :meth:`slot`. When a slot is free, the waiting work of the
+    highest priority class goes first, with the promotion of :class:`PriorityItems` for work
+    that has waited. Within a class, flows get slots in proportion to their weights (weighted
+    fair queuing): each flow has a virtual time that advances by ``1 / weight`` for every
+    slot it gets, and the flow furthest behind goes next. A flow that was idle starts at the
+    current virtual time, so it cannot save up turns.
+
+    Must be used from a single event loop.
+
+    Args:
+        workers (int): The number of slots.
+        weights (Optional[Dict[str, float]]): The weight of each flow, by name. Defaults to 1.
+        aging (Optional[float]): Seconds of waiting per class of promotion, or None for no aging.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        weights: Optional[Dict[str, float]] = None,
+        aging: Optional[float] = 60.0,
+    ):
+        if workers < 1:
+            raise ValueError(f"Expected at least one worker, got {workers}")
+        for flow, weight in (weights or {}).items():
+            if weight <= 0:
+                raise ValueError(f"Expected a positive weight for {flow}, got {weight}")
+        self.workers = workers
+        self.weights = dict(weights or {})
+        self.aging = aging
+        self.in_use = 0
+        self.granted: Dict[str, int] = {}
+        self._waiting: Dict[str, PriorityItems] = {}
+        self._virtual_time: Dict[str, float] = {}
+        self._now = 0.0
+
+    @property
+    def waiting(self) -> int:
+        "The number of work items waiting for a slot."
+        return sum(len(items) for items in self._waiting.values())
+
+    def _start_tag(self, flow: str) -> float:
+        return max(self._virtual_time.get(flow, 0.0), self._now)
+
+    def _grant(self, flow: str) -> None:
+        start = self._start_tag(flow)
+        self._now = start
+        self._virtual_time[flow] = start + 1 / self.weights.get(flow, 1.0)
+        self.granted[flow] = self.granted.get(flow, 0) + 1
+        self.in_use += 1
+
+    def _dispatch(self) -> None:
+        "Hand free slots to the waiting work that goes next."
+        now = time.monotonic()
+        while self.in_use < self.workers:
+            best = None
+            for flow, items in self._waiting.items():
+                head = items.head(now)
+                if head is None:
+                    continue
+                level, sequence = head
+                key = (level, self._start_tag(flow), sequence)
+                if best is None or key < best[0]:
+                    best = (key, flow)
+            if best is None:
+                return
+            flow = best[1]
+            waiter: asyncio.Future = self._waiting[flow].pop(now)
+            if waiter.done():
+                # Cancelled while waiting.
+                continue
+            self._grant(flow)
+            waiter.set_result(None)
+
+    def _release(self) -> None:
+        self.in_use -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, flow: str, priority: Optional[Priority] = None) -> AsyncIterator[None]:
+        """
+        Wait for a slot for work of `flow` in the class `priority`, and hold it.
+
+        Raises:
+            ValueError: If `priority` is not a priority class.
+        """
+        level = priority_level(priority)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(flow, PriorityItems(self.aging)).push(waiter, level)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as it was cancelled: give the slot to the next in line.
+                self._release()
+            else:
+                waiter.cancel()
+            raise
+        try:
+            yield
+        finally:
+            self._release()
@@ -1,29 +1,196 @@
-from fastapi import FastAPI, Body
-from typing import Dict, Any
+from fastapi import FastAPI, Body, Depends, Header, Request
+from fastapi.responses import FileResponse, Response
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union
 from papercast.pipelines import Pipeline
+from papercast.production import Production
+from papercast.jobs import Job, JobStatus, JobStore, QueueFullError, WorkQueue
+from papercast.journal import JobJournal
+from papercast.metrics import CONTENT_TYPE, ServerMetrics
+from papercast.scheduling import DEFAULT_PRIORITY, PRIORITIES, FairScheduler
+from papercast.workers import JobUpdate, SharedQueue, WorkerPool
+from papercast.distributed import ArtifactStore, encode_inputs
 from fastapi import HTTPException, APIRouter
 import uvicorn
 import asyncio
+import hmac
+import os
+import tempfile
+import time
+import uuid
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
 from loguru import logger
 
 
 class Server:
-    def __init__(self, pipelines: Dict[str, Pipeline]):
+    def __init__(
+        self,
+        pipelines: Dict[str, Pipeline],
+        max_queue_size: int = 100,
+        workers: Union[int, Dict[str, int]] = 2,
+        retry_after: int = 5,
+        shutdown_timeout: Optional[float] = 300,
+        jobs: Optional[JobStore] = None,
+        max_batch_size: int = 50,
+        journal: Optional[JobJournal] = None,
+        max_workers: Optional[int] = None,
+        weights: Optional[Dict[str, float]] = None,
+        aging: Optional[float] = 60,
+        processes: int = 0,
+        queue_path: Optional[str] = None,
+        remote_workers: bool = False,
+        lease_timeout: float = 60,
+        artifacts_dir: Optional[str] = None,
+        worker_token: Optional[str] = None,
+        input_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            pipelines (Dict[str, Pipeline]): The pipelines served, by name.
+            max_queue_size (int): The maximum number of documents waiting per pipeline.
+                Further submissions are rejected with HTTP 429.
+            workers (Union[int, Dict[str, int]]): The number of documents processed concurrently
+                per pipeline, either for all pipelines or by pipeline name.
+            retry_after (int): The number of seconds sent in the Retry-After header when a
+                queue is full.
+            shutdown_timeout (Optional[float]): The maximum number of seconds to wait for
+                queued and in-flight documents on shutdown.
+            jobs (Optional[JobStore]): The store that keeps track of submitted documents.
+            max_batch_size (int): Documents submitted to ``/add_batch`` are split into batches
+                of at most this many, each taking one place in the queue.
+            journal (Optional[papercast.journal.JobJournal]): Records submissions and finished
+                stages, so that unfinished jobs resume when the server restarts.
+            max_workers (Optional[int]): The number of documents processed concurrently across
+                all pipelines, from submissions and subscribers. Defaults to the sum of the
+                pipelines' `workers`.
+            weights (Optional[Dict[str, float]]): The share of `max_workers` each pipeline gets
+                when several have documents waiting, by pipeline name. Defaults to 1.
+            aging (Optional[float]): Seconds a document waits before it is promoted one
+                priority class, so that bulk submissions still progress. None disables aging.
+            processes (int): The number of worker processes that process documents, or 0 to
+                process them in the server process. With worker processes, the server only
+                serves the API and runs the subscribers, and documents are queued for the
+                workers in a SQLite database; see :class:`papercast.workers.WorkerPool`.
+            queue_path (Optional[str]): The database file of the worker processes' queue.
+                Defaults to a file in a new temporary directory.
+            remote_workers (bool): Queue documents for workers on other machines, which lease
+                them over HTTP, as well as for any worker processes; see
+                :func:`papercast.distributed.run_remote_worker`.
+            lease_timeout (float): Seconds without a heartbeat after which the documents of a
+                worker are queued again.
+            artifacts_dir (Optional[str]): Where files exchanged with remote workers are kept,
+                including the outputs of their documents. Defaults to a directory next to
+                `queue_path`.
+            worker_token (Optional[str]): The shared secret remote workers send as a bearer
+                token, required with `remote_workers`. The ``/workers`` and ``/artifacts``
+                endpoints reject requests without it.
+            input_dir (Optional[str]): The directory of the files that inputs ending in
+                ``_path`` may name, to be sent to remote workers. Strings naming files
+                elsewhere are sent as they are, so that clients cannot read the server's files.
+
+        Raises:
+            ValueError: If `journal` is given with `processes` or `remote_workers`, since jobs
+                queued for workers are already durable, or if `remote_workers` is given without
+                `worker_token`.
+        """
         self.logger = logger
         self._pipelines = pipelines
         self._pipeline_tasks = []
-        self.executor = ThreadPoolExecutor()
+        self._queues: Dict[str, WorkQueue] = {}
+        self.max_queue_size = max_queue_size
+        self.workers = workers
+        self.retry_after = retry_after
+        self.shutdown_timeout = shutdown_timeout
+        self.jobs = jobs if jobs is not None else JobStore()
+        self.max_batch_size = max_batch_size
+        self.journal = journal
+        # Journal records are written in order on a thread of their own, off the event loop.
+        self._journal_writer = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="papercast-journal")
+            if journal is not None
+            else None
+        )
+        # The unfinished job of each paper submitted to a pipeline with a deduplicator.
+        self._submitted: Dict[Tuple[str, str], Job] = {}
+        self._identities: Dict[str, Tuple[str, str]] = {}
+        self.aging = aging
+        self.scheduler = FairScheduler(
+            max_workers or sum(self._workers_for(name) for name in pipelines) or 1,
+            weights,
+            aging,
+        )
+        self.lease_timeout = lease_timeout
+        self.poll_interval = 0.2
+        self.pool: Optional[WorkerPool] = None
+        self.shared_queue: Optional[SharedQueue] = None
+        self.artifacts: Optional[ArtifactStore] = None
+        # Registered remote workers, by worker ID.
+        self._remote_workers: Dict[str, Dict[str, Any]] = {}
+        # Jobs waiting in the shared queue by pipeline, as of the last time it was read.
+        self._shared_depths: Dict[str, int] = {}
+        self._worker_token = worker_token
+        self.input_dir = input_dir
+        if processes or remote_workers:
+            if journal is not None:
+                raise ValueError("Worker processes and remote workers cannot be used with a journal")
+            if queue_path is None:
+                queue_path = os.path.join(tempfile.mkdtemp(prefix="papercast-"), "queue.db")
+            if processes:
+                self.pool = WorkerPool(
+                    pipelines,
+                    queue_path,
+                    processes,
+                    poll_interval=self.poll_interval,
+                    heartbeat_interval=lease_timeout / 3,
+                    lease_timeout=lease_timeout,
+                    aging=aging,
+                )
+                self.shared_queue = self.pool.queue
+            else:
+                self.shared_queue = SharedQueue(queue_path, aging)
+        if remote_workers:
+            if not worker_token:
+                raise ValueError("Remote workers require a worker_token")
+            self.artifacts = ArtifactStore(
+                artifacts_dir or os.path.join(os.path.dirname(queue_path), "artifacts")
+            )
+        self.metrics = ServerMetrics()
+        for name, pipeline in pipelines.items():
+            pipeline.instrumentation.add_sink(self.metrics.sink(name))
 
         self.router = APIRouter()
         self.router.add_api_route("/", self._root)
         self.router.add_api_route("/add", self._add, methods=["POST"])
+        self.router.add_api_route("/add_batch", self._add_batch, methods=["POST"])
         self.router.add_api_route("/pipelines", self.serialize_pipelines)
+        self.router.add_api_route("/jobs", self._list_jobs)
+        self.router.add_api_route("/jobs/{job_id}", self._get_job)
+        self.router.add_api_route("/metrics", self._metrics)
+        if remote_workers:
+            workers = APIRouter(dependencies=[Depends(self._check_worker_token)])
+            workers.add_api_route("/workers", self._list_workers)
+            workers.add_api_route("/workers/register", self._register_worker, methods=["POST"])
+            workers.add_api_route(
+                "/workers/{worker_id}/heartbeat", self._worker_heartbeat, methods=["POST"]
+            )
+            workers.add_api_route("/workers/{worker_id}/lease", self._lease_job, methods=["POST"])
+            workers.add_api_route(
+                "/workers/{worker_id}/jobs/{job_id}", self._finish_job, methods=["POST"]
+            )
+            workers.add_api_route(
+                "/artifacts/{digest}", self._get_artifact, methods=["GET", "HEAD"]
+            )
+            workers.add_api_route("/artifacts/{digest}", self._put_artifact, methods=["PUT"])
+            self.router.include_router(workers)
 
         self.app = FastAPI()
         self.app.include_router(self.router)
         self.app.add_event_handler("startup", self.run_pipelines)
         self.app.add_event_handler("shutdown", self._cancel_pipeline_tasks)
+        self.app.add_event_handler("shutdown", self._drain_queues)
+        self.app.add_event_handler("shutdown", self._close_instrumentation)
+        self.app.add_event_handler("shutdown", self._close_journal)
 
     def _root(self):
         return {"message": "Papercast Server"}
@@ -33,35 +200,346 @@ class Server:
             raise HTTPException(status_code=404, detail="Pipeline not found")
         return self._pipelines[pipeline]
 
+    def _workers_for(self, pipeline_name: str) -> int:
+        if isinstance(self.workers, dict):
+            return self.workers.get(pipeline_name, 1)
+        return self.workers
+
+    def _get_queue(self, pipeline_name: str) -> WorkQueue:
+        "Get the work queue of a pipeline, creating it on first use."
+        queue = self._queues.get(pipeline_name)
+        if queue is None:
+            pipeline = self._pipelines[pipeline_name]
+
+            async def run(jobs: List[Job]):
+                checkpoints = [
+                    await self._journal_call(self.journal.checkpoint, job.id)
+                    if self.journal
+                    else None
+                    for job in jobs
+                ]
+                if len(jobs) == 1:
+                    job = jobs[0]
+                    return [
+                        await pipeline.arun(
+                            on_stage=job.on_stage, checkpoint=checkpoints[0], **job.inputs
+                        )
+                    ]
+                return await pipeline.arun_many(
+                    [job.inputs for job in jobs],
+                    on_stage=[job.on_stage for job in jobs],
+                    checkpoints=checkpoints,
+                )
+
+            async def handle(jobs: List[Job]):
+                for job in jobs:
+                    job.start()
+                    if self.journal:
+                        self._journal_call(self.journal.record_started, job)
+                self.metrics.jobs_started(pipeline_name, len(jobs))
+                try:
+                    reports = await run(jobs)
+                except Exception as e:
+                    for job in jobs:
+                        job.fail(e)
+                        self._job_finished(job)
+                    raise
+                for job, report in zip(jobs, reports):
+                    if report.error is not None:
+                        job.fail(report.error)
+                    else:
+                        job.succeed(report.production)
+                    self._job_finished(job)
+
+            queue = WorkQueue(
+                pipeline_name,
+                handle,
+                max_size=self.max_queue_size,
+                workers=self._workers_for(pipeline_name),
+                aging=self.aging,
+                scheduler=self.scheduler,
+            )
+            self._queues[pipeline_name] = queue
+        return queue
+
+    def _job_finished(self, job: Job) -> None:
+        key = self._identities.pop(job.id, None)
+        if key is not None and self._submitted.get(key) is job:
+            del self._submitted[key]
+        self.metrics.job_finished(job.pipeline, job.status == JobStatus.DONE)
+        if self.journal:
+            self._journal_call(self.journal.record_finished, job)
+
+    def _journal_call(self, method: Callable[..., Any], *args) -> "asyncio.Future[Any]":
+        """
+        Call a method of the journal on its writer thread, after the calls made before it.
+
+        The call is made whether or not the returned future is awaited. Failures are logged,
+        since records that are not awaited have no caller to report them to.
+        """
+        future = asyncio.wrap_future(self._journal_writer.submit(method, *args))
+        future.add_done_callback(self._journal_call_done)
+        return future
+
+    def _journal_call_done(self, future: "asyncio.Future[Any]") -> None:
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.opt(exception=future.exception()).error("Failed to write to the journal")
+
+    async def _flush_journal(self) -> None:
+        "Wait for the journal records written so far."
+        if self.journal:
+            await self._journal_call(lambda: None)
+
     async def _add(
         self,
         data: Dict[Any, Any] = Body(...),
     ):
         "Add a document to a pipeline."
+        pipeline_name = self._pop_pipeline_name(data)
+        priority = self._pop_priority(data)
+        [(identity, published)] = await self._identify(pipeline_name, [data])
+        duplicate = self._find_duplicate(pipeline_name, data, identity, published)
+        if duplicate is not None:
+            return {
+                "message": "Document already submitted or published",
+                "job_id": duplicate.id,
+                "duplicate": True,
+            }
+        self.logger.info(f"Adding document to pipeline {pipeline_name}")
+
+        job = Job(pipeline=pipeline_name, inputs=data, priority=priority)
+        self._submit(pipeline_name, [[job]], {job.id: identity})
+        # Accepted documents are journaled before the response.
+        await self._flush_journal()
+
+        return {"message": "Document(s) added to pipeline", "job_id": job.id}
+
+    async def _add_batch(
+        self,
+        data: Dict[Any, Any] = Body(...),
+    ):
+        """
+        Add several documents to a pipeline.
+
+        The body has a ``documents`` list with the inputs of each document. Other keys, except
+        ``pipeline``, are options shared by every document.
+        """
+        pipeline_name = self._pop_pipeline_name(data)
+        priority = self._pop_priority(data)
+        documents = data.pop("documents", None)
+        if not isinstance(documents, list) or not documents:
+            raise HTTPException(
+                status_code=400, detail="Expected a non-empty list of documents"
+            )
+
+        pipeline = self._pipelines[pipeline_name]
+        for i, document in enumerate(documents):
+            try:
+                pipeline._validate_run_kwargs({**document, **data})
+            except Exception as e:
+                raise HTTPException(
+                    status_code=400, detail=f"Invalid document {i}: {e}"
+                )
+        self.logger.info(
+            f"Adding {len(documents)} documents to pipeline {pipeline_name}"
+        )
+
+        jobs = []
+        new_jobs = []
+        identities: Dict[str, Optional[str]] = {}
+        in_batch: Dict[str, Job] = {}
+        documents = [{**document, **data} for document in documents]
+        found = await self._identify(pipeline_name, documents)
+        for inputs, (identity, published) in zip(documents, found):
+            job = self._find_duplicate(pipeline_name, inputs, identity, published)
+            if job is None and identity is not None:
+                job = in_batch.get(identity)
+            if job is None:
+                job = Job(pipeline=pipeline_name, inputs=inputs, priority=priority)
+                new_jobs.append(job)
+                identities[job.id] = identity
+                if identity is not None:
+                    in_batch[identity] = job
+            jobs.append(job)
+        batches = [
+            new_jobs[i : i + self.max_batch_size]
+            for i in range(0, len(new_jobs), self.max_batch_size)
+        ]
+        if batches:
+            self._submit(pipeline_name, batches, identities)
+            await self._flush_journal()
+
+        return {
+            "message": "Document(s) added to pipeline",
+            "job_ids": [job.id for job in jobs],
+            "duplicates": len(jobs) - len(new_jobs),
+        }
+
+    async def _identify(
+        self, pipeline_name: str, documents: List[Dict[str, Any]]
+    ) -> List[Tuple[Optional[str], bool]]:
+        """
+        Identify the papers of documents, if the pipeline deduplicates.
+
+        Identities may hash the documents' files and the published papers are in a database,
+        so both are looked up on a thread.
+
+        Returns:
+            List[Tuple[Optional[str], bool]]: For each document, the identity of its paper, or
+            None if it is not deduplicated, and whether the paper was published within the
+            deduplicator's window.
+        """
+        dedup = self._pipelines[pipeline_name].dedup
+        if dedup is None:
+            return [(None, False)] * len(documents)
+
+        def identify() -> List[Tuple[Optional[str], bool]]:
+            found = []
+            for inputs in documents:
+                identity = dedup.identity(inputs)
+                found.append((identity, identity is not None and dedup.published(identity)))
+            return found
+
+        return await asyncio.get_running_loop().run_in_executor(None, identify)
+
+    def _find_duplicate(
+        self,
+        pipeline_name: str,
+        inputs: Dict[str, Any],
+        identity: Optional[str],
+        published: bool,
+    ) -> Optional[Job]:
+        """
+        Find the job of an earlier submission of the same paper, as identified by
+        :meth:`_identify`.
+
+        A paper that is queued or running gets the job of that submission. A paper that was
+        published within the deduplicator's window gets a new job that is already done. This
+        runs on the event loop in the same step that queues new jobs, so that a paper
+        submitted twice at once gets a single job.
+
+        Returns:
+            Optional[Job]: The job of the earlier submission, or None if there is none.
+        """
+        if identity is None:
+            return None
+        dedup = self._pipelines[pipeline_name].dedup
+        job = self._submitted.get((pipeline_name, identity))
+        if job is not None:
+            dedup.coalesced += 1
+            return job
+        if published:
+            dedup.skipped += 1
+            job = Job(pipeline=pipeline_name, inputs=inputs)
+            job.succeed(Production())
+            self.jobs.add(job)
+            return job
+        return None
+
+    def _pop_pipeline_name(self, data: Dict[Any, Any]) -> str:
+        "Remove the pipeline name from a request body, falling back to the default pipeline."
         if "pipeline" in data:
-            pipeline = self._get_pipeline(data["pipeline"])  # type: Pipeline
-        elif "default" in self._pipelines.keys():
-            pipeline = self._get_pipeline("default")
-        else:
+            pipeline_name = data.pop("pipeline")
+            self._get_pipeline(pipeline_name)
+            return pipeline_name
+        if "default" in self._pipelines.keys():
+            return "default"
+        raise HTTPException(
+            status_code=400,
+            detail="Pipeline not specified and no default pipeline found",
+        )
+
+    @staticmethod
+    def _pop_priority(data: Dict[Any, Any]) -> str:
+        "Remove the priority class from a request body, falling back to the default class."
+        priority = data.pop("priority", DEFAULT_PRIORITY)
+        if priority not in PRIORITIES:
             raise HTTPException(
                 status_code=400,
-                detail="Pipeline not specified and no default pipeline found",
+                detail=f"Unknown priority {priority!r}, expected one of {list(PRIORITIES)}",
             )
+        return priority
 
-        loop = asyncio.get_running_loop()
+    def _submit(
+        self,
+        pipeline_name: str,
+        batches: List[List[Job]],
+        identities: Optional[Dict[str, Optional[str]]] = None,
+    ) -> None:
+        """
+        Queue batches of jobs, or reject them all with HTTP 429 if the queue is full.
 
-        data.pop("pipeline", None)
-        self.logger.info(f"Adding document to pipeline {pipeline.name}")
+        Jobs are remembered by the identities of their papers, given by job ID, until they
+        finish, so that later submissions of the same papers get the same jobs.
+        """
+        try:
+            self._enqueue(pipeline_name, batches)
+        except QueueFullError as e:
+            raise HTTPException(
+                status_code=429,
+                detail=str(e),
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self._track(pipeline_name, batches, identities)
 
-        async def run_pipeline():
-            def _run():
-                pipeline.run(**data)
+    def _enqueue(
+        self, pipeline_name: str, batches: List[List[Job]], start: Optional[str] = None
+    ) -> None:
+        """
+        Queue batches of jobs, on the pipeline's work queue or for the worker processes.
+
+        Worker processes take jobs one at a time, so batches are split up for them.
+
+        Raises:
+            QueueFullError: If the queue does not have room for every batch.
+        """
+        if self.shared_queue is not None:
+            self.shared_queue.submit(
+                [job for batch in batches for job in batch], start, self.max_queue_size
+            )
+        else:
+            self._get_queue(pipeline_name).submit_many(batches, batches[0][0].priority)
+
+    def _track(
+        self,
+        pipeline_name: str,
+        batches: List[List[Job]],
+        identities: Optional[Dict[str, Optional[str]]] = None,
+    ) -> None:
+        "Keep track of queued jobs."
+        identities = identities or {}
+        for batch in batches:
+            for job in batch:
+                self.jobs.add(job)
+                identity = identities.get(job.id)
+                if identity is not None:
+                    key = (pipeline_name, identity)
+                    self._submitted[key] = job
+                    self._identities[job.id] = key
+        if self.journal:
+            self._journal_call(
+                self.journal.record_submitted, [job for batch in batches for job in batch]
+            )
 
-            await loop.run_in_executor(self.executor, _run)
+    # Handlers that read the jobs and queues are async, so that FastAPI runs them on the event
+    # loop that updates them rather than on its thread pool.
+    async def _get_job(self, job_id: str):
+        "Get the status of a submitted document."
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job.asdict()
 
-        asyncio.create_task(run_pipeline())
+    async def _list_jobs(self, status: Optional[JobStatus] = None):
+        "List submitted documents, optionally filtered by status."
+        return {"jobs": [job.asdict() for job in self.jobs.list(status)]}
 
-        return {"message": "Document(s) added to pipeline"}
+    async def _metrics(self):
+        "Queue, job, executor, cache and processor metrics in the Prometheus text format."
+        return Response(
+            self.metrics.render(self._pipelines, self._queues, self._shared_depths),
+            media_type=CONTENT_TYPE,
+        )
 
     def serialize_pipelines(self):
         def serialize_pipeline(pipeline: Pipeline):
@@ -86,10 +564,332 @@ class Server:
             except asyncio.CancelledError:
                 pass
 
+    async def _drain_queues(self):
+        "Wait for queued and in-flight documents to finish, up to `shutdown_timeout`."
+        await asyncio.gather(
+            *[queue.drain(self.shutdown_timeout) for queue in self._queues.values()]
+        )
+        if self.shared_queue is not None:
+            await self._drain_shared_queue()
+        await self._flush_journal()
+
+    async def _drain_shared_queue(self):
+        "Wait for the workers to finish the queued jobs, then stop the worker processes."
+        loop = asyncio.get_running_loop()
+        deadline = (
+            None if self.shutdown_timeout is None else time.monotonic() + self.shutdown_timeout
+        )
+        while self._workers_available():
+            pending = await loop.run_in_executor(None, self.shared_queue.pending)
+            if not pending:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                self.logger.warning(
+                    f"Leaving {pending} jobs to the workers after {self.shutdown_timeout}s"
+                )
+                break
+            await self._follow_shared_queue_once()
+            await asyncio.sleep(self.poll_interval)
+        await self._follow_shared_queue_once()
+        if self.pool is not None:
+            await loop.run_in_executor(None, self.pool.stop)
+
+    def _workers_available(self) -> bool:
+        "Whether any worker process is running or remote worker is registered."
+        return (self.pool is not None and self.pool.running) or bool(self._remote_workers)
+
+    def _poll_shared_queue(self) -> Tuple[List[JobUpdate], Dict[str, int]]:
+        """
+        Queue again the jobs of remote workers that stopped sending heartbeats, and read the
+        progress of the jobs run by workers and the depth of the queue.
+
+        Runs on a thread, since the queue's transactions wait for the workers' ones.
+        """
+        if self.artifacts is not None:
+            # Worker processes are watched by their supervisor, remote workers by their heartbeats.
+            self.shared_queue.requeue_expired(self.lease_timeout)
+        return self.shared_queue.updates(), self.shared_queue.depths()
+
+    async def _follow_shared_queue_once(self):
+        """
+        Apply the progress of the jobs run by workers.
+
+        Jobs are queued and tracked in one step on the event loop, so a job in the updates
+        read on the thread is always tracked by the time they are applied here.
+        """
+        loop = asyncio.get_running_loop()
+        updates, self._shared_depths = await loop.run_in_executor(
+            None, self._poll_shared_queue
+        )
+        for update in updates:
+            self._apply_update(update)
+        if self.artifacts is None:
+            return
+        expired = time.time() - self.lease_timeout
+        for worker_id, worker in list(self._remote_workers.items()):
+            if worker["last_seen"] < expired:
+                self.logger.warning(f"Remote worker {worker_id} stopped sending heartbeats")
+                del self._remote_workers[worker_id]
+
+    def _apply_update(self, update: JobUpdate) -> None:
+        job = self.jobs.get(update.id)
+        if job is None:
+            # Submitted before the server restarted, or evicted from the job store.
+            return
+        if job.status == JobStatus.QUEUED:
+            job.start()
+            self.metrics.jobs_started(job.pipeline)
+        if update.status == JobStatus.RUNNING:
+            return
+        job.timings.update(update.timings)
+        if update.status == JobStatus.DONE:
+            job.succeed(Production(**{k: Path(v) for k, v in update.outputs.items()}))
+            key = self._identities.get(job.id)
+            if key is not None:
+                # Workers do not deduplicate, so the paper is recorded as published here.
+                self._pipelines[job.pipeline].dedup.store.add(key[1])
+        else:
+            job.fail(update.error or "Failed in a worker process")
+        self._job_finished(job)
+
+    async def _follow_shared_queue(self):
+        "Apply the progress of the jobs run by workers, as long as the server runs."
+        while True:
+            await self._follow_shared_queue_once()
+            await asyncio.sleep(self.poll_interval)
+
+    async def _submit_subscribed(
+        self, pipeline_name: str, subscriber_name: str, production: Production
+    ):
+        "Queue a subscriber's production for the worker processes, waiting for room."
+        inputs = dict(vars(production))
+        [(identity, published)] = await self._identify(pipeline_name, [inputs])
+        duplicate = self._find_duplicate(pipeline_name, inputs, identity, published)
+        if duplicate is not None:
+            return
+        subscriber = self._pipelines[pipeline_name].subscribers[subscriber_name]
+        job = Job(
+            pipeline=pipeline_name,
+            inputs=inputs,
+            priority=getattr(subscriber, "priority", None) or DEFAULT_PRIORITY,
+        )
+        while True:
+            try:
+                self._enqueue(pipeline_name, [[job]], subscriber_name)
+                break
+            except QueueFullError:
+                await asyncio.sleep(self.poll_interval)
+        self._track(pipeline_name, [[job]], {job.id: identity})
+
+    def _check_worker_token(self, authorization: Optional[str] = Header(None)):
+        "Reject requests to the remote worker endpoints without the worker token."
+        expected = f"Bearer {self._worker_token}"
+        if authorization is None or not hmac.compare_digest(
+            authorization.encode(), expected.encode()
+        ):
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid worker token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+    # The remote worker handlers are async too, so that the registered workers are only read
+    # and changed on the event loop, which also reaps them. Only the queue and artifact I/O
+    # runs on threads.
+    async def _list_workers(self):
+        "List the registered remote workers."
+        return {
+            "workers": [
+                {"id": worker_id, **worker} for worker_id, worker in self._remote_workers.items()
+            ]
+        }
+
+    async def _register_worker(self, data: Dict[Any, Any] = Body(...)):
+        """
+        Register a remote worker.
+
+        The body may have a ``name``, the ``pipelines`` the worker runs, and the ``worker_id``
+        of a worker registering again.
+        """
+        pipelines = data.get("pipelines")
+        if pipelines is not None:
+            unknown = set(pipelines) - set(self._pipelines)
+            if unknown:
+                raise HTTPException(
+                    status_code=400, detail=f"Unknown pipelines {sorted(unknown)}"
+                )
+        worker_id = data.get("worker_id") or uuid.uuid4().hex[:12]
+        self._remote_workers[worker_id] = {
+            "name": data.get("name") or worker_id,
+            "pipelines": pipelines,
+            "registered_at": time.time(),
+            "last_seen": time.time(),
+        }
+        self.logger.info(f"Registered remote worker {worker_id}")
+        return {
+            "worker_id": worker_id,
+            "heartbeat_interval": self.lease_timeout / 3,
+            "lease_timeout": self.lease_timeout,
+        }
+
+    def _seen_worker(self, worker_id: str) -> Dict[str, Any]:
+        worker = self._remote_workers.get(worker_id)
+        if worker is None:
+            raise HTTPException(status_code=404, detail="Worker not registered")
+        worker["last_seen"] = time.time()
+        return worker
+
+    async def _worker_heartbeat(self, worker_id: str):
+        "Renew the leases of a remote worker."
+        self._seen_worker(worker_id)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.shared_queue.heartbeat, worker_id)
+        return {"message": "ok"}
+
+    async def _lease_job(self, worker_id: str):
+        """
+        Lease the next job to a remote worker.
+
+        Responds with ``{"job": null}`` if no job is waiting. Jobs whose inputs cannot be sent
+        to a remote worker fail.
+        """
+        worker = self._seen_worker(worker_id)
+        loop = asyncio.get_running_loop()
+        job = await loop.run_in_executor(
+            None, self._claim_for_remote, worker_id, worker["pipelines"]
+        )
+        return {"job": job}
+
+    def _claim_for_remote(
+        self, worker_id: str, pipelines: Optional[List[str]]
+    ) -> Optional[Dict[str, Any]]:
+        "Claim the next job that can be sent to a remote worker, with its files stored."
+        while True:
+            job = self.shared_queue.claim(worker_id, pipelines=pipelines)
+            if job is None:
+                return None
+            try:
+                inputs = encode_inputs(job.inputs, self.artifacts, self.input_dir)
+            except (ValueError, OSError) as e:
+                self.shared_queue.finish(job.id, worker_id, error=f"{type(e).__name__}: {e}")
+                continue
+            return {
+                "id": job.id,
+                "pipeline": job.pipeline,
+                "start": job.start,
+                "inputs": inputs,
+                "attempts": job.attempts,
+            }
+
+    async def _finish_job(self, worker_id: str, job_id: str, data: Dict[Any, Any] = Body(...)):
+        """
+        Record the result of a job leased to a remote worker.
+
+        The body has the ``outputs``, as the ``digest`` and ``name`` of each file uploaded to
+        ``/artifacts``, the ``timings`` of the stages and the ``error``, if the job failed.
+        Responds with ``"accepted": false`` if the job's lease had expired.
+        """
+        self._seen_worker(worker_id)
+        loop = asyncio.get_running_loop()
+        accepted = await loop.run_in_executor(
+            None, self._finish_for_remote, worker_id, job_id, data
+        )
+        return {"accepted": accepted}
+
+    def _finish_for_remote(self, worker_id: str, job_id: str, data: Dict[Any, Any]) -> bool:
+        "Record the result of a remote worker's job, with its outputs in the artifact store."
+        outputs = {}
+        for key, artifact in (data.get("outputs") or {}).items():
+            try:
+                path = self.artifacts.path(artifact["digest"])
+            except (KeyError, TypeError, ValueError):
+                path = None
+            if path is None:
+                raise HTTPException(status_code=400, detail=f"Output {key} was not uploaded")
+            outputs[key] = str(path)
+        return self.shared_queue.finish(
+            job_id, worker_id, outputs, data.get("timings"), data.get("error")
+        )
+
+    def _artifact_path(self, digest: str) -> Optional[Path]:
+        try:
+            return self.artifacts.path(digest)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def _get_artifact(self, digest: str):
+        "Download a file by the SHA-256 digest of its contents."
+        path = self._artifact_path(digest)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Artifact not found")
+        return FileResponse(path, filename=path.name)
+
+    async def _put_artifact(self, digest: str, request: Request, name: str = ""):
+        "Upload a file by the SHA-256 digest of its contents, for use as an output."
+        self._artifact_path(digest)
+        loop = asyncio.get_running_loop()
+        # Small files are buffered in memory, larger ones on disk.
+        with tempfile.SpooledTemporaryFile(max_size=8 << 20) as body:
+            async for chunk in request.stream():
+                body.write(chunk)
+            body.seek(0)
+            chunks = iter(lambda: body.read(1 << 20), b"")
+            try:
+                path = await loop.run_in_executor(
+                    None, self.artifacts.write, digest, name or digest, chunks
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        return {"digest": digest, "name": path.name}
+
+    def _close_instrumentation(self):
+        "Flush and close the instrumentation sinks of every pipeline."
+        for pipeline in self._pipelines.values():
+            pipeline.instrumentation.close()
+
+    def _close_journal(self):
+        if self.journal:
+            self._journal_writer.shutdown(wait=True)
+            self.journal.close()
+
+    async def _replay_journal(self):
+        "Submit the jobs left unfinished in the journal again, waiting for room in the queues."
+        self._journal_call(self.journal.prune)
+        for job in await self._journal_call(self.journal.unfinished):
+            self.jobs.add(job)
+            if job.pipeline not in self._pipelines:
+                job.fail(KeyError(f"Pipeline {job.pipeline} is no longer served"))
+                self._journal_call(self.journal.record_finished, job)
+                continue
+            self.logger.info(f"Resuming job {job.id} in pipeline {job.pipeline}")
+            await self._get_queue(job.pipeline).put([job], job.priority)
+
     async def run_pipelines(self):
         self.logger.info("Running pipelines")
-        for pipeline in self._pipelines.values():
-            task = asyncio.create_task(pipeline._run_in_server())
+        if self.shared_queue is not None:
+            if self.pool is not None:
+                # Fork the workers before the pipelines start any threads.
+                self.pool.start()
+            self._pipeline_tasks.append(asyncio.create_task(self._follow_shared_queue()))
+            for name, pipeline in self._pipelines.items():
+                task = asyncio.create_task(
+                    pipeline._run_in_server(submit=partial(self._submit_subscribed, name))
+                )
+                self._pipeline_tasks.append(task)
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *[
+                loop.run_in_executor(None, pipeline.warm_up)
+                for pipeline in self._pipelines.values()
+            ]
+        )
+        if self.journal:
+            self._pipeline_tasks.append(asyncio.create_task(self._replay_journal()))
+        for name, pipeline in self._pipelines.items():
+            task = asyncio.create_task(
+                pipeline._run_in_server(slot=partial(self.scheduler.slot, name))
+            )
             self._pipeline_tasks.append(task)
 
     def run(self, host: str = "", port: int = 8000):
@@ -0,0 +1,116 @@
+"""
+Fields whose values arrive in chunks, so that downstream stages can start on the first chunk
+while later ones are still being produced.
+"""
+import asyncio
+from functools import partial
+from typing import Any, AsyncIterator, Callable, List, Optional
+
+from papercast.production import Production
+from papercast.types import MP3File
+
+_UNJOINED = object()
+
+
+def join_chunks(chunks: List[Any], separator: str = "") -> Any:
+    """
+    Join the chunks of a stream into one value, for stages that do not process chunks.
+
+    Strings are joined with `separator`, bytes are concatenated, and MP3 files are joined
+    into one with :meth:`papercast.types.MP3File.concat`; other chunks are returned as a list.
+    """
+    if chunks and all(isinstance(chunk, str) for chunk in chunks):
+        return separator.join(chunks)
+    if chunks and all(isinstance(chunk, (bytes, bytearray)) for chunk in chunks):
+        return b"".join(chunks)
+    if chunks and all(isinstance(chunk, MP3File) for chunk in chunks):
+        return MP3File.concat(chunks)
+    return list(chunks)
+
+
+class Stream:
+    """
+    A production field whose value arrives in chunks, such as the sections of a paper.
+
+    Pipelines create streams for the outputs of processors that yield their results in chunks
+    (see :mod:`papercast.pipelines`). A stream can be read by several stages: each iteration
+    starts at the first chunk and waits for chunks that have not arrived yet. Chunks are kept
+    until the stream is no longer referenced.
+
+    Args:
+        join (Optional[Callable[[List[Any]], Any]]): Joins the chunks into one value for stages
+            that read the field whole. Defaults to :func:`join_chunks`.
+        separator (str): The separator :func:`join_chunks` puts between string chunks, such
+            as a blank line between chunks of paragraphs.
+    """
+
+    def __init__(
+        self, join: Optional[Callable[[List[Any]], Any]] = None, separator: str = ""
+    ):
+        self.chunks: List[Any] = []
+        self.closed = False
+        self.error: Optional[BaseException] = None
+        self.separator = separator
+        self._join = join or partial(join_chunks, separator=separator)
+        # The joined value, computed once for all the stages reading the field whole.
+        self._value: Any = _UNJOINED
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        # Wake the readers waiting on the current event, and give later readers a fresh one.
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def put(self, chunk: Any) -> None:
+        "Append a chunk. Must be called on the event loop the stream is read on."
+        if self.closed:
+            raise ValueError("Cannot add chunks to a closed stream")
+        self.chunks.append(chunk)
+        self._notify()
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        "Mark the stream as complete, or as failed with `error`, which readers then raise."
+        self.closed = True
+        self.error = error
+        self._notify()
+
+    async def _iterate(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            if index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            elif self.closed:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self._iterate()
+
+    async def join(self) -> Any:
+        "Wait for the stream to complete and join its chunks."
+        async for _ in self:
+            pass
+        return self.joined()
+
+    def joined(self) -> Any:
+        "Join the chunks of a complete stream."
+        if not self.closed:
+            raise ValueError("Cannot join a stream that is still open")
+        if self.error is not None:
+            raise self.error
+        if self._value is _UNJOINED:
+            self._value = self._join(self.chunks)
+        return self._value
+
+    def __repr__(self):
+        state = "failed" if self.error else "closed" if self.closed else "open"
+        return f"Stream({len(self.chunks)} chunks, {state})"
+
+
+def has_streams(production: Production) -> bool:
+    "Whether any field of `production` is a :class:`Stream`."
+    return any(isinstance(value, Stream) for value in vars(production).values())
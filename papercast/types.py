@@ -1,6 +1,7 @@
 from typing import Union
+import hashlib
 import os
-from typing import List, Any
+from typing import List, Any, Optional
 from pathlib import Path
 from dataclasses import dataclass
 import logging
@@ -15,6 +16,18 @@ import logging
 PathLike = Union[str, Path]
 
 
+def _id3v2_size(data: bytes) -> int:
+    "The length of the ID3v2 tag at the start of `data`, or 0 if there is none."
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    # The tag size is a 28-bit "syncsafe" integer: 7 bits per byte.
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
 @dataclass
 class PNGFile:
     path: PathLike
@@ -180,6 +193,39 @@ class MP3File:
         self.path = Path(path)
         self.measured = False
 
+    @classmethod
+    def concat(cls, files: List["MP3File"], path: Optional[PathLike] = None) -> "MP3File":
+        """
+        Join MP3 files end to end, such as the narrations of the chunks of a paper.
+
+        The ID3v2 tag of the first file and the ID3v1 tag of the last are kept; the tags of the
+        files in between are dropped so that players do not read them as audio.
+
+        Args:
+            files (List[MP3File]): The files, in order.
+            path (Optional[PathLike]): Where to write the joined file. Defaults to a file named
+                after the joined paths, next to the first file.
+
+        Returns:
+            MP3File: The joined file.
+        """
+        if not files:
+            raise ValueError("Cannot join an empty list of MP3 files")
+        if path is None:
+            digest = hashlib.sha256(
+                "\n".join(str(f.path) for f in files).encode("utf-8")
+            ).hexdigest()
+            path = files[0].path.parent / f"joined-{digest[:16]}.mp3"
+        with open(path, "wb") as out:
+            for i, f in enumerate(files):
+                data = f.path.read_bytes()
+                start = _id3v2_size(data) if i > 0 else 0
+                end = len(data)
+                if i < len(files) - 1 and data[-128:-125] == b"TAG":
+                    end -= 128
+                out.write(data[start:end])
+        return cls(path)
+
     def measure(self):
         from mutagen.mp3 import MP3
 
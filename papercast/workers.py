@@ -0,0 +1,628 @@
+"""
+Processing the documents of a server in worker processes, which take jobs from a queue in a
+SQLite database shared with the server.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import pickle
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from papercast.jobs import Job, JobStatus, QueueFullError, output_paths
+from papercast.production import Production
+from papercast.scheduling import priority_level
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    id TEXT PRIMARY KEY,
+    pipeline TEXT NOT NULL,
+    start TEXT,
+    inputs BLOB NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    heartbeat REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    reported INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    submitted_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_status ON queue (status, priority, submitted_at);
+CREATE INDEX IF NOT EXISTS queue_worker ON queue (worker);
+"""
+
+
+@dataclass
+class QueuedJob:
+    """
+    A job taken from a :class:`SharedQueue` by a worker.
+
+    Attributes:
+        id (str): The ID of the server's :class:`papercast.jobs.Job`.
+        pipeline (str): The name of the pipeline.
+        inputs (Dict[str, Any]): The inputs of the document.
+        start (Optional[str]): The subscriber the document came from, or None for a submission
+            run from the pipeline's collector.
+        attempts (int): The number of times the job was taken, including this one.
+    """
+
+    id: str
+    pipeline: str
+    inputs: Dict[str, Any]
+    start: Optional[str] = None
+    attempts: int = 1
+
+
+@dataclass
+class JobUpdate:
+    """
+    A change in the status of a job in a :class:`SharedQueue`, for the server to apply.
+
+    Attributes:
+        id (str): The ID of the job.
+        status (JobStatus): Running, done or failed.
+        outputs (Dict[str, str]): The file paths of a finished job, by field name.
+        timings (Dict[str, float]): The duration of each stage of a finished job.
+        error (Optional[str]): The error of a failed job.
+    """
+
+    id: str
+    status: JobStatus
+    outputs: Dict[str, str] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class SharedQueue:
+    """
+    A queue of jobs in a SQLite database, shared by a server and its worker processes.
+
+    Workers take jobs in order of priority class, with aging, then of submission. A job taken
+    by a worker is leased to it: the worker sends heartbeats while it runs the job, and a job
+    whose worker stopped sending them, or whose worker exited, is queued again. A job that lost
+    its worker `max_attempts` times, such as one that crashes its worker, fails instead.
+
+    Each process opens the database with a connection of its own. The database uses
+    write-ahead logging, and taking a job is a short write transaction.
+
+    Args:
+        path (str): The database file, created if it does not exist.
+        aging (Optional[float]): Seconds a job waits before it is promoted one priority class.
+        max_attempts (int): The number of times a job is leased before it fails.
+    """
+
+    def __init__(self, path: str, aging: Optional[float] = 60.0, max_attempts: int = 3):
+        if max_attempts < 1:
+            raise ValueError(f"Expected at least one attempt, got {max_attempts}")
+        self.path = path
+        self.aging = aging
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            # Take the write lock up front, so that two workers cannot take the same job.
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def submit(self, jobs: List[Job], start: Optional[str] = None, max_size: int = 0) -> None:
+        """
+        Queue jobs, either all of them or none.
+
+        Args:
+            jobs (List[Job]): The jobs. Their inputs must be picklable.
+            start (Optional[str]): The subscriber the documents came from, if any.
+            max_size (int): The maximum number of jobs waiting in the queue, or 0 for no limit.
+
+        Raises:
+            QueueFullError: If the queue does not have room for every job.
+        """
+        rows = [
+            (
+                job.id,
+                job.pipeline,
+                start,
+                pickle.dumps(job.inputs, protocol=pickle.HIGHEST_PROTOCOL),
+                priority_level(job.priority),
+                JobStatus.QUEUED.value,
+                job.submitted_at,
+            )
+            for job in jobs
+        ]
+        with self._transaction():
+            if max_size > 0:
+                depth = self._count(JobStatus.QUEUED)
+                if depth + len(rows) > max_size:
+                    raise QueueFullError(
+                        f"Shared queue does not have room for {len(rows)} jobs "
+                        f"({depth} of {max_size} used)"
+                    )
+            self._db.executemany(
+                "INSERT INTO queue (id, pipeline, start, inputs, priority, status, submitted_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def _count(self, *statuses: JobStatus) -> int:
+        marks = ", ".join("?" * len(statuses))
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM queue WHERE status IN ({marks})",
+            [status.value for status in statuses],
+        ).fetchone()[0]
+
+    @property
+    def depth(self) -> int:
+        "The number of jobs waiting for a worker."
+        with self._lock:
+            return self._count(JobStatus.QUEUED)
+
+    def depths(self) -> Dict[str, int]:
+        "The number of jobs waiting for a worker, by pipeline."
+        with self._lock:
+            return dict(
+                self._db.execute(
+                    "SELECT pipeline, COUNT(*) FROM queue WHERE status = ? GROUP BY pipeline",
+                    (JobStatus.QUEUED.value,),
+                ).fetchall()
+            )
+
+    def pending(self) -> int:
+        "The number of jobs waiting for a worker or running."
+        with self._lock:
+            return self._count(JobStatus.QUEUED, JobStatus.RUNNING)
+
+    def claim(
+        self,
+        worker: str,
+        now: Optional[float] = None,
+        pipelines: Optional[List[str]] = None,
+    ) -> Optional[QueuedJob]:
+        """
+        Take the next job, leasing it to `worker`.
+
+        Args:
+            worker (str): The worker.
+            now (Optional[float]): The current Unix time.
+            pipelines (Optional[List[str]]): Only take jobs of these pipelines.
+
+        Returns:
+            Optional[QueuedJob]: The job, or None if no job is waiting.
+        """
+        now = time.time() if now is None else now
+        where = "status = ?"
+        params: list = [JobStatus.QUEUED.value]
+        if pipelines is not None:
+            where += f" AND pipeline IN ({', '.join('?' * len(pipelines))})"
+            params += pipelines
+        if self.aging:
+            order = "MAX(0, priority - CAST((? - submitted_at) / ? AS INTEGER)), submitted_at"
+            params += [now, self.aging]
+        else:
+            order = "priority, submitted_at"
+        with self._transaction():
+            row = self._db.execute(
+                "SELECT id, pipeline, start, inputs, attempts FROM queue "
+                f"WHERE {where} ORDER BY {order} LIMIT 1",
+                params,
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, pipeline, start, inputs, attempts = row
+            self._db.execute(
+                "UPDATE queue SET status = ?, worker = ?, heartbeat = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (JobStatus.RUNNING.value, worker, now, job_id),
+            )
+        return QueuedJob(job_id, pipeline, pickle.loads(inputs), start, attempts + 1)
+
+    def heartbeat(self, worker: str, now: Optional[float] = None) -> None:
+        "Renew the leases of the jobs `worker` is running."
+        with self._lock:
+            self._db.execute(
+                "UPDATE queue SET heartbeat = ? WHERE worker = ? AND status = ?",
+                (time.time() if now is None else now, worker, JobStatus.RUNNING.value),
+            )
+
+    def finish(
+        self,
+        job_id: str,
+        worker: str,
+        outputs: Optional[Dict[str, str]] = None,
+        timings: Optional[Dict[str, float]] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """
+        Record that a worker finished a job, successfully unless `error` is given.
+
+        Returns:
+            bool: False if the job is no longer leased to `worker`, because its lease expired
+            and it was queued again, in which case nothing is recorded.
+        """
+        result = json.dumps({"outputs": outputs or {}, "timings": timings or {}})
+        status = JobStatus.FAILED if error is not None else JobStatus.DONE
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE queue SET status = ?, result = ?, error = ? "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (status.value, result, error, job_id, worker, JobStatus.RUNNING.value),
+            )
+        return cursor.rowcount == 1
+
+    def _requeue(self, where: str, params: tuple) -> int:
+        with self._transaction():
+            lost = self._db.execute(
+                f"SELECT id, worker, attempts FROM queue WHERE status = ? AND {where}",
+                (JobStatus.RUNNING.value, *params),
+            ).fetchall()
+            for job_id, worker, attempts in lost:
+                if attempts >= self.max_attempts:
+                    logger.warning(f"Job {job_id} lost its worker {attempts} times, failing it")
+                    self._db.execute(
+                        "UPDATE queue SET status = ?, error = ? WHERE id = ?",
+                        (
+                            JobStatus.FAILED.value,
+                            f"WorkerLost: lost its worker {attempts} times",
+                            job_id,
+                        ),
+                    )
+                else:
+                    logger.warning(f"Queueing job {job_id} again after losing worker {worker}")
+                    self._db.execute(
+                        "UPDATE queue SET status = ?, worker = NULL WHERE id = ?",
+                        (JobStatus.QUEUED.value, job_id),
+                    )
+        return len(lost)
+
+    def release(self, worker: str) -> int:
+        """
+        Queue the jobs leased to a worker that exited again.
+
+        Returns:
+            int: The number of jobs released.
+        """
+        return self._requeue("worker = ?", (worker,))
+
+    def requeue_expired(self, timeout: float, now: Optional[float] = None) -> int:
+        """
+        Queue the jobs whose worker has not sent a heartbeat for `timeout` seconds again.
+
+        Returns:
+            int: The number of jobs released.
+        """
+        now = time.time() if now is None else now
+        return self._requeue("heartbeat < ?", (now - timeout,))
+
+    def updates(self) -> List[JobUpdate]:
+        """
+        Get the jobs that started or finished since the last call.
+
+        Finished jobs are removed from the queue, as the server keeps track of them.
+        """
+        updates = []
+        with self._transaction():
+            for (job_id,) in self._db.execute(
+                "SELECT id FROM queue WHERE status = ? AND reported = 0",
+                (JobStatus.RUNNING.value,),
+            ).fetchall():
+                updates.append(JobUpdate(job_id, JobStatus.RUNNING))
+            self._db.execute(
+                "UPDATE queue SET reported = 1 WHERE status = ? AND reported = 0",
+                (JobStatus.RUNNING.value,),
+            )
+            finished = self._db.execute(
+                "SELECT id, status, result, error FROM queue WHERE status IN (?, ?)",
+                (JobStatus.DONE.value, JobStatus.FAILED.value),
+            ).fetchall()
+            for job_id, status, result, error in finished:
+                result = json.loads(result) if result else {}
+                updates.append(
+                    JobUpdate(
+                        job_id,
+                        JobStatus(status),
+                        result.get("outputs", {}),
+                        result.get("timings", {}),
+                        error,
+                    )
+                )
+            self._db.executemany(
+                "DELETE FROM queue WHERE id = ?", [(row[0],) for row in finished]
+            )
+        return updates
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class Worker:
+    """
+    Runs the jobs of a :class:`SharedQueue` one at a time, in the current process.
+
+    Args:
+        pipelines (Dict[str, papercast.pipelines.Pipeline]): The pipelines, by name.
+        queue (SharedQueue): The queue, or a :class:`papercast.distributed.RemoteQueue` to run
+            the jobs of a server on another machine.
+        worker_id (str): Identifies the worker's leases.
+        poll_interval (float): Seconds to wait before looking for jobs again when none are
+            waiting.
+        heartbeat_interval (float): Seconds between heartbeats while a job runs.
+    """
+
+    def __init__(
+        self,
+        pipelines: Dict[str, Any],
+        queue: SharedQueue,
+        worker_id: Optional[str] = None,
+        poll_interval: float = 0.2,
+        heartbeat_interval: float = 5.0,
+    ):
+        self.pipelines = pipelines
+        self.queue = queue
+        self.worker_id = worker_id or uuid.uuid4().hex[:12]
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._stopping = threading.Event()
+        # Set once the worker has stopped, after its last job; heartbeats run until then.
+        self._stopped = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def stop(self) -> None:
+        "Stop after the job that is running, if any."
+        self._stopping.set()
+
+    async def _execute(self, job: QueuedJob):
+        # Documents are deduplicated by the server as they are queued, not by the workers.
+        pipeline = self.pipelines[job.pipeline]
+        if job.start is None:
+            return await pipeline._arun(None, None, **job.inputs)
+        return await pipeline.aprocess(Production(**job.inputs), job.start)
+
+    def run_one(self) -> bool:
+        """
+        Take the next job and run it.
+
+        Returns:
+            bool: False if no job was waiting.
+        """
+        job = self.queue.claim(self.worker_id)
+        if job is None:
+            return False
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        logger.info(f"Worker {self.worker_id} running job {job.id} of {job.pipeline}")
+        try:
+            report = self._loop.run_until_complete(self._execute(job))
+            if report.error is not None:
+                raise report.error
+        except Exception as e:
+            self.queue.finish(job.id, self.worker_id, error=f"{type(e).__name__}: {e}")
+            logger.exception(f"Worker {self.worker_id} failed on job {job.id}")
+            return True
+        finished = self.queue.finish(
+            job.id,
+            self.worker_id,
+            outputs=output_paths(report.production),
+            timings={name: timing.duration for name, timing in report.timings.items()},
+        )
+        if not finished:
+            logger.warning(f"Lease of job {job.id} expired before worker {self.worker_id} finished")
+        return True
+
+    def _send_heartbeats(self) -> None:
+        # Heartbeats go on while a job finishes after stop() is called, so that its lease does
+        # not expire and the job is not queued again while it is still running.
+        while not self._stopped.wait(self.heartbeat_interval):
+            try:
+                self.queue.heartbeat(self.worker_id)
+            except Exception as e:
+                logger.warning(f"Worker {self.worker_id} failed to send a heartbeat: {e}")
+
+    def run(self) -> None:
+        """
+        Run jobs until :meth:`stop` is called or, when run in the main thread, the process
+        receives SIGTERM.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        for pipeline in self.pipelines.values():
+            pipeline.warm_up()
+        heartbeats = threading.Thread(target=self._send_heartbeats, daemon=True)
+        heartbeats.start()
+        logger.info(f"Worker {self.worker_id} started in process {os.getpid()}")
+        try:
+            while not self._stopping.is_set():
+                try:
+                    busy = self.run_one()
+                except Exception:
+                    logger.exception(f"Worker {self.worker_id} failed to take or report a job")
+                    busy = False
+                if not busy:
+                    self._stopping.wait(self.poll_interval)
+        finally:
+            self._stopping.set()
+            self._stopped.set()
+            heartbeats.join()
+            if self._loop is not None:
+                self._loop.close()
+            self.queue.close()
+
+
+def _run_worker(pipelines: Dict[str, Any], path: str, worker_id: str, **options) -> None:
+    queue = SharedQueue(path, options.pop("aging"), options.pop("max_attempts"))
+    Worker(pipelines, queue, worker_id, **options).run()
+
+
+class WorkerPool:
+    """
+    Runs a number of :class:`Worker` processes on a :class:`SharedQueue`.
+
+    The workers are started by a supervisor process, which starts a new worker when one exits,
+    for example after a crash, and queues the jobs of the workers that exited or stopped
+    sending heartbeats again. The supervisor and the workers are forked, so the pipelines do
+    not need to be picklable, but they must not have started threads or processes before
+    :meth:`start`. The supervisor stops the workers when it is stopped or its parent exits.
+
+    Args:
+        pipelines (Dict[str, papercast.pipelines.Pipeline]): The pipelines, by name.
+        path (str): The database file of the queue.
+        processes (int): The number of worker processes.
+        poll_interval (float): Seconds between looks for jobs by idle workers, and between
+            checks of the workers by the supervisor.
+        heartbeat_interval (float): Seconds between heartbeats of workers running a job.
+        lease_timeout (float): Seconds without a heartbeat after which a job is queued again.
+        max_attempts (int): The number of times a job is leased before it fails.
+        aging (Optional[float]): Seconds a job waits before it is promoted one priority class.
+        stop_timeout (float): Seconds workers get to finish their jobs when the pool stops.
+    """
+
+    def __init__(
+        self,
+        pipelines: Dict[str, Any],
+        path: str,
+        processes: int = 2,
+        poll_interval: float = 0.2,
+        heartbeat_interval: float = 5.0,
+        lease_timeout: float = 60.0,
+        max_attempts: int = 3,
+        aging: Optional[float] = 60.0,
+        stop_timeout: float = 30.0,
+    ):
+        if processes < 1:
+            raise ValueError(f"Expected at least one worker process, got {processes}")
+        if lease_timeout <= heartbeat_interval:
+            raise ValueError(
+                f"Expected a lease timeout longer than the heartbeat interval, "
+                f"got {lease_timeout} and {heartbeat_interval}"
+            )
+        self.pipelines = pipelines
+        self.path = str(path)
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.aging = aging
+        self.stop_timeout = stop_timeout
+        self._queue: Optional[SharedQueue] = None
+        self._supervisor: Optional[multiprocessing.process.BaseProcess] = None
+        self._context = multiprocessing.get_context("fork")
+
+    @property
+    def queue(self) -> SharedQueue:
+        "The queue, opened in this process."
+        if self._queue is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._queue = SharedQueue(self.path, self.aging, self.max_attempts)
+        return self._queue
+
+    @property
+    def running(self) -> bool:
+        return self._supervisor is not None and self._supervisor.is_alive()
+
+    def start(self) -> None:
+        "Start the supervisor and the workers, if they are not already running."
+        if self.running:
+            return
+        # Create the database before forking, so that processes do not race to create it.
+        self.queue
+        self._supervisor = self._context.Process(
+            target=self._supervise, name="papercast-supervisor", daemon=False
+        )
+        self._supervisor.start()
+        logger.info(f"Started {self.processes} worker processes on {self.path}")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop the workers, letting them finish the jobs they are running, and the supervisor.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait before killing them. Defaults to
+                `stop_timeout` plus a little.
+        """
+        if self._supervisor is None:
+            return
+        if self._supervisor.is_alive():
+            self._supervisor.terminate()
+        self._supervisor.join(self.stop_timeout + 5 if timeout is None else timeout)
+        if self._supervisor.is_alive():
+            logger.warning("Killing the worker supervisor")
+            self._supervisor.kill()
+            self._supervisor.join()
+        self._supervisor = None
+
+    def _start_worker(self, slot: int):
+        worker_id = f"{slot}-{uuid.uuid4().hex[:8]}"
+        process = self._context.Process(
+            target=_run_worker,
+            args=(self.pipelines, self.path, worker_id),
+            kwargs={
+                "poll_interval": self.poll_interval,
+                "heartbeat_interval": self.heartbeat_interval,
+                "aging": self.aging,
+                "max_attempts": self.max_attempts,
+            },
+            name=f"papercast-worker-{slot}",
+            daemon=True,
+        )
+        process.start()
+        return worker_id, process
+
+    def _supervise(self) -> None:
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+        parent = os.getppid()
+        # A connection of our own: the parent's must not be used after forking.
+        queue = SharedQueue(self.path, self.aging, self.max_attempts)
+        workers = {}
+        try:
+            while not stopping.is_set() and os.getppid() == parent:
+                for slot in range(self.processes):
+                    worker = workers.get(slot)
+                    if worker is not None and worker[1].is_alive():
+                        continue
+                    if worker is not None:
+                        worker_id, process = worker
+                        logger.error(
+                            f"Worker {worker_id} exited with code {process.exitcode}, "
+                            "restarting it"
+                        )
+                        queue.release(worker_id)
+                    workers[slot] = self._start_worker(slot)
+                queue.requeue_expired(self.lease_timeout)
+                stopping.wait(self.poll_interval)
+        finally:
+            for _, process in workers.values():
+                process.terminate()
+            deadline = time.monotonic() + self.stop_timeout
+            for worker_id, process in workers.values():
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    logger.warning(f"Killing worker {worker_id}")
+                    process.kill()
+                    process.join()
+                queue.release(worker_id)
+            queue.close()
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from papercast.base import BaseProcessor, Production
+from papercast.pipelines import Pipeline
+
+
+class Fetch(BaseProcessor):
+    "Passes the document's `key` on unchanged."
+
+    def __init__(self, key: str = "arxiv_id"):
+        super().__init__()
+        self.input_types = {key: str}
+        self.output_types = {key: str}
+
+    def process(self, input: Production) -> Production:
+        return input
+
+
+class Narrate(BaseProcessor):
+    "Records the papers it narrates, in order."
+
+    input_types = {"arxiv_id": str}
+    output_types = {"audio": str}
+
+    def __init__(self, delay=0.0):
+        super().__init__()
+        self.delay = delay
+        self.narrated = []
+
+    @property
+    def calls(self) -> int:
+        return len(self.narrated)
+
+    def process(self, input: Production) -> Production:
+        self.narrated.append(input.arxiv_id)
+        time.sleep(self.delay)
+        input.audio = f"{input.arxiv_id}.mp3"
+        return input
+
+
+@pytest.fixture
+def narrate():
+    return Narrate()
+
+
+@pytest.fixture
+def make_pipeline():
+    "Build a pipeline that fetches a document and passes its `key` on to `narrate`."
+
+    def make(narrate, key="arxiv_id", **kwargs):
+        pipeline = Pipeline("test", **kwargs)
+        pipeline.add_processor("fetch", Fetch(key))
+        pipeline.add_processor("narrate", narrate)
+        pipeline.connect("fetch", key, "narrate", key)
+        return pipeline
+
+    return make
@@ -0,0 +1,30 @@
+import json
+
+from papercast.benchmarks import main, run_benchmarks
+
+
+class TestBenchmarks:
+    def test_quick_run_covers_every_benchmark(self):
+        report = run_benchmarks(quick=True)
+
+        names = {result["name"] for result in report["results"]}
+        assert {
+            "pipeline.run",
+            "pipeline.process",
+            "pipeline.run.sleep_branches",
+            "pipeline._topological_sort",
+            "pipeline.get_downstream_processors",
+            "pipeline.compile.cached",
+            "server.add",
+            "memory.production",
+            "import.plugins",
+            "plugins.index.cached",
+        } <= names
+        server_add = next(r for r in report["results"] if r["name"] == "server.add")
+        assert server_add["accepted"] == server_add["params"]["requests"]
+
+    def test_main_writes_json(self, tmp_path):
+        output = tmp_path / "results.json"
+        main(["--quick", "--output", str(output)])
+
+        assert json.loads(output.read_text())["quick"] is True
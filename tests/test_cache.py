@@ -0,0 +1,224 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from papercast.base import BaseProcessor, Production
+from papercast.cache import (
+    DiskBackend,
+    MemoryBackend,
+    ResultCache,
+    stable_hash,
+)
+from papercast.pipelines import Pipeline
+from papercast.production import FileValue, spill
+
+
+class CountingProcessor(BaseProcessor):
+    input_types = {"text": str}
+    output_types = {"upper": str}
+
+    def __init__(self, suffix: str = ""):
+        super().__init__()
+        self.suffix = suffix
+        self.calls = 0
+
+    def cache_config(self):
+        return {"suffix": self.suffix}
+
+    def process(self, input: Production) -> Production:
+        self.calls += 1
+        input.upper = input.text.upper() + self.suffix
+        return input
+
+
+class Source(BaseProcessor):
+    input_types = {"doc": str}
+    output_types = {"text": str}
+
+    def process(self, input: Production) -> Production:
+        input.text = input.doc
+        return input
+
+
+class TestStableHash:
+    def test_equal_values_hash_equal(self):
+        assert stable_hash({"a": [1, 2], "b": "x"}) == stable_hash(
+            {"b": "x", "a": [1, 2]}
+        )
+        assert stable_hash([1, 2]) != stable_hash((1, 2))
+        assert stable_hash("1") != stable_hash(1)
+
+    def test_files_hash_by_content(self, tmp_path):
+        a = tmp_path / "a.pdf"
+        b = tmp_path / "b.pdf"
+        a.write_bytes(b"same")
+        b.write_bytes(b"same")
+        assert stable_hash(Path(a)) == stable_hash(Path(b))
+
+        b.write_bytes(b"different")
+        os.utime(b, ns=(0, 1))
+        assert stable_hash(Path(a)) != stable_hash(Path(b))
+
+    def test_objects_and_cycles_are_rejected(self):
+        cyclic = [1]
+        cyclic.append(cyclic)
+        with pytest.raises(ValueError):
+            stable_hash(cyclic)
+        with pytest.raises(TypeError):
+            stable_hash({"session": object()})
+        shared = [1]
+        assert stable_hash([shared, shared]) == stable_hash([[1], [1]])
+
+
+class TestBackends:
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryBackend(max_items=2)
+        backend.set("a", {"v": 1})
+        backend.set("b", {"v": 2})
+        backend.get("a")
+        backend.set("c", {"v": 3})
+
+        assert backend.get("b") is None
+        assert backend.get("a") == {"v": 1}
+        assert backend.get("c") == {"v": 3}
+
+    def test_disk_backend_round_trip(self, tmp_path):
+        backend = DiskBackend(str(tmp_path))
+        backend.set("abcdef", {"v": [1, 2, 3]})
+        assert backend.get("abcdef") == {"v": [1, 2, 3]}
+        assert backend.get("missing") is None
+
+    def test_disk_backend_evicts_by_size(self, tmp_path):
+        backend = DiskBackend(str(tmp_path), max_bytes=3000)
+        for i in range(5):
+            backend.set(f"key{i}", {"v": b"x" * 1000})
+            os.utime(backend._path(f"key{i}"), (i, i))
+
+        remaining = [k for k in (f"key{i}" for i in range(5)) if backend._path(k).exists()]
+        assert remaining == ["key3", "key4"]
+
+    def test_disk_backend_scans_only_when_over_size(self, tmp_path, monkeypatch):
+        backend = DiskBackend(str(tmp_path), max_bytes=5000)
+        scans = []
+        entries = backend._entries
+        monkeypatch.setattr(backend, "_entries", lambda: scans.append(1) or entries())
+        for i in range(4):
+            backend.set(f"key{i}", {"v": b"x" * 1000})
+        # The first write measures the directory, and the next ones are counted.
+        assert len(scans) == 1
+        backend.set("key4", {"v": b"x" * 1000})
+        assert len(scans) == 2
+        assert sum(size for _, size, _ in entries()) <= 5000 * backend.low_water
+
+    def test_disk_backend_expires_by_age(self, tmp_path):
+        backend = DiskBackend(str(tmp_path), max_age=60)
+        backend.set("old", {"v": 1})
+        past = time.time() - 120
+        os.utime(backend._path("old"), (past, past))
+
+        assert backend.get("old") is None
+        assert not backend._path("old").exists()
+
+
+class TestResultCache:
+    def test_second_tier_hit_is_promoted(self, tmp_path):
+        memory = MemoryBackend()
+        cache = ResultCache([memory, DiskBackend(str(tmp_path))])
+        cache.backends[1].set("key", {"v": 1})
+
+        assert cache.get("key") == {"v": 1}
+        assert memory.get("key") == {"v": 1}
+
+    def test_pipeline_skips_cached_processor(self):
+        cache = ResultCache()
+        processor = CountingProcessor()
+        pipeline = Pipeline("default")
+        pipeline.add_processor("source", Source())
+        pipeline.add_processor("upper", processor, cache=cache)
+        pipeline.connect("source", "text", "upper", "text")
+
+        first = pipeline.run(doc="hello")
+        second = pipeline.run(doc="hello")
+        pipeline.run(doc="other")
+
+        assert processor.calls == 2
+        assert second.production.upper == "HELLO"
+        assert second.timings["upper"].cached
+        assert not first.timings["upper"].cached
+        assert cache.stats["upper"].hits == 1
+        assert cache.stats["upper"].misses == 2
+
+    def test_default_configuration_leaves_out_objects(self):
+        class Client:
+            pass
+
+        class Remote(CountingProcessor):
+            def __init__(self, suffix):
+                super().__init__(suffix)
+                self.session = Client()
+
+            cache_config = BaseProcessor.cache_config
+
+        cache = ResultCache()
+        production = Production(text="hello")
+        assert cache.key(Remote("!"), production) == cache.key(Remote("!"), production)
+        assert cache.key(Remote("!"), production) != cache.key(Remote("?"), production)
+
+    def test_unhashable_inputs_are_a_miss(self):
+        cache = ResultCache()
+        processor = CountingProcessor()
+        pipeline = Pipeline("default")
+        pipeline.add_processor("source", Source())
+        pipeline.add_processor("upper", processor, cache=cache)
+        pipeline.connect("source", "text", "upper", "text")
+        cyclic = {}
+        cyclic["self"] = cyclic
+        processor.cache_config = lambda: cyclic
+
+        for _ in range(2):
+            assert pipeline.run(doc="hello").production.upper == "HELLO"
+        assert processor.calls == 2
+        assert cache.stats["upper"].misses == 2
+
+    def test_lazy_inputs_are_not_loaded(self, tmp_path):
+        class CountingFile(FileValue):
+            loads = 0
+
+            def load(self):
+                CountingFile.loads += 1
+                return super().load()
+
+        class Spill(BaseProcessor):
+            input_types = {"doc": str}
+            output_types = {"text": str}
+
+            def process(self, input: Production) -> Production:
+                # A new file each run, with the same contents.
+                input.text = CountingFile(spill(input.doc, tmp_path).path, encoding="utf-8")
+                return input
+
+        cache = ResultCache()
+        processor = CountingProcessor()
+        pipeline = Pipeline("default")
+        pipeline.add_processor("spill", Spill())
+        pipeline.add_processor("upper", processor, cache=cache)
+        pipeline.connect("spill", "text", "upper", "text")
+
+        assert pipeline.run(doc="hello").production.upper == "HELLO"
+        assert CountingFile.loads == 1
+        second = pipeline.run(doc="hello")
+        assert second.timings["upper"].cached
+        assert second.production.upper == "HELLO"
+        assert CountingFile.loads == 1
+
+    def test_configuration_is_part_of_key(self):
+        cache = ResultCache()
+        production = Production(text="hello")
+        assert cache.key(CountingProcessor("!"), production) != cache.key(
+            CountingProcessor("?"), production
+        )
+        assert cache.key(CountingProcessor("!"), production) == cache.key(
+            CountingProcessor("!"), production
+        )
@@ -0,0 +1,166 @@
+import itertools
+import time
+
+import pytest
+
+from papercast.base import BaseProcessor, Production
+from papercast.cache import ResultCache
+from papercast.chunking import TextChunker, split_text
+from papercast.pipelines import Pipeline
+from papercast.types import MP3File
+
+
+class Narrate(BaseProcessor):
+    input_types = {"text": str}
+    output_types = {"audio": MP3File}
+
+    def __init__(self, directory, delay=0.0):
+        super().__init__()
+        self.directory = directory
+        self.delay = delay
+        self.narrated = []
+        self._files = itertools.count()
+
+    def cache_config(self):
+        return {}
+
+    def process(self, input: Production) -> Production:
+        self.narrated.append(input.text)
+        path = self.directory / f"{next(self._files)}.mp3"
+        time.sleep(self.delay)
+        path.write_bytes(id3v2(b"tag") + input.text.encode() + id3v1())
+        input.audio = MP3File(path)
+        return input
+
+
+class Publish(BaseProcessor):
+    input_types = {"audio": MP3File}
+    output_types = {"url": str}
+
+    def process(self, input: Production) -> Production:
+        input.url = str(input.audio.path)
+        return input
+
+
+class Shout(BaseProcessor):
+    input_types = {"text": str}
+    output_types = {"text": str}
+    chunked = True
+
+    def process(self, input: Production) -> Production:
+        input.text = input.text.upper()
+        return input
+
+
+def id3v2(body: bytes) -> bytes:
+    "An ID3v2 header followed by `body` as the tag contents."
+    size = len(body)
+    syncsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + syncsafe + body
+
+
+def id3v1() -> bytes:
+    return b"TAG" + b"\x00" * 125
+
+
+def build_narration_pipeline(narrate, **kwargs):
+    pipeline = Pipeline("test", max_workers=4)
+    pipeline.add_processor("chunk", TextChunker(max_chars=5))
+    pipeline.add_processor("narrate", narrate, **kwargs)
+    pipeline.add_processor("publish", Publish())
+    pipeline.connect("chunk", "text", "narrate", "text")
+    pipeline.connect("narrate", "audio", "publish", "audio")
+    return pipeline
+
+
+class TestSplitText:
+    def test_groups_paragraphs(self):
+        chunks = split_text("aa\n\nbb\n\n\n  cc", max_chars=6)
+        assert all(len(chunk) <= 6 for chunk in chunks)
+        assert "\n\n".join(chunks).split("\n\n") == ["aa", "bb", "cc"]
+
+    def test_edits_keep_other_chunks(self):
+        words = ["alpha", "beta", "gamma.", "delta", "epsilon"]
+        paragraphs = [
+            " ".join(words[(i * j) % 5] for j in range(3 + (i * 7) % 20)) for i in range(60)
+        ]
+        before = split_text("\n\n".join(paragraphs), max_chars=1000)
+        assert len(before) > 10
+
+        edited = list(paragraphs)
+        edited[30] += " zeta" * 30
+        after = split_text("\n\n".join(edited), max_chars=1000)
+        assert len(set(after) - set(before)) <= 2
+
+        # Text inserted at the start does not move the boundaries after it.
+        introduction = "An introduction. " * 12
+        after = split_text("\n\n".join([introduction] + paragraphs), max_chars=1000)
+        assert len(set(after) - set(before)) <= 2
+
+    def test_splits_long_paragraphs_at_sentences(self):
+        text = "One two. Three four! Five six seven eight"
+        assert split_text(text, max_chars=12) == [
+            "One two.",
+            "Three four!",
+            "Five six",
+            "seven eight",
+        ]
+
+    def test_hard_splits_long_words(self):
+        assert split_text("abcdefgh", max_chars=3) == ["abc", "def", "gh"]
+        with pytest.raises(ValueError):
+            split_text("a", max_chars=0)
+
+
+class TestMP3Concat:
+    def test_keeps_outer_tags_only(self, tmp_path):
+        paths = [tmp_path / "a.mp3", tmp_path / "b.mp3"]
+        paths[0].write_bytes(id3v2(b"first") + b"AAA" + id3v1())
+        paths[1].write_bytes(id3v2(b"second") + b"BBB" + id3v1())
+        joined = MP3File.concat([MP3File(p) for p in paths])
+        assert joined.path.parent == tmp_path
+        assert joined.path.read_bytes() == id3v2(b"first") + b"AAABBB" + id3v1()
+
+
+class TestParallelNarration:
+    def test_chunks_narrated_in_parallel_and_joined_in_order(self, tmp_path):
+        narrate = Narrate(tmp_path, delay=0.1)
+        pipeline = build_narration_pipeline(narrate, chunk_workers=4)
+        start = time.perf_counter()
+        report = pipeline.run(text="aaaa\n\nbbbb\n\ncccc\n\ndddd")
+        assert time.perf_counter() - start < 0.3
+        assert sorted(narrate.narrated) == ["aaaa", "bbbb", "cccc", "dddd"]
+        audio = MP3File(report.production.url).path.read_bytes()
+        assert audio == id3v2(b"tag") + b"aaaabbbbccccdddd" + id3v1()
+        # The joined text keeps the blank lines between paragraphs.
+        assert report.production.text == "aaaa\n\nbbbb\n\ncccc\n\ndddd"
+
+    def test_chunked_outputs_keep_separator(self, tmp_path):
+        pipeline = Pipeline("test")
+        pipeline.add_processor("chunk", TextChunker(max_chars=5))
+        pipeline.add_processor("shout", Shout())
+        pipeline.add_processor("narrate", Narrate(tmp_path))
+        pipeline.connect("chunk", "text", "shout", "text")
+        pipeline.connect("shout", "text", "narrate", "text")
+        pipeline.run(text="aaaa\n\nbbbb")
+        assert pipeline.processors["narrate"].narrated == ["AAAA\n\nBBBB"]
+
+    def test_one_worker_narrates_in_order(self, tmp_path):
+        narrate = Narrate(tmp_path)
+        pipeline = build_narration_pipeline(narrate, chunk_workers=1)
+        pipeline.run(text="aaaa\n\nbbbb\n\ncccc")
+        assert narrate.narrated == ["aaaa", "bbbb", "cccc"]
+
+    def test_unchanged_chunks_are_cached(self, tmp_path):
+        narrate = Narrate(tmp_path)
+        pipeline = build_narration_pipeline(narrate, chunk_workers=2, cache=ResultCache())
+        pipeline.run(text="aaaa\n\nbbbb\n\ncccc")
+        assert len(narrate.narrated) == 3
+        report = pipeline.run(text="aaaa\n\nBBBB\n\ncccc")
+        assert narrate.narrated[3:] == ["BBBB"]
+        audio = MP3File(report.production.url).path.read_bytes()
+        assert audio == id3v2(b"tag") + b"aaaaBBBBcccc" + id3v1()
+
+    def test_rejects_no_workers(self, tmp_path):
+        with pytest.raises(ValueError):
+            Pipeline("test").add_processor("narrate", Narrate(tmp_path), chunk_workers=0)
@@ -0,0 +1,190 @@
+import asyncio
+import time
+
+import pytest
+
+from papercast.base import BaseProcessor, BaseSubscriber, Production
+from papercast.dedup import (
+    BloomFilter,
+    Deduplicator,
+    SeenStore,
+    document_identity,
+    normalize_arxiv_id,
+    normalize_doi,
+)
+from papercast.pipelines import Pipeline
+from papercast.server import Server
+
+
+class TestIdentity:
+    @pytest.mark.parametrize(
+        "value",
+        [
+            "2301.00001",
+            "arXiv:2301.00001v2",
+            "https://arxiv.org/abs/2301.00001",
+            "http://arxiv.org/pdf/2301.00001v1.pdf",
+        ],
+    )
+    def test_arxiv_ids(self, value):
+        assert normalize_arxiv_id(value) == "2301.00001"
+
+    def test_old_style_arxiv_ids_and_dois(self):
+        assert normalize_arxiv_id("hep-th/9901001v3") == "hep-th/9901001"
+        assert normalize_arxiv_id("not an id") is None
+        assert normalize_doi("https://doi.org/10.1000/ABC.1") == "10.1000/abc.1"
+        assert normalize_doi("doi:10.1000/abc.1") == "10.1000/abc.1"
+        assert normalize_doi("abc") is None
+
+    def test_document_identity(self, tmp_path):
+        pdf = tmp_path / "paper.pdf"
+        pdf.write_bytes(b"%PDF")
+        copy = tmp_path / "copy.pdf"
+        copy.write_bytes(b"%PDF")
+        assert document_identity({"url": "https://arxiv.org/abs/2301.00001v3"}) == (
+            "arxiv:2301.00001"
+        )
+        assert document_identity({"doi": "10.1000/X"}) == "doi:10.1000/x"
+        assert document_identity({"pdf": str(pdf)}) == document_identity({"pdf": copy})
+        assert document_identity({"title": "A paper"}) is None
+
+
+class TestSeenStore:
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"arxiv:{i}")
+        assert all(f"arxiv:{i}" in bloom for i in range(1000))
+        false_positives = sum(f"doi:{i}" in bloom for i in range(10000))
+        assert false_positives < 300
+
+    def test_persists(self, tmp_path):
+        path = str(tmp_path / "seen.db")
+        store = SeenStore(path)
+        store.add("arxiv:2301.00001", published_at=100.0)
+        store.close()
+
+        store = SeenStore(path)
+        assert store.published_at("arxiv:2301.00001") == 100.0
+        assert store.published_at("arxiv:2301.00002") is None
+        store.prune(before=200.0)
+        assert store.published_at("arxiv:2301.00001") is None
+        assert len(store) == 0
+
+
+class TestDeduplicator:
+    @pytest.mark.asyncio
+    async def test_concurrent_runs_are_coalesced(self, narrate, make_pipeline):
+        narrate.delay = 0.05
+        pipeline = make_pipeline(narrate, dedup=Deduplicator())
+        first, second = await asyncio.gather(
+            pipeline.arun(arxiv_id="2301.00001"),
+            pipeline.arun(arxiv_id="arXiv:2301.00001v2"),
+        )
+        assert narrate.calls == 1
+        assert first is second
+        assert pipeline.dedup.coalesced == 1
+
+    def test_published_papers_are_skipped_within_window(self, narrate, make_pipeline):
+        dedup = Deduplicator(window=60)
+        pipeline = make_pipeline(narrate, dedup=dedup)
+        assert not pipeline.run(arxiv_id="2301.00001").duplicate
+        report = pipeline.run(arxiv_id="2301.00001")
+        assert report.duplicate
+        assert narrate.calls == 1
+
+        dedup.store.add("arxiv:2301.00001", published_at=time.time() - 120)
+        assert not pipeline.run(arxiv_id="2301.00001").duplicate
+        assert narrate.calls == 2
+
+    def test_failed_runs_are_not_recorded(self, make_pipeline):
+        class Failing(BaseProcessor):
+            input_types = {"arxiv_id": str}
+            output_types = {"audio": str}
+            calls = 0
+
+            def process(self, input: Production) -> Production:
+                self.calls += 1
+                raise RuntimeError("TTS unavailable")
+
+        narrate = Failing()
+        pipeline = make_pipeline(narrate, dedup=Deduplicator())
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                pipeline.run(arxiv_id="2301.00001")
+        assert narrate.calls == 2
+
+    @pytest.mark.asyncio
+    async def test_subscriber_and_add_are_deduplicated(self, narrate):
+        class Feed(BaseSubscriber):
+            output_types = {"arxiv_id": str}
+
+            async def subscribe(self):
+                for arxiv_id in ("2301.00001", "2301.00002", "2301.00001v2"):
+                    yield Production(arxiv_id=arxiv_id)
+
+        pipeline = Pipeline("test", dedup=Deduplicator())
+        pipeline.add_processor("feed", Feed())
+        pipeline.add_processor("narrate", narrate)
+        pipeline.connect("feed", "arxiv_id", "narrate", "arxiv_id")
+        await pipeline._run_in_server()
+        assert narrate.calls == 2
+
+        server = Server(pipelines={"default": pipeline})
+        response = await server._add({"arxiv_id": "https://arxiv.org/abs/2301.00002"})
+        assert response["duplicate"]
+        assert server.jobs.get(response["job_id"]).status == "done"
+        assert narrate.calls == 2
+
+
+class TestServerDedup:
+    @pytest.mark.asyncio
+    async def test_slow_identities_do_not_block_the_loop(self, narrate, make_pipeline):
+        def slow_identity(inputs):
+            time.sleep(0.2)
+            return document_identity(inputs)
+
+        pipeline = make_pipeline(narrate, dedup=Deduplicator(identity=slow_identity))
+        server = Server(pipelines={"default": pipeline})
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        first, second = await asyncio.gather(
+            server._add({"arxiv_id": "2301.00001"}),
+            server._add({"arxiv_id": "arXiv:2301.00001v2"}),
+        )
+        ticker.cancel()
+        assert ticks > 5
+        # Identified concurrently, the two submissions still share one job.
+        assert second["job_id"] == first["job_id"]
+        await server._drain_queues()
+        assert narrate.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_queued_submissions_share_a_job(self, narrate, make_pipeline):
+        pipeline = make_pipeline(narrate, dedup=Deduplicator())
+        server = Server(pipelines={"default": pipeline})
+
+        first = await server._add({"arxiv_id": "2301.00001"})
+        second = await server._add({"arxiv_id": "arXiv:2301.00001"})
+        assert second == {
+            "message": "Document already submitted or published",
+            "job_id": first["job_id"],
+            "duplicate": True,
+        }
+        batch = await server._add_batch(
+            {"documents": [{"arxiv_id": "2301.00001"}, {"arxiv_id": "2301.00002"}] * 2}
+        )
+        assert batch["job_ids"][0] == first["job_id"]
+        assert batch["job_ids"][1] == batch["job_ids"][3]
+        assert batch["duplicates"] == 3
+
+        await server._drain_queues()
+        assert narrate.calls == 2
+        assert server._submitted == {}
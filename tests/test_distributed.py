@@ -0,0 +1,196 @@
+import hashlib
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import requests
+import uvicorn
+from fastapi import HTTPException
+
+from papercast.base import BaseProcessor, Production
+from papercast.distributed import (
+    ArtifactStore,
+    RemoteQueue,
+    decode_inputs,
+    encode_inputs,
+)
+from papercast.server import Server
+from papercast.types import MP3File
+from papercast.workers import Worker
+
+
+class Narrate(BaseProcessor):
+    input_types = {"text_path": str}
+    output_types = {"audio_path": str}
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def process(self, input: Production) -> Production:
+        text = Path(input.text_path).read_text()
+        path = self.directory / f"{Path(input.text_path).stem}.mp3"
+        path.write_text(text.upper())
+        input.audio_path = str(path)
+        return input
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestArtifacts:
+    def test_files_are_stored_once_by_digest(self, tmp_path):
+        store = ArtifactStore(str(tmp_path / "store"))
+        (tmp_path / "a.mp3").write_bytes(b"audio")
+        (tmp_path / "b.mp3").write_bytes(b"audio")
+        digest = store.add(tmp_path / "a.mp3")
+        assert store.add(tmp_path / "b.mp3") == digest == hashlib.sha256(b"audio").hexdigest()
+        assert store.path(digest).read_bytes() == b"audio"
+        assert store.write(digest, "c.mp3", [b"aud", b"io"]) == store.path(digest)
+
+        with pytest.raises(ValueError):
+            store.write(hashlib.sha256(b"other").hexdigest(), "d.mp3", [b"audio"])
+        with pytest.raises(ValueError):
+            store.path("../etc")
+
+    def test_inputs_round_trip(self, tmp_path):
+        store = ArtifactStore(str(tmp_path / "store"))
+        (tmp_path / "paper.txt").write_text("text")
+        inputs = {
+            "title": "A paper",
+            "text_path": str(tmp_path / "paper.txt"),
+            "audio": MP3File(tmp_path / "paper.txt"),
+        }
+        encoded = encode_inputs(inputs, store, input_dir=str(tmp_path))
+        assert encoded["title"] == "A paper"
+        decoded = decode_inputs(encoded, lambda digest, name: store.path(digest))
+        assert Path(decoded["text_path"]).read_text() == "text"
+        assert isinstance(decoded["audio"], MP3File)
+
+        with pytest.raises(ValueError):
+            encode_inputs({"value": object()}, store)
+
+    def test_strings_outside_input_dir_are_not_read(self, tmp_path):
+        store = ArtifactStore(str(tmp_path / "store"))
+        (tmp_path / "inputs").mkdir()
+        (tmp_path / "secret.txt").write_text("secret")
+        for input_dir in (None, str(tmp_path / "inputs")):
+            for path in (tmp_path / "secret.txt", tmp_path / "inputs" / ".." / "secret.txt"):
+                inputs = {"text_path": str(path)}
+                assert encode_inputs(inputs, store, input_dir) == inputs
+        assert not any(store.directory.iterdir())
+
+
+class TestRemoteWorkers:
+    @pytest.mark.asyncio
+    async def test_workers_are_registered_and_reaped_on_the_loop(self, tmp_path, make_pipeline):
+        server = Server(
+            pipelines={"default": make_pipeline(Narrate(tmp_path), "text_path")},
+            remote_workers=True,
+            worker_token="secret",
+            lease_timeout=1.0,
+            queue_path=str(tmp_path / "queue.db"),
+        )
+        worker_id = (await server._register_worker({"name": "w"}))["worker_id"]
+        assert await server._lease_job(worker_id) == {"job": None}
+        assert [w["name"] for w in (await server._list_workers())["workers"]] == ["w"]
+
+        server._remote_workers[worker_id]["last_seen"] -= 2
+        await server._follow_shared_queue_once()
+        assert (await server._list_workers())["workers"] == []
+        # A reaped worker must register again.
+        with pytest.raises(HTTPException) as e:
+            await server._worker_heartbeat(worker_id)
+        assert e.value.status_code == 404
+
+    def test_workers_lease_jobs_over_http(self, tmp_path, make_pipeline):
+        (tmp_path / "texts").mkdir()
+        (tmp_path / "server").mkdir()
+        documents = []
+        for i in range(6):
+            path = tmp_path / "texts" / f"paper{i}.txt"
+            path.write_text(f"paper {i}")
+            documents.append({"text_path": str(path)})
+
+        server = Server(
+            pipelines={"default": make_pipeline(Narrate(tmp_path), "text_path")},
+            remote_workers=True,
+            worker_token="secret",
+            input_dir=str(tmp_path / "texts"),
+            lease_timeout=1.5,
+            queue_path=str(tmp_path / "server" / "queue.db"),
+        )
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        http = uvicorn.Server(uvicorn.Config(server.app, port=port, log_level="warning"))
+        threads = [threading.Thread(target=http.run, daemon=True)]
+        threads[0].start()
+        workers = []
+        try:
+            deadline = time.monotonic() + 10
+            while not http.started:
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+
+            job_ids = requests.post(f"{url}/add_batch", json={"documents": documents}).json()[
+                "job_ids"
+            ]
+            for token in (None, "wrong"):
+                with pytest.raises(requests.HTTPError) as e:
+                    RemoteQueue(url, str(tmp_path / "rejected"), token=token).register()
+                assert e.value.response.status_code == 401
+
+            # A worker that leases a job and is lost before finishing it.
+            lost = RemoteQueue(url, str(tmp_path / "lost"), token="secret")
+            lost_id = lost.register("lost")["worker_id"]
+            lost_job = lost.claim(lost_id)
+
+            for i in range(2):
+                directory = tmp_path / f"worker{i}"
+                directory.mkdir()
+                queue = RemoteQueue(url, str(directory / "artifacts"), token="secret")
+                registration = queue.register(f"worker{i}", ["default"])
+                worker = Worker(
+                    {"default": make_pipeline(Narrate(directory), "text_path")},
+                    queue,
+                    registration["worker_id"],
+                    poll_interval=0.05,
+                    heartbeat_interval=registration["heartbeat_interval"],
+                )
+                workers.append(worker)
+                threads.append(threading.Thread(target=worker.run, daemon=True))
+                threads[-1].start()
+
+            def jobs():
+                return [requests.get(f"{url}/jobs/{job_id}").json() for job_id in job_ids]
+
+            deadline = time.monotonic() + 20
+            while not all(job["status"] == "done" for job in jobs()):
+                assert time.monotonic() < deadline, jobs()
+                time.sleep(0.1)
+
+            # The lost worker's job was leased again after its lease expired.
+            with pytest.raises(requests.HTTPError):
+                lost.finish(lost_job.id, lost_id)
+            registered = requests.get(
+                f"{url}/workers", headers={"Authorization": "Bearer secret"}
+            ).json()["workers"]
+            names = {w["name"] for w in registered}
+            assert names == {"worker0", "worker1"}
+        finally:
+            for worker in workers:
+                worker.stop()
+            http.should_exit = True
+            for thread in threads:
+                thread.join(10)
+
+        for i, job_id in enumerate(job_ids):
+            audio = Path(server.jobs.get(job_id).outputs["audio_path"])
+            # Outputs were uploaded to the server's artifact store.
+            assert audio.parent.parent == tmp_path / "server" / "artifacts"
+            assert audio.read_text() == f"PAPER {i}"
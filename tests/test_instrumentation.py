@@ -0,0 +1,220 @@
+import json
+from typing import AsyncIterable
+
+import pytest
+
+from papercast import instrumentation
+from papercast.base import BaseProcessor, BaseSubscriber, Production
+from papercast.instrumentation import (
+    Histogram,
+    HistogramSink,
+    Instrumentation,
+    JSONLinesSink,
+    OTLPSpanSink,
+    Sink,
+    StageEvent,
+)
+from papercast.pipelines import Pipeline
+
+
+class Source(BaseProcessor):
+    input_types = {"doc": str}
+    output_types = {"text": str}
+
+    def process(self, input: Production) -> Production:
+        input.text = input.doc * 2
+        return input
+
+
+class Failing(BaseProcessor):
+    input_types = {"text": str}
+    output_types = {"summary": str}
+
+    def process(self, input: Production) -> Production:
+        raise RuntimeError("boom")
+
+
+class Upper(BaseProcessor):
+    input_types = {"text": str}
+    output_types = {"summary": str}
+
+    def process(self, input: Production) -> Production:
+        input.summary = input.text.upper()
+        return input
+
+
+class ListSink(Sink):
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event: StageEvent) -> None:
+        self.events.append(event)
+
+
+class BrokenSink(Sink):
+    def emit(self, event: StageEvent) -> None:
+        raise OSError("disk full")
+
+
+def build_instrumented_pipeline(downstream=Upper, **kwargs) -> Pipeline:
+    pipeline = Pipeline("test", **kwargs)
+    pipeline.add_processor("source", Source())
+    pipeline.add_processor("summary", downstream())
+    pipeline.connect("source", "text", "summary", "text")
+    return pipeline
+
+
+class TestInstrumentation:
+    def test_events_per_stage_and_document(self):
+        sink = ListSink()
+        pipeline = build_instrumented_pipeline(instrumentation=Instrumentation([sink]))
+        pipeline.run(doc="ab")
+
+        kinds = [(e.kind, e.stage) for e in sink.events]
+        assert kinds == [
+            ("process", "source"),
+            ("process", "summary"),
+            ("document", "source"),
+        ]
+        source, summary, document = sink.events
+        assert source.input_size == 2 and source.output_size == 4
+        assert summary.output_size == 4
+        assert source.error is None and source.queued >= 0
+        assert source.end >= source.start
+        # One trace per document, with stages as children of the document span.
+        assert source.trace_id == summary.trace_id == document.trace_id
+        assert source.parent_id == summary.parent_id == document.span_id
+        assert document.parent_id is None
+
+    def test_records_errors(self):
+        sink = ListSink()
+        pipeline = build_instrumented_pipeline(Failing, instrumentation=Instrumentation([sink]))
+        with pytest.raises(RuntimeError):
+            pipeline.run(doc="ab")
+
+        failed = [e for e in sink.events if e.error is not None]
+        assert [(e.kind, e.stage) for e in failed] == [
+            ("process", "summary"),
+            ("document", "source"),
+        ]
+        assert failed[0].error == "RuntimeError: boom"
+
+    def test_run_many_traces_each_document(self):
+        sink = ListSink()
+        pipeline = build_instrumented_pipeline(instrumentation=Instrumentation([sink]))
+        pipeline.run_many([{"doc": "a"}, {"doc": "b"}])
+
+        documents = [e for e in sink.events if e.kind == "document"]
+        assert len(documents) == 2
+        assert documents[0].trace_id != documents[1].trace_id
+        for document in documents:
+            stages = [e for e in sink.events if e.parent_id == document.span_id]
+            assert sorted(e.stage for e in stages) == ["source", "summary"]
+
+    @pytest.mark.parametrize("run", ["run", "run_many"])
+    def test_no_ids_without_trace_sinks(self, run, monkeypatch):
+        class CountingSink(ListSink):
+            record_traces = False
+
+        def no_uuids():
+            raise AssertionError("made an ID")
+
+        monkeypatch.setattr(instrumentation.uuid, "uuid4", no_uuids)
+        sink = CountingSink()
+        pipeline = build_instrumented_pipeline(instrumentation=Instrumentation([sink]))
+        if run == "run":
+            pipeline.run(doc="ab")
+        else:
+            pipeline.run_many([{"doc": "a"}, {"doc": "b"}])
+
+        assert sink.events
+        assert all(e.trace_id is None and e.span_id is None for e in sink.events)
+
+    def test_broken_sink_does_not_fail_pipeline(self):
+        sink = ListSink()
+        pipeline = build_instrumented_pipeline(
+            instrumentation=Instrumentation([BrokenSink(), sink])
+        )
+        report = pipeline.run(doc="ab")
+        assert report.production.summary == "ABAB"
+        assert len(sink.events) == 3
+
+    @pytest.mark.asyncio
+    async def test_subscriber_waits_recorded_separately(self):
+        class Subscriber(BaseSubscriber):
+            output_types = {"text": str}
+
+            async def subscribe(self) -> AsyncIterable[Production]:
+                for text in ("a", "b"):
+                    yield Production(text=text)
+
+        sink = ListSink()
+        pipeline = Pipeline("test", instrumentation=Instrumentation([sink]))
+        pipeline.add_processor("subscriber", Subscriber())
+        pipeline.add_processor("summary", Upper())
+        pipeline.connect("subscriber", "text", "summary", "text")
+        await pipeline._run_subscriber("subscriber")
+
+        # The subscriber is read ahead of processing, so its waits interleave with documents.
+        kinds = [(e.kind, e.stage) for e in sink.events]
+        assert kinds.count(("subscribe", "subscriber")) == 2
+        assert [k for k in kinds if k[0] != "subscribe"] == [
+            ("process", "summary"),
+            ("document", "subscriber"),
+        ] * 2
+
+
+class TestSinks:
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1.0, float("inf")))
+        for value in (0.05, 0.05, 0.5, 5.0):
+            histogram.observe(value)
+        assert histogram.counts == [2, 1, 1]
+        assert histogram.quantile(0.5) == 0.1
+        assert histogram.quantile(0.75) == 1.0
+        assert histogram.quantile(1.0) == float("inf")
+
+    def test_histogram_sink(self):
+        sink = HistogramSink()
+        pipeline = build_instrumented_pipeline(instrumentation=Instrumentation([sink]))
+        for _ in range(3):
+            pipeline.run(doc="ab")
+        snapshot = sink.snapshot()
+        assert snapshot["test.summary.process"]["duration"]["count"] == 3
+        assert snapshot["test.summary.process"]["queued"]["count"] == 3
+        assert snapshot["test.source.document"]["errors"] == 0
+
+    def test_json_lines_sink(self, tmp_path):
+        path = tmp_path / "trace.jsonl"
+        sink = JSONLinesSink(str(path))
+        pipeline = build_instrumented_pipeline(instrumentation=Instrumentation([sink]))
+        pipeline.run(doc="ab")
+        sink.close()
+
+        events = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [e["stage"] for e in events] == ["source", "summary", "source"]
+        assert events[0]["output_size"] == 4
+
+    def test_otlp_sink_exports_spans(self, mocker):
+        post = mocker.patch("requests.post")
+        sink = OTLPSpanSink(endpoint="http://collector/v1/traces", interval=0.01)
+        pipeline = build_instrumented_pipeline(Failing, instrumentation=Instrumentation([sink]))
+        with pytest.raises(RuntimeError):
+            pipeline.run(doc="ab")
+        sink.close()
+
+        spans = [
+            span
+            for call in post.call_args_list
+            for span in call.kwargs["json"]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        ]
+        assert post.call_args.args == ("http://collector/v1/traces",)
+        assert [span["name"] for span in spans] == [
+            "test.source",
+            "test.summary",
+            "test.source",
+        ]
+        assert spans[1]["status"] == {"code": 2, "message": "RuntimeError: boom"}
+        assert spans[0]["parentSpanId"] == spans[2]["spanId"]
+        assert len({span["traceId"] for span in spans}) == 1
+        assert int(spans[0]["endTimeUnixNano"]) >= int(spans[0]["startTimeUnixNano"])
@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from papercast.jobs import (
+    Job,
+    JobStatus,
+    JobStore,
+    QueueFullError,
+    SubscriberMux,
+    WorkQueue,
+)
+
+
+class TestWorkQueue:
+    @pytest.mark.asyncio
+    async def test_workers_bound_concurrency(self):
+        active = 0
+        peak = 0
+
+        async def handler(item):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        queue = WorkQueue("test", handler, max_size=10, workers=3)
+        for i in range(10):
+            queue.submit(i)
+        assert await queue.drain(timeout=5)
+
+        assert peak == 3
+
+    @pytest.mark.asyncio
+    async def test_failed_items_do_not_stop_workers(self):
+        handled = []
+
+        async def handler(item):
+            if item == 0:
+                raise RuntimeError("boom")
+            handled.append(item)
+
+        queue = WorkQueue("test", handler, workers=1)
+        queue.submit(0)
+        queue.submit(1)
+        await queue.drain(timeout=5)
+
+        assert handled == [1]
+
+    @pytest.mark.asyncio
+    async def test_submit_after_drain_is_rejected(self):
+        async def handler(item):
+            pass
+
+        queue = WorkQueue("test", handler)
+        await queue.drain()
+
+        with pytest.raises(QueueFullError):
+            queue.submit(1)
+
+    @pytest.mark.asyncio
+    async def test_drain_timeout_abandons_pending_items(self):
+        async def handler(item):
+            await asyncio.sleep(10)
+
+        queue = WorkQueue("test", handler, workers=1)
+        queue.submit(1)
+        await asyncio.sleep(0)
+
+        assert not await queue.drain(timeout=0.05)
+
+
+async def feed(items, fetched=None):
+    for item in items:
+        if fetched is not None:
+            fetched.append(item)
+        yield item
+
+
+class TestSubscriberMux:
+    @pytest.mark.asyncio
+    async def test_subscriber_reads_ahead_of_processing(self):
+        fetched = []
+        handled = []
+
+        async def handler(name, item):
+            await asyncio.sleep(0.02)
+            handled.append(item)
+
+        mux = SubscriberMux("test", handler, workers=1, prefetch=2)
+        task = asyncio.create_task(mux.run({"feed": feed(range(6), fetched)}))
+        await asyncio.sleep(0.01)
+        # One document is being handled and two are buffered; the feed waits for room.
+        assert fetched == [0, 1, 2]
+        assert mux.depth == 2
+        await task
+        assert handled == list(range(6))
+
+    @pytest.mark.asyncio
+    async def test_workers_are_shared_across_subscribers(self):
+        active = 0
+        peak = 0
+
+        async def handler(name, item):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        mux = SubscriberMux("test", handler, workers=3)
+        await mux.run({"a": feed(range(10)), "b": feed(range(10))})
+        assert peak == 3
+
+    @pytest.mark.asyncio
+    async def test_subscribers_take_turns(self):
+        handled = []
+
+        async def handler(name, item):
+            handled.append(name)
+            await asyncio.sleep(0)
+
+        mux = SubscriberMux("test", handler, workers=1, prefetch=5)
+        await mux.run({"chatty": feed(range(20)), "quiet": feed(range(3))})
+        assert handled[:6] == ["chatty", "quiet"] * 3
+        assert handled.count("chatty") == 20
+
+    @pytest.mark.asyncio
+    async def test_failures_do_not_stop_other_documents(self):
+        handled = []
+
+        async def broken():
+            yield 1
+            raise ConnectionError("feed unavailable")
+
+        async def handler(name, item):
+            if item == 0:
+                raise RuntimeError("boom")
+            handled.append((name, item))
+
+        mux = SubscriberMux("test", handler, workers=1)
+        await mux.run({"broken": broken(), "feed": feed(range(3))})
+        assert sorted(handled) == [("broken", 1), ("feed", 1), ("feed", 2)]
+
+    def test_rejects_no_prefetch(self):
+        with pytest.raises(ValueError):
+            SubscriberMux("test", None, prefetch=0)
+
+
+class TestJobStore:
+    def test_prunes_finished_jobs_after_retention(self):
+        store = JobStore(retention=10)
+        old = Job(pipeline="default", inputs={})
+        running = Job(pipeline="default", inputs={})
+        store.add(old)
+        store.add(running)
+        old.fail(RuntimeError("boom"))
+        running.start()
+
+        store.prune(now=old.finished_at + 11)
+
+        assert store.get(old.id) is None
+        assert store.get(running.id) is running
+
+    def test_drops_oldest_finished_jobs_over_capacity(self):
+        store = JobStore(max_jobs=2)
+        jobs = [Job(pipeline="default", inputs={}) for _ in range(3)]
+        for job in jobs[:2]:
+            store.add(job)
+            job.status = JobStatus.DONE
+            job.finished_at = job.submitted_at
+        store.add(jobs[2])
+
+        assert store.get(jobs[0].id) is None
+        assert len(store) == 2
@@ -0,0 +1,279 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import pytest
+
+from papercast.base import BaseProcessor, Production
+from papercast.checkpoints import Checkpoint, CheckpointStore
+from papercast.jobs import Job, JobStatus
+from papercast.journal import JobJournal
+from papercast.pipelines import Pipeline
+from papercast.server import Server
+from papercast.types import MP3File
+
+
+class DictCheckpoint(Checkpoint):
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def get(self, stage: str) -> Optional[Dict[str, Any]]:
+        return self.stages.get(stage)
+
+    def save(self, stage: str, outputs: Dict[str, Any]) -> None:
+        self.stages[stage] = outputs
+
+
+class Download(BaseProcessor):
+    input_types = {"arxiv_id": str}
+    output_types = {"pdf_path": str}
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def process(self, input: Production) -> Production:
+        self.calls += 1
+        input.pdf_path = f"data/{input.arxiv_id}.pdf"
+        return input
+
+
+class Narrate(BaseProcessor):
+    input_types = {"pdf_path": str}
+    output_types = {"mp3_path": str}
+
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.failures = failures
+        self.calls = 0
+
+    def process(self, input: Production) -> Production:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("TTS unavailable")
+        input.mp3_path = input.pdf_path.replace(".pdf", ".mp3")
+        return input
+
+
+def build_resumable_pipeline(failures: int = 0) -> Pipeline:
+    pipeline = Pipeline("test")
+    pipeline.add_processor("download", Download())
+    pipeline.add_processor("narrate", Narrate(failures))
+    pipeline.connect("download", "pdf_path", "narrate", "pdf_path")
+    return pipeline
+
+
+class TestCheckpointResume:
+    @pytest.mark.parametrize("scheduler", ["sequential", "concurrent"])
+    def test_run_resumes_after_failed_stage(self, scheduler):
+        pipeline = build_resumable_pipeline(failures=1)
+        pipeline.scheduler = scheduler
+        checkpoint = DictCheckpoint()
+
+        with pytest.raises(RuntimeError):
+            pipeline.run(checkpoint=checkpoint, arxiv_id="2301.00001")
+        assert checkpoint.stages == {"download": {"pdf_path": "data/2301.00001.pdf"}}
+
+        report = pipeline.run(checkpoint=checkpoint, arxiv_id="2301.00001")
+        assert report.production.mp3_path == "data/2301.00001.mp3"
+        assert pipeline.processors["download"].calls == 1
+        assert pipeline.processors["narrate"].calls == 2
+        assert report.timings["download"].cached
+
+    def test_run_many_resumes(self):
+        pipeline = build_resumable_pipeline()
+        checkpoint = DictCheckpoint()
+        checkpoint.save("download", {"pdf_path": "data/cached.pdf"})
+
+        reports = pipeline.run_many(
+            [{"arxiv_id": "a"}, {"arxiv_id": "b"}], checkpoints=[checkpoint, None]
+        )
+        assert reports[0].production.mp3_path == "data/cached.mp3"
+        assert reports[1].production.mp3_path == "data/b.mp3"
+        assert pipeline.processors["download"].calls == 1
+        assert checkpoint.stages["narrate"] == {"mp3_path": "data/cached.mp3"}
+
+
+class TestJobJournal:
+    def test_records_and_finishes_jobs(self, tmp_path):
+        journal = JobJournal(str(tmp_path / "journal.db"))
+        job = Job(pipeline="default", inputs={"arxiv_id": "2301.00001"})
+        journal.record_submitted([job])
+        journal.record_stage(job.id, "download", {"pdf_path": "a.pdf"})
+        journal.close()
+
+        # A new process sees the unfinished job and its finished stages.
+        journal = JobJournal(str(tmp_path / "journal.db"))
+        [replayed] = journal.unfinished()
+        assert replayed.id == job.id
+        assert replayed.inputs == {"arxiv_id": "2301.00001"}
+        assert journal.checkpoint(job.id).get("download") == {"pdf_path": "a.pdf"}
+
+        replayed.succeed(Production())
+        journal.record_finished(replayed)
+        assert journal.unfinished() == []
+        assert journal.stages(job.id) == {}
+
+        journal.prune(now=replayed.finished_at + journal.retention + 1)
+        assert journal._db.execute("SELECT COUNT(*) FROM jobs").fetchone() == (0,)
+
+    def test_keeps_priority(self, tmp_path):
+        path = str(tmp_path / "journal.db")
+        journal = JobJournal(path)
+        journal.record_submitted(
+            [Job(pipeline="default", inputs={"arxiv_id": "a"}, priority="interactive")]
+        )
+        assert [job.priority for job in journal.unfinished()] == ["interactive"]
+        # A journal written before priorities were recorded.
+        journal._db.execute("ALTER TABLE jobs DROP COLUMN priority")
+        journal.close()
+
+        journal = JobJournal(path)
+        journal.record_submitted(
+            [Job(pipeline="default", inputs={"arxiv_id": "b"}, priority="bulk")]
+        )
+        assert [job.priority for job in journal.unfinished()] == ["normal", "bulk"]
+
+    @pytest.mark.asyncio
+    async def test_server_resumes_unfinished_jobs(self, tmp_path):
+        path = str(tmp_path / "journal.db")
+
+        # The first server accepted two documents and finished downloading one of them.
+        journal = JobJournal(path)
+        first = Job(pipeline="default", inputs={"arxiv_id": "a"})
+        second = Job(pipeline="default", inputs={"arxiv_id": "b"})
+        journal.record_submitted([first, second])
+        journal.record_started(first)
+        journal.record_stage(first.id, "download", {"pdf_path": "data/a.pdf"})
+        journal.close()
+
+        pipeline = build_resumable_pipeline()
+        server = Server(pipelines={"default": pipeline}, journal=JobJournal(path))
+        await server._replay_journal()
+        await server._drain_queues()
+
+        assert pipeline.processors["download"].calls == 1
+        assert pipeline.processors["narrate"].calls == 2
+        for job in (first, second):
+            status = await server._get_job(job.id)
+            assert status["status"] == JobStatus.DONE.value
+        assert (await server._get_job(first.id))["outputs"] == {
+            "pdf_path": "data/a.pdf",
+            "mp3_path": "data/a.mp3",
+        }
+        assert server.journal.unfinished() == []
+
+    @pytest.mark.asyncio
+    async def test_server_journals_submissions(self, tmp_path):
+        pipeline = build_resumable_pipeline(failures=1)
+        server = Server(
+            pipelines={"default": pipeline},
+            journal=JobJournal(str(tmp_path / "journal.db")),
+        )
+        job_id = (await server._add({"arxiv_id": "a"}))["job_id"]
+        assert [job.id for job in server.journal.unfinished()] == [job_id]
+        await server._drain_queues()
+
+        assert (await server._get_job(job_id))["status"] == JobStatus.FAILED.value
+        assert server.journal.unfinished() == []
+
+    @pytest.mark.asyncio
+    async def test_slow_journal_does_not_block_the_loop(self, tmp_path):
+        class SlowJournal(JobJournal):
+            def record_started(self, job):
+                time.sleep(0.3)
+                super().record_started(job)
+
+            def record_finished(self, job):
+                time.sleep(0.3)
+                super().record_finished(job)
+
+        server = Server(
+            pipelines={"default": build_resumable_pipeline()},
+            journal=SlowJournal(str(tmp_path / "journal.db")),
+        )
+        gaps = []
+
+        async def tick():
+            while True:
+                start = time.monotonic()
+                await asyncio.sleep(0.01)
+                gaps.append(time.monotonic() - start)
+
+        ticker = asyncio.create_task(tick())
+        job_id = (await server._add({"arxiv_id": "a"}))["job_id"]
+        await server._drain_queues()
+        ticker.cancel()
+
+        assert (await server._get_job(job_id))["status"] == JobStatus.DONE.value
+        assert server.journal.unfinished() == []
+        assert max(gaps) < 0.2
+
+
+class TestCheckpointStore:
+    def test_run_resumes_from_store(self, tmp_path):
+        store = CheckpointStore(str(tmp_path / "checkpoints"))
+        pipeline = build_resumable_pipeline(failures=1)
+        pipeline.checkpoint_store = store
+
+        with pytest.raises(RuntimeError):
+            pipeline.run(arxiv_id="2301.00001")
+        report = pipeline.run(arxiv_id="2301.00001")
+        assert report.production.mp3_path == "data/2301.00001.mp3"
+        assert pipeline.processors["download"].calls == 1
+        assert report.timings["download"].cached
+
+        # Checkpoints are removed once the document succeeds.
+        assert list((tmp_path / "checkpoints").glob("*/*.pkl")) == []
+        pipeline.run(arxiv_id="2301.00001")
+        assert pipeline.processors["download"].calls == 2
+
+    def test_different_inputs_do_not_share_checkpoints(self, tmp_path):
+        store = CheckpointStore(str(tmp_path))
+        a = store.checkpoint("test", "download", {"arxiv_id": "a"})
+        a.save("download", {"pdf_path": "a.pdf"})
+        assert store.checkpoint("test", "download", {"arxiv_id": "a"}).get("download")
+        assert store.checkpoint("test", "download", {"arxiv_id": "b"}).get("download") is None
+        assert store.checkpoint("other", "download", {"arxiv_id": "a"}).get("download") is None
+
+    def test_ignores_outputs_with_missing_files(self, tmp_path):
+        store = CheckpointStore(str(tmp_path / "checkpoints"))
+        checkpoint = store.checkpoint("test", "download", {"arxiv_id": "a"})
+        audio = tmp_path / "a.mp3"
+        audio.write_bytes(b"mp3")
+        checkpoint.save("narrate", {"mp3": MP3File(audio)})
+        assert checkpoint.get("narrate")["mp3"].path == audio
+
+        audio.unlink()
+        assert checkpoint.get("narrate") is None
+
+    def test_gc_by_size(self, tmp_path):
+        store = CheckpointStore(str(tmp_path), max_bytes=1000)
+        for i in range(20):
+            store.checkpoint("test", "download", {"arxiv_id": str(i)}).save(
+                "download", {"text": "x" * 200}
+            )
+        store.gc()
+        total = sum(p.stat().st_size for p in tmp_path.glob("*/*.pkl"))
+        assert 0 < total <= 1000
+
+    def test_stages_do_not_scan_the_store(self, tmp_path, monkeypatch):
+        store = CheckpointStore(str(tmp_path))
+        store.backend.set("warm", {"v": 1})
+        scans = []
+        entries = store.backend._entries
+        monkeypatch.setattr(store.backend, "_entries", lambda: scans.append(1) or entries())
+        pipeline = build_resumable_pipeline(failures=1)
+        pipeline.checkpoint_store = store
+
+        with pytest.raises(RuntimeError):
+            pipeline.run(arxiv_id="2301.00001")
+        pipeline.run(arxiv_id="2301.00001")
+        assert scans == []
+
+    def test_unhashable_inputs_run_without_checkpoint(self, tmp_path):
+        pipeline = build_resumable_pipeline()
+        pipeline.checkpoint_store = CheckpointStore(str(tmp_path))
+        production = Production(pdf_path="data/2301.00001.pdf", client=object())
+        report = pipeline.process(production, "download")
+        assert report.production.mp3_path == "data/2301.00001.mp3"
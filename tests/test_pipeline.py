@@ -1,8 +1,12 @@
+import asyncio
+import time
+
 import pytest
 from typing import Any, List, Union, Dict
 
 from papercast.pipelines import Pipeline
-from papercast.base import BaseProcessor, Production
+from papercast.plan import Routes
+from papercast.base import AsyncProcessor, BaseProcessor, BaseSubscriber, Production
 
 
 class MyClass:
@@ -95,3 +99,371 @@ class TestPipeline:
         )
 
         assert sorted_processors == ["test", "test2", "test3", "test4"]
+
+    def test_invalid_scheduler(self):
+        with pytest.raises(ValueError):
+            Pipeline("default", scheduler="unknown")
+
+    def test_concurrent_scheduler_runs_branches_in_parallel(self):
+        "Independent branches should overlap, so wall time tracks the critical path."
+
+        class Source(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"value": int}
+
+            def process(self, input: Production) -> Production:
+                input.value = input.input1
+                return input
+
+        class Sleeper(BaseProcessor):
+            input_types = {"value": int}
+
+            def __init__(self, output: str, delay: float):
+                super().__init__()
+                self.output = output
+                self.delay = delay
+                self.output_types = {output: int}
+
+            def process(self, input: Production) -> Production:
+                time.sleep(self.delay)
+                return Production(**{self.output: input.value + 1})
+
+        class Joiner(BaseProcessor):
+            input_types = {"left": int, "right": int}
+            output_types = {"total": int}
+
+            def process(self, input: Production) -> Production:
+                input.total = input.left + input.right
+                return input
+
+        pipeline = Pipeline("default", scheduler="concurrent")
+        pipeline.add_processor("source", Source())
+        pipeline.add_processor("left", Sleeper("left", 0.2))
+        pipeline.add_processor("right", Sleeper("right", 0.1))
+        pipeline.add_processor("join", Joiner())
+        pipeline.connect("source", "value", "left", "value")
+        pipeline.connect("source", "value", "right", "value")
+        pipeline.connect("left", "left", "join", "left")
+        pipeline.connect("right", "right", "join", "right")
+
+        report = pipeline.run(input1=1)
+
+        assert report.production.total == 4
+        assert report.critical_path == ["source", "left", "join"]
+        assert report.wall_time < 0.28
+        assert report.timings["right"].start < report.timings["left"].end
+
+    def test_sequential_scheduler_reports_timings(self):
+        class MyProcessor(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"input1": int}
+
+            def process(self, input: Production) -> Production:
+                return Production(input1=input.input1 + 1)
+
+        pipeline = Pipeline("default")
+        pipeline.add_processor("a", MyProcessor())
+        pipeline.add_processor("b", MyProcessor())
+        pipeline.add_processor("c", MyProcessor())
+        pipeline.connect("a", "input1", "b", "input1")
+        pipeline.connect("b", "input1", "c", "input1")
+
+        report = pipeline.run(input1=0)
+
+        assert report.production.input1 == 3
+        assert set(report.timings) == {"a", "b", "c"}
+        assert report.critical_path == ["a", "b", "c"]
+        assert report.critical_path_time <= report.wall_time
+
+    def test_compile_caches_and_invalidates_plan(self):
+        class MyProcessor(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"output": int}
+
+            def process(self, input: Production) -> Production:
+                return input
+
+        processor = MyProcessor()
+        pipeline = Pipeline("default")
+        pipeline.add_processor("a", processor)
+        pipeline.add_processor("b", processor)
+        pipeline.add_processor("c", processor)
+        pipeline.connect("a", "output", "b", "input1")
+        pipeline.connect("a", "output", "c", "input1")
+
+        plan = pipeline.compile("a")
+        assert pipeline.compile("a") is plan
+        assert set(plan.stages) == {"b", "c"}
+        assert plan.upstream["b"] == frozenset()
+        assert [(b.source, b.output, b.input) for b in plan.bindings["c"]] == [
+            ("a", "output", "input1")
+        ]
+
+        pipeline.add_processor("d", processor)
+        pipeline.connect("b", "output", "d", "input1")
+        new_plan = pipeline.compile("a")
+
+        assert new_plan is not plan
+        assert new_plan.stages.index("d") > new_plan.stages.index("b")
+        assert new_plan.downstream["b"] == ("d",)
+        assert new_plan.upstream["d"] == frozenset({"b"})
+
+    def test_run_reports_stage_events(self):
+        class MyProcessor(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"input1": int}
+
+            def process(self, input: Production) -> Production:
+                return input
+
+        pipeline = Pipeline("default")
+        pipeline.add_processor("a", MyProcessor())
+        pipeline.add_processor("b", MyProcessor())
+        pipeline.connect("a", "input1", "b", "input1")
+
+        events = []
+        pipeline.run(
+            on_stage=lambda name, timing: events.append((name, timing is None)),
+            input1=0,
+        )
+
+        assert events == [("a", True), ("a", False), ("b", True), ("b", False)]
+
+    def test_run_many_batches_and_falls_back_to_process(self):
+        class Collector(BaseProcessor):
+            input_types = {"doc_id": int}
+            output_types = {"doc_id": int}
+
+            def process(self, input: Production) -> Production:
+                return input
+
+        class Fetcher(BaseProcessor):
+            input_types = {"doc_id": int}
+            output_types = {"text": str}
+
+            def __init__(self):
+                super().__init__()
+                self.batches = []
+
+            def process(self, input: Production) -> Production:
+                raise AssertionError("process_batch should be used")
+
+            def process_batch(self, inputs, **kwargs):
+                self.batches.append([i.doc_id for i in inputs])
+                return [Production(text=f"doc {i.doc_id}") for i in inputs]
+
+        class Narrator(BaseProcessor):
+            input_types = {"text": str}
+            output_types = {"audio": str}
+
+            def process(self, input: Production) -> Production:
+                if input.text == "doc 2":
+                    raise RuntimeError("boom")
+                input.audio = input.text.upper()
+                return input
+
+        fetcher = Fetcher()
+        pipeline = Pipeline("default")
+        pipeline.add_processor("collector", Collector())
+        pipeline.add_processor("fetcher", fetcher)
+        pipeline.add_processor("narrator", Narrator())
+        pipeline.connect("collector", "doc_id", "fetcher", "doc_id")
+        pipeline.connect("fetcher", "text", "narrator", "text")
+
+        reports = pipeline.run_many([{"doc_id": i} for i in range(4)])
+
+        assert fetcher.batches == [[0, 1, 2, 3]]
+        assert [r.error is None for r in reports] == [True, True, False, True]
+        assert reports[3].production.audio == "DOC 3"
+        assert reports[0].critical_path == ["collector", "fetcher", "narrator"]
+        assert "narrator" not in reports[2].timings
+
+    def test_run_many_requires_shared_options(self):
+        class MyProcessor(BaseProcessor):
+            input_types = {"input1": int}
+
+            def process(self, input: Production, **kwargs) -> Production:
+                return input
+
+        pipeline = Pipeline("default")
+        pipeline.add_processor("a", MyProcessor())
+
+        with pytest.raises(ValueError):
+            pipeline.run_many([{"input1": 1, "speed": 1}, {"input1": 2, "speed": 2}])
+
+    def test_async_processors_run_on_the_event_loop(self):
+        "Async stages should overlap without needing an executor thread each."
+
+        class Source(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"value": int}
+
+            def process(self, input: Production) -> Production:
+                input.value = input.input1
+                return input
+
+        class Fetch(AsyncProcessor):
+            input_types = {"value": int}
+
+            def __init__(self, output: str):
+                super().__init__()
+                self.output = output
+                self.output_types = {output: int}
+
+            async def aprocess(self, input: Production) -> Production:
+                await asyncio.sleep(0.1)
+                setattr(input, self.output, input.value)
+                return input
+
+        pipeline = Pipeline("default", scheduler="concurrent", max_workers=1)
+        pipeline.add_processor("source", Source())
+        for i in range(10):
+            pipeline.add_processor(f"fetch{i}", Fetch(f"out{i}"))
+            pipeline.connect("source", "value", f"fetch{i}", "value")
+
+        report = pipeline.run(input1=3)
+
+        assert all(getattr(report.production, f"out{i}") == 3 for i in range(10))
+        assert report.wall_time < 0.5
+
+    @pytest.mark.asyncio
+    async def test_arun_and_sync_run_inside_event_loop(self):
+        class Double(AsyncProcessor):
+            input_types = {"input1": int}
+            output_types = {"input1": int}
+
+            async def aprocess(self, input: Production) -> Production:
+                return Production(input1=input.input1 * 2)
+
+        pipeline = Pipeline("default")
+        pipeline.add_processor("a", Double())
+        pipeline.add_processor("b", Double())
+        pipeline.connect("a", "input1", "b", "input1")
+
+        report = await pipeline.arun(input1=1)
+        assert report.production.input1 == 4
+
+        report = pipeline.run(input1=2)
+        assert report.production.input1 == 8
+
+    def test_connections_route_outputs_to_inputs(self):
+        "Each processor should see only its connected inputs, under its own input names."
+
+        class Grobid(BaseProcessor):
+            input_types = {"pdf": str}
+            output_types = {"abstract": str, "text": str}
+
+            def process(self, input: Production) -> Production:
+                input.abstract = f"abstract of {input.pdf}"
+                input.text = f"text of {input.pdf}"
+                return input
+
+        class Publisher(BaseProcessor):
+            input_types = {"description": str}
+            output_types = {"url": str}
+
+            def process(self, input: Production) -> Production:
+                self.seen = dict(vars(input))
+                input.url = "https://example.com"
+                return input
+
+        publisher = Publisher()
+        pipeline = Pipeline("default")
+        pipeline.add_processor("grobid", Grobid())
+        pipeline.add_processor("pages", publisher)
+        pipeline.connect("grobid", "abstract", "pages", "description")
+
+        report = pipeline.run(pdf="paper.pdf")
+
+        assert publisher.seen == {"description": "abstract of paper.pdf"}
+        assert report.production.url == "https://example.com"
+        assert report.production.abstract == "abstract of paper.pdf"
+        assert not hasattr(report.production, "description")
+
+    def test_branches_do_not_see_each_others_changes(self):
+        class Source(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"value": int}
+
+            def process(self, input: Production) -> Production:
+                input.value = input.input1
+                return input
+
+        class Branch(BaseProcessor):
+            input_types = {"value": int}
+
+            def __init__(self, output: str):
+                super().__init__()
+                self.output = output
+                self.output_types = {output: int}
+
+            def process(self, input: Production) -> Production:
+                setattr(input, self.output, input.value)
+                input.value = -1
+                return input
+
+        pipeline = Pipeline("default", scheduler="concurrent")
+        pipeline.add_processor("source", Source())
+        pipeline.add_processor("left", Branch("left"))
+        pipeline.add_processor("right", Branch("right"))
+        pipeline.connect("source", "value", "left", "value")
+        pipeline.connect("source", "value", "right", "value")
+
+        report = pipeline.run(input1=3)
+
+        assert (report.production.left, report.production.right) == (3, 3)
+        assert report.production.value == 3
+
+    def test_routes_drop_outputs_after_last_consumer(self):
+        class MyProcessor(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"output": int}
+
+            def process(self, input: Production) -> Production:
+                return input
+
+        pipeline = Pipeline("default")
+        for name in "abcd":
+            pipeline.add_processor(name, MyProcessor())
+        pipeline.connect("a", "output", "b", "input1")
+        pipeline.connect("b", "output", "c", "input1")
+        pipeline.connect("b", "output", "d", "input1")
+        plan = pipeline.compile("a")
+        assert plan.consumers == {("a", "output"): 1, ("b", "output"): 2}
+
+        routes = Routes(plan)
+        document = {"output": 1}
+        assert routes.inputs("b", document) == {"input1": 1}
+        routes.finish("b", {"output": 2}, document)
+        assert routes.inputs("c", document) == {"input1": 2}
+        routes.finish("c", {"output": 3}, document)
+        assert routes.outputs["b"] == {"output": 2}
+        routes.finish("d", {"output": 4}, document)
+        assert routes.outputs["b"] == {}
+
+    @pytest.mark.asyncio
+    async def test_subscriber_documents_processed_concurrently(self):
+        class Feed(BaseSubscriber):
+            output_types = {"doc": str}
+
+            async def subscribe(self):
+                for doc in "abcd":
+                    yield Production(doc=doc)
+
+        class Slow(BaseProcessor):
+            input_types = {"doc": str}
+            output_types = {"doc": str}
+
+            def process(self, input: Production) -> Production:
+                time.sleep(0.05)
+                return input
+
+        pipeline = Pipeline(
+            "default", max_workers=4, subscriber_workers=4, subscriber_prefetch=4
+        )
+        pipeline.add_processor("feed", Feed())
+        pipeline.add_processor("slow", Slow())
+        pipeline.connect("feed", "doc", "slow", "doc")
+        start = time.perf_counter()
+        await pipeline._run_in_server()
+        assert time.perf_counter() - start < 0.15
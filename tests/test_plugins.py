@@ -0,0 +1,107 @@
+import json
+import sys
+
+import pytest
+
+import papercast.processors
+from papercast import plugin_utils
+
+PLUGIN = """
+from papercast.base import BaseProcessor
+
+
+class {name}(BaseProcessor):
+    input_types = {{"pdf": str}}
+    output_types = {{"text": str}}
+
+    def process(self, input):
+        return input
+"""
+
+
+@pytest.fixture
+def plugins(tmp_path, monkeypatch):
+    "Install two processor plugins, each in its own module."
+    site = tmp_path / "site-packages"
+    dist_info = site / "fake_plugins-0.1.dist-info"
+    dist_info.mkdir(parents=True)
+    (dist_info / "METADATA").write_text("Metadata-Version: 2.1\nName: fake-plugins\nVersion: 0.1\n")
+    (dist_info / "entry_points.txt").write_text(
+        "[papercast.processors]\n"
+        "FakePDFProcessor = fake_pdf:FakePDFProcessor\n"
+        "FakeTTSProcessor = fake_tts:FakeTTSProcessor\n"
+    )
+    (site / "fake_pdf.py").write_text(PLUGIN.format(name="FakePDFProcessor"))
+    (site / "fake_tts.py").write_text(PLUGIN.format(name="FakeTTSProcessor"))
+    monkeypatch.syspath_prepend(str(site))
+    monkeypatch.setenv("PAPERCAST_PLUGIN_INDEX", str(tmp_path / "index.json"))
+    plugin_utils.plugin_index.cache_clear()
+    yield site
+    plugin_utils.plugin_index.cache_clear()
+    for name in ("FakePDFProcessor", "FakeTTSProcessor"):
+        vars(papercast.processors).pop(name, None)
+    for module in ("fake_pdf", "fake_tts"):
+        sys.modules.pop(module, None)
+
+
+class TestLazyPlugins:
+    def test_imports_only_the_plugin_accessed(self, plugins):
+        from papercast.processors import FakePDFProcessor
+
+        assert FakePDFProcessor.__module__ == "fake_pdf"
+        assert "fake_tts" not in sys.modules
+        assert {"FakePDFProcessor", "FakeTTSProcessor"} <= set(dir(papercast.processors))
+        assert vars(papercast.processors)["FakePDFProcessor"] is FakePDFProcessor
+
+    def test_star_import_imports_every_plugin(self, plugins):
+        namespace = {}
+        exec("from papercast.processors import *", namespace)
+        assert namespace["FakePDFProcessor"].__module__ == "fake_pdf"
+        assert namespace["FakeTTSProcessor"].__module__ == "fake_tts"
+
+    def test_unknown_attribute(self, plugins):
+        with pytest.raises(AttributeError):
+            papercast.processors.MissingProcessor
+        with pytest.raises(ImportError):
+            from papercast.processors import MissingProcessor  # noqa: F401
+
+    def test_validates_plugins(self, plugins):
+        (plugins / "fake_tts.py").write_text("class FakeTTSProcessor:\n    pass\n")
+        with pytest.raises(TypeError):
+            papercast.processors.FakeTTSProcessor
+
+    def test_load_plugins(self, plugins):
+        assert set(plugin_utils.load_plugins("processors")) == {
+            "FakePDFProcessor",
+            "FakeTTSProcessor",
+        }
+
+
+class TestPluginIndex:
+    def test_index_is_cached_on_disk(self, plugins, monkeypatch):
+        index = plugin_utils.plugin_index()
+        assert index["processors"]["FakePDFProcessor"] == "fake_pdf:FakePDFProcessor"
+        assert (plugins.parent / "index.json").exists()
+
+        plugin_utils.plugin_index.cache_clear()
+        monkeypatch.setattr(plugin_utils, "_scan_entry_points", pytest.fail)
+        assert plugin_utils.plugin_index() == index
+
+    def test_index_rebuilt_when_packages_change(self, plugins):
+        plugin_utils.plugin_index()
+        extra = plugins / "extra-0.1.dist-info"
+        extra.mkdir()
+        (extra / "METADATA").write_text("Metadata-Version: 2.1\nName: extra\nVersion: 0.1\n")
+        (extra / "entry_points.txt").write_text(
+            "[papercast.subscribers]\nFakeSubscriber = fake_sub:FakeSubscriber\n"
+        )
+        plugin_utils.plugin_index.cache_clear()
+        assert "FakeSubscriber" in plugin_utils.plugin_index()["subscribers"]
+
+    def test_refresh(self, plugins):
+        plugin_utils.plugin_index()
+        index = plugins.parent / "index.json"
+        index.write_text(json.dumps({**json.loads(index.read_text()), "plugins": {}}))
+        plugin_utils.plugin_index.cache_clear()
+        assert plugin_utils.plugin_index() == {}
+        assert "processors" in plugin_utils.refresh_plugin_index()
@@ -0,0 +1,264 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from papercast.base import AsyncProcessor, BaseProcessor, Production
+from papercast.pipelines import Pipeline
+from papercast.policies import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    StageTimeoutError,
+)
+from papercast.resources import ResourcePool
+from papercast.server import Server
+
+
+class Source(BaseProcessor):
+    input_types = {"doc": str}
+    output_types = {"text": str}
+
+    def process(self, input: Production) -> Production:
+        input.text = input.doc
+        return input
+
+
+class Flaky(BaseProcessor):
+    input_types = {"text": str}
+    output_types = {"summary": str}
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.calls = 0
+
+    def process(self, input: Production) -> Production:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("GROBID unavailable")
+        input.summary = input.text.upper()
+        return input
+
+
+class Slow(BaseProcessor):
+    input_types = {"text": str}
+    output_types = {"summary": str}
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+        self.finished = threading.Event()
+
+    def process(self, input: Production) -> Production:
+        time.sleep(self.delay)
+        self.finished.set()
+        input.summary = input.text
+        return input
+
+
+class AsyncSlow(AsyncProcessor):
+    input_types = {"text": str}
+    output_types = {"summary": str}
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled = False
+
+    async def aprocess(self, input: Production, **kwargs) -> Production:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return input
+
+
+class FlakyBatch(Flaky):
+    def process_batch(self, inputs, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("GROBID unavailable")
+        for input in inputs:
+            input.summary = input.text.upper()
+        return inputs
+
+
+class SlowBatch(Slow):
+    def process_batch(self, inputs, **kwargs):
+        return [self.process(input) for input in inputs]
+
+
+class AsyncBatch(AsyncSlow):
+    async def process_batch(self, inputs, **kwargs):
+        for input in inputs:
+            input.summary = input.text
+        return inputs
+
+
+def build_policy_pipeline(processor, **policy) -> Pipeline:
+    pipeline = Pipeline("test")
+    pipeline.add_processor("source", Source())
+    pipeline.add_processor("summary", processor, **policy)
+    pipeline.connect("source", "text", "summary", "text")
+    return pipeline
+
+
+class TestRetry:
+    def test_retries_until_success(self):
+        flaky = Flaky(failures=2)
+        pipeline = build_policy_pipeline(flaky, retry=RetryPolicy(attempts=3, backoff=0.001))
+        report = pipeline.run(doc="ab")
+        assert report.production.summary == "AB"
+        assert flaky.calls == 3
+        assert pipeline.policies["summary"].stats.retries == 2
+
+    def test_gives_up_after_attempts(self):
+        flaky = Flaky(failures=5)
+        pipeline = build_policy_pipeline(flaky, retry=RetryPolicy(attempts=2, backoff=0.001))
+        with pytest.raises(ConnectionError):
+            pipeline.run(doc="ab")
+        assert flaky.calls == 2
+
+    def test_only_retries_configured_errors(self):
+        flaky = Flaky(failures=1)
+        pipeline = build_policy_pipeline(
+            flaky, retry=RetryPolicy(backoff=0.001, retry_on=(TimeoutError,))
+        )
+        with pytest.raises(ConnectionError):
+            pipeline.run(doc="ab")
+        assert flaky.calls == 1
+
+    def test_backoff_grows_with_jitter(self):
+        policy = RetryPolicy(backoff=1, multiplier=2, max_backoff=5, jitter=0.5)
+        for attempt, full in ((0, 1), (1, 2), (2, 4), (5, 5)):
+            assert full * 0.5 <= policy.delay(attempt) <= full
+        assert RetryPolicy(backoff=1, jitter=0).delay(1) == 2
+
+
+class TestTimeout:
+    def test_sync_processor_times_out(self):
+        slow = Slow(delay=0.3)
+        pipeline = build_policy_pipeline(slow, timeout=0.05)
+        start = time.perf_counter()
+        with pytest.raises(StageTimeoutError):
+            pipeline.run(doc="ab")
+        assert time.perf_counter() - start < 0.25
+        assert pipeline.policies["summary"].stats.timeouts == 1
+        assert slow.finished.wait(1)
+
+    def test_async_processor_is_cancelled(self):
+        slow = AsyncSlow()
+        pipeline = build_policy_pipeline(slow, timeout=0.05)
+        with pytest.raises(StageTimeoutError):
+            pipeline.run(doc="ab")
+        assert slow.cancelled
+
+    @pytest.mark.asyncio
+    async def test_abandoned_call_keeps_pool_slot(self):
+        pool = ResourcePool(1)
+        slow = Slow(delay=0.2)
+        pipeline = build_policy_pipeline(slow, timeout=0.02, limit=pool)
+        with pytest.raises(StageTimeoutError):
+            await pipeline.arun(doc="ab")
+        assert pool.in_use == 1
+        await asyncio.sleep(0.3)
+        assert pool.in_use == 0
+
+
+class TestCircuitBreaker:
+    def test_opens_fails_fast_and_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        flaky = Flaky(failures=2)
+        pipeline = build_policy_pipeline(flaky, circuit_breaker=breaker)
+
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                pipeline.run(doc="ab")
+        assert breaker.state == CircuitBreaker.OPEN
+
+        with pytest.raises(CircuitOpenError):
+            pipeline.run(doc="ab")
+        assert flaky.calls == 2
+        assert pipeline.policies["summary"].stats.rejections == 1
+
+        time.sleep(0.06)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert pipeline.run(doc="ab").production.summary == "AB"
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.name == "test.summary"
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+        breaker.before_call()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+    def test_retries_stop_when_circuit_opens(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        flaky = Flaky(failures=10)
+        pipeline = build_policy_pipeline(
+            flaky,
+            retry=RetryPolicy(attempts=5, backoff=0.001),
+            circuit_breaker=breaker,
+        )
+        with pytest.raises(CircuitOpenError):
+            pipeline.run(doc="ab")
+        assert flaky.calls == 2
+
+
+class TestBatchPolicies:
+    def test_batches_are_retried(self):
+        flaky = FlakyBatch(failures=1)
+        pipeline = build_policy_pipeline(flaky, retry=RetryPolicy(attempts=2, backoff=0.001))
+        reports = pipeline.run_many([{"doc": "a"}, {"doc": "b"}])
+        assert [r.production.summary for r in reports] == ["A", "B"]
+        assert flaky.calls == 2
+        assert pipeline.policies["summary"].stats.retries == 1
+
+    def test_batches_time_out(self):
+        slow = SlowBatch(delay=0.3)
+        pipeline = build_policy_pipeline(slow, timeout=0.05)
+        reports = pipeline.run_many([{"doc": "a"}, {"doc": "b"}])
+        assert all(isinstance(r.error, StageTimeoutError) for r in reports)
+        assert pipeline.policies["summary"].stats.timeouts == 1
+        assert slow.finished.wait(1)
+
+    def test_failing_batches_open_the_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        pipeline = build_policy_pipeline(FlakyBatch(failures=5), circuit_breaker=breaker)
+        reports = pipeline.run_many([{"doc": "a"}, {"doc": "b"}])
+        assert all(isinstance(r.error, ConnectionError) for r in reports)
+        reports = pipeline.run_many([{"doc": "a"}])
+        assert isinstance(reports[0].error, CircuitOpenError)
+
+    def test_async_batches_are_awaited(self):
+        pipeline = build_policy_pipeline(AsyncBatch())
+        reports = pipeline.run_many([{"doc": "a"}, {"doc": "b"}])
+        assert [r.production.summary for r in reports] == ["a", "b"]
+
+
+class TestPolicyMetrics:
+    @pytest.mark.asyncio
+    async def test_outcomes_in_server_metrics(self):
+        breaker = CircuitBreaker(failure_threshold=5)
+        pipeline = build_policy_pipeline(
+            Flaky(failures=1),
+            retry=RetryPolicy(attempts=2, backoff=0.001),
+            circuit_breaker=breaker,
+        )
+        server = Server(pipelines={"default": pipeline})
+        await server._add({"doc": "ab"})
+        await server._drain_queues()
+
+        lines = set((await server._metrics()).body.decode().splitlines())
+        labels = 'pipeline="default",processor="summary"'
+        assert f"papercast_processor_retries_total{{{labels}}} 1" in lines
+        assert f"papercast_processor_timeouts_total{{{labels}}} 0" in lines
+        assert f'papercast_circuit_breaker_state{{{labels},state="closed"}} 1' in lines
+        assert f'papercast_circuit_breaker_state{{{labels},state="open"}} 0' in lines
@@ -0,0 +1,96 @@
+import os
+
+from papercast.base import BaseProcessor, Production
+from papercast.pipelines import Pipeline
+
+
+# Processors run in worker processes must be importable, so they are defined at module level.
+class Source(BaseProcessor):
+    input_types = {"input1": int}
+    output_types = {"value": int, "payload": bytes}
+
+    def process(self, input: Production) -> Production:
+        input.value = input.input1
+        input.payload = b"x" * 1_000_000
+        return input
+
+
+class CPUBound(BaseProcessor):
+    cpu_bound = True
+    input_types = {"value": int}
+    output_types = {"squared": int, "pid": int, "saw_payload": bool}
+
+    def process(self, input: Production) -> Production:
+        input.squared = input.value**2
+        input.pid = os.getpid()
+        input.saw_payload = hasattr(input, "payload")
+        return input
+
+
+class CPUBoundBatch(CPUBound):
+    def process_batch(self, inputs):
+        return [self.process(input) for input in inputs]
+
+
+class Sections(BaseProcessor):
+    input_types = {"value": int}
+    output_types = {"section": str}
+
+    def __init__(self, cpu_bound=False):
+        super().__init__()
+        self.cpu_bound = cpu_bound
+
+    def process(self, input: Production):
+        for i in range(input.value):
+            yield Production(section=f"{i};")
+
+
+class TestProcessPool:
+    def test_cpu_bound_processor_runs_in_worker_process(self):
+        pipeline = Pipeline("default", process_workers=2)
+        pipeline.add_processor("source", Source())
+        pipeline.add_processor("cpu", CPUBound())
+        pipeline.connect("source", "value", "cpu", "value")
+
+        report = pipeline.run(input1=7)
+
+        production = report.production
+        assert production.squared == 49
+        assert production.pid != os.getpid()
+        assert not production.saw_payload
+        assert len(production.payload) == 1_000_000
+
+    def test_warm_up_starts_workers(self):
+        pipeline = Pipeline("default", process_workers=2)
+        pipeline.add_processor("cpu", CPUBound())
+
+        pipeline.warm_up()
+
+        assert pipeline._process_pool is not None
+        pool = pipeline._process_pool
+        pipeline.add_processor("cpu2", CPUBound())
+        assert pipeline._process_pool is None
+        pool.shutdown()
+
+    def test_generator_processors_are_drained_in_worker(self):
+        for executor_type, cpu_bound in (("process", False), ("thread", True)):
+            pipeline = Pipeline("default", executor_type=executor_type, process_workers=1)
+            pipeline.add_processor("source", Source())
+            pipeline.add_processor("sections", Sections(cpu_bound))
+            pipeline.connect("source", "value", "sections", "value")
+
+            report = pipeline.run(input1=3)
+
+            assert report.production.section == "0;1;2;"
+            pipeline.executor.shutdown()
+
+    def test_cpu_bound_batches_run_in_worker_process(self):
+        pipeline = Pipeline("default", process_workers=1)
+        pipeline.add_processor("source", Source())
+        pipeline.add_processor("cpu", CPUBoundBatch())
+        pipeline.connect("source", "value", "cpu", "value")
+
+        reports = pipeline.run_many([{"input1": 2}, {"input1": 3}])
+
+        assert [r.production.squared for r in reports] == [4, 9]
+        assert all(r.production.pid != os.getpid() for r in reports)
@@ -0,0 +1,163 @@
+import pickle
+
+import pytest
+
+from papercast import pipelines
+from papercast.base import BaseProcessor
+from papercast.pipelines import Pipeline
+from papercast.production import FileValue, LazyValue, MappedValue, Production, spill
+
+
+class CountingValue(LazyValue):
+    def __init__(self, value):
+        self.value = value
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return self.value
+
+
+class Spill(BaseProcessor):
+    input_types = {"doc": str}
+    output_types = {"audio": bytes}
+
+    def __init__(self):
+        super().__init__()
+        self.audio = CountingValue(b"audio")
+
+    def process(self, input: Production) -> Production:
+        return Production(doc=vars(input)["doc"], audio=self.audio)
+
+
+class TestProduction:
+    def test_fields_are_a_single_table(self):
+        production = Production(doc="a")
+        production.text = "b"
+        assert vars(production) == {"doc": "a", "text": "b"}
+        assert not hasattr(Production(), "__weakref__")
+
+        del production.doc
+        assert not hasattr(production, "doc")
+        with pytest.raises(AttributeError):
+            production.doc
+        with pytest.raises(AttributeError):
+            del production.doc
+
+    def test_pickles(self):
+        production = pickle.loads(pickle.dumps(Production(doc="a", pages=[1, 2])))
+        assert vars(production) == {"doc": "a", "pages": [1, 2]}
+
+    def test_repr_truncates_large_values(self):
+        assert len(repr(Production(text="x" * 10000))) < 100
+
+    def test_lazy_values_load_on_read(self, tmp_path):
+        path = tmp_path / "text.txt"
+        path.write_text("hello")
+        production = Production(text=FileValue(path, encoding="utf-8"))
+        assert isinstance(vars(production)["text"], FileValue)
+        assert production.text == "hello"
+        path.write_text("changed")
+        assert production.text == "changed"
+
+    def test_mapped_values(self, tmp_path):
+        audio = spill(b"\x00\x01" * 1000, tmp_path)
+        assert isinstance(audio, MappedValue)
+        production = Production(audio=audio)
+        assert bytes(production.audio[:2]) == b"\x00\x01"
+        assert len(production.audio) == 2000
+
+        copy = pickle.loads(pickle.dumps(production))
+        assert bytes(copy.audio) == bytes(production.audio)
+
+        text = spill("héllo", tmp_path)
+        assert Production(text=text).text == "héllo"
+
+
+class Tag(BaseProcessor):
+    input_types = {"audio": bytes}
+    output_types = {"tag": str}
+
+    def process(self, input: Production) -> Production:
+        # A new production carrying the input along, which is not an output of this stage.
+        return Production(audio=vars(input)["audio"], tag="id3")
+
+
+class TestLazyOutputs:
+    def test_outputs_are_merged_unloaded(self):
+        spill = Spill()
+        pipeline = Pipeline("test")
+        pipeline.add_processor("source", Stage(["doc"], "doc"))
+        pipeline.add_processor("spill", spill)
+        pipeline.add_processor("tag", Tag())
+        pipeline.connect("source", "doc", "spill", "doc")
+        pipeline.connect("spill", "audio", "tag", "audio")
+        report = pipeline.run(doc="d")
+        assert vars(report.production)["audio"] is spill.audio
+        assert report.production.tag == "id3"
+        assert spill.audio.loads == 0
+
+    def test_worker_sends_outputs_unloaded(self, monkeypatch):
+        spill = Spill()
+        monkeypatch.setitem(pipelines._worker_processors, "spill", spill)
+        outputs, _, _ = pipelines._process_in_worker("spill", {"doc": "d"}, ["audio"], {})
+        assert outputs == {"audio": spill.audio}
+        assert spill.audio.loads == 0
+
+
+class Stage(BaseProcessor):
+    def __init__(self, inputs, output):
+        super().__init__()
+        self.input_types = {name: str for name in inputs}
+        self.output_types = {output: str}
+        self.output = output
+        self.seen = {}
+
+    def process(self, input: Production) -> Production:
+        self.seen = {name: getattr(input, name) for name in self.input_types}
+        setattr(input, self.output, "+".join(self.seen.values()))
+        return input
+
+
+def build_fanout_pipeline(**kwargs):
+    "doc -> source -> text, read by summary and narrate, whose outputs are read by publish."
+    pipeline = Pipeline("test", **kwargs)
+    stages = {
+        "source": Stage(["doc"], "text"),
+        "summary": Stage(["text"], "summary"),
+        "narrate": Stage(["text"], "audio"),
+        "publish": Stage(["summary", "audio"], "url"),
+    }
+    pipeline.add_processors(stages)
+    pipeline.connect("source", "text", "summary", "text")
+    pipeline.connect("source", "text", "narrate", "text")
+    pipeline.connect("summary", "summary", "publish", "summary")
+    pipeline.connect("narrate", "audio", "publish", "audio")
+    return pipeline, stages
+
+
+class TestReleaseFields:
+    @pytest.mark.parametrize("scheduler", ["sequential", "concurrent"])
+    def test_fields_released_after_last_consumer(self, scheduler):
+        pipeline, stages = build_fanout_pipeline(scheduler=scheduler, release_fields=True)
+        report = pipeline.run(doc="d")
+        assert stages["publish"].seen == {"summary": "d", "audio": "d"}
+        assert vars(report.production) == {"doc": "d", "url": "d+d"}
+
+    def test_keep_fields(self):
+        pipeline, _ = build_fanout_pipeline(release_fields=True, keep_fields=["text"])
+        report = pipeline.run(doc="d")
+        assert set(vars(report.production)) == {"doc", "text", "url"}
+
+    def test_disabled_by_default(self):
+        pipeline, _ = build_fanout_pipeline()
+        report = pipeline.run(doc="d")
+        assert set(vars(report.production)) == {"doc", "text", "summary", "audio", "url"}
+
+    def test_run_many(self):
+        pipeline, _ = build_fanout_pipeline(release_fields=True)
+        reports = pipeline.run_many([{"doc": "a"}, {"doc": "b"}])
+        assert [vars(r.production) for r in reports] == [
+            {"doc": "a", "url": "a+a"},
+            {"doc": "b", "url": "b+b"},
+        ]
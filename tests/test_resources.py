@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from papercast.base import BaseProcessor, Production
+from papercast.pipelines import Pipeline
+from papercast.resources import ResourcePool, resource_pool
+
+
+class TestResourcePool:
+    @pytest.mark.asyncio
+    async def test_limits_concurrent_holders(self):
+        pool = ResourcePool(2)
+        active = 0
+        peak = 0
+
+        async def work():
+            nonlocal active, peak
+            async with pool:
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+        await asyncio.gather(*[work() for _ in range(10)])
+
+        assert peak == 2
+        assert pool.in_use == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_leak_slot(self):
+        pool = ResourcePool(1)
+        await pool.acquire()
+        waiter = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        pool.release()
+        assert pool.in_use == 0
+        await asyncio.wait_for(pool.acquire(), 1)
+
+    def test_shared_between_event_loops(self):
+        pool = ResourcePool(1)
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+
+        async def work():
+            nonlocal active, peak
+            async with pool:
+                with lock:
+                    active += 1
+                    peak = max(peak, active)
+                await asyncio.sleep(0.02)
+                with lock:
+                    active -= 1
+
+        threads = [threading.Thread(target=asyncio.run, args=(work(),)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert peak == 1
+        assert pool.in_use == 0
+
+    def test_named_pools(self):
+        pool = resource_pool("test-grobid", 3)
+        assert resource_pool("test-grobid") is pool
+        with pytest.raises(ValueError):
+            resource_pool("test-grobid", 4)
+        with pytest.raises(KeyError):
+            resource_pool("test-missing")
+
+
+class TestPipelineLimits:
+    def test_processor_limit_is_enforced(self):
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+
+        class Source(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"value": int}
+
+            def process(self, input: Production) -> Production:
+                input.value = input.input1
+                return input
+
+        class Slow(BaseProcessor):
+            input_types = {"value": int}
+            output_types = {}
+
+            def process(self, input: Production) -> Production:
+                nonlocal active, peak
+                with lock:
+                    active += 1
+                    peak = max(peak, active)
+                time.sleep(0.02)
+                with lock:
+                    active -= 1
+                return input
+
+        shared = ResourcePool(2, name="shared")
+        pipeline = Pipeline("default", scheduler="concurrent", max_workers=8)
+        pipeline.add_processor("source", Source())
+        for i in range(6):
+            pipeline.add_processor(f"slow{i}", Slow(), limit=shared)
+            pipeline.connect("source", "value", f"slow{i}", "value")
+
+        pipeline.run(input1=1)
+
+        assert peak == 2
+        assert pipeline.limits["slow0"] is shared
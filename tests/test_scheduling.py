@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from papercast.jobs import WorkQueue
+from papercast.scheduling import FairScheduler, PriorityItems, priority_level
+from papercast.server import Server
+
+
+class TestPriorities:
+    def test_priority_level(self):
+        assert priority_level("interactive") < priority_level(None) < priority_level("bulk")
+        with pytest.raises(ValueError):
+            priority_level("urgent")
+
+    def test_waiting_items_are_promoted(self):
+        items = PriorityItems(aging=10)
+        items.push("bulk", priority_level("bulk"))
+        items.push("normal", priority_level("normal"))
+        assert items.pop(now=None) == "normal"
+
+        items.push("interactive", priority_level("interactive"))
+        # Older than 20 seconds, the bulk item is promoted to interactive and goes first.
+        now = items._levels[2][0][1] + 25
+        assert items.pop(now) == "bulk"
+        assert items.pop(now) == "interactive"
+        assert len(items) == 0
+
+    @pytest.mark.asyncio
+    async def test_queue_takes_higher_priority_first(self):
+        handled = []
+
+        async def handler(item):
+            handled.append(item)
+
+        queue = WorkQueue("test", handler, workers=1)
+        queue.submit("bulk", "bulk")
+        queue.submit("normal")
+        queue.submit_many(["interactive-1", "interactive-2"], "interactive")
+        assert await queue.drain(timeout=5)
+
+        assert handled == ["interactive-1", "interactive-2", "normal", "bulk"]
+
+
+class TestFairScheduler:
+    @pytest.mark.asyncio
+    async def test_slots_are_shared_by_weight(self):
+        scheduler = FairScheduler(workers=1, weights={"daily": 3, "backfill": 1})
+        order = []
+
+        async def work(flow):
+            async with scheduler.slot(flow):
+                order.append(flow)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(work(flow) for flow in ["backfill"] * 20 + ["daily"] * 20))
+
+        # While both flows have work waiting, daily gets three slots for each of backfill's.
+        first = order[:16]
+        assert first.count("daily") == 12
+        assert first.count("backfill") == 4
+
+    @pytest.mark.asyncio
+    async def test_priority_goes_before_weight(self):
+        scheduler = FairScheduler(workers=1, weights={"daily": 10})
+        order = []
+
+        async def work(flow, priority):
+            async with scheduler.slot(flow, priority):
+                order.append(flow)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(
+            *(work("daily", "bulk") for _ in range(3)), work("web", "interactive")
+        )
+        # The first daily item took the free slot before the interactive one arrived.
+        assert order == ["daily", "web", "daily", "daily"]
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiters_free_their_turn(self):
+        scheduler = FairScheduler(workers=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.slot("a"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 1
+        waiter.cancel()
+        release.set()
+        await holder
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.in_use == 0
+        async with scheduler.slot("b"):
+            assert scheduler.in_use == 1
+
+    @pytest.mark.asyncio
+    async def test_queue_takes_item_once_it_has_a_slot(self):
+        scheduler = FairScheduler(workers=1)
+        release = asyncio.Event()
+        handled = []
+
+        async def hold():
+            async with scheduler.slot("other"):
+                await release.wait()
+
+        async def handler(item):
+            handled.append(item)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queue = WorkQueue("test", handler, workers=1, scheduler=scheduler)
+        queue.submit("bulk", "bulk")
+        await asyncio.sleep(0)
+        # Arrives while the queue's worker waits for a slot, and still goes first.
+        queue.submit("interactive", "interactive")
+        release.set()
+        await holder
+        assert await queue.drain(timeout=5)
+
+        assert handled == ["interactive", "bulk"]
+
+    def test_rejects_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            FairScheduler(workers=0)
+        with pytest.raises(ValueError):
+            FairScheduler(workers=1, weights={"a": 0})
+
+
+class TestServerPriorities:
+    @pytest.mark.asyncio
+    async def test_interactive_submissions_go_first(self, narrate, make_pipeline):
+        server = Server(
+            pipelines={"default": make_pipeline(narrate)}, max_workers=1, max_batch_size=1
+        )
+
+        bulk = await server._add_batch(
+            {"documents": [{"arxiv_id": "2301.0000%d" % i} for i in range(3)], "priority": "bulk"}
+        )
+        interactive = await server._add({"arxiv_id": "2301.00009", "priority": "interactive"})
+        await server._drain_queues()
+
+        assert narrate.narrated[-1] == "2301.00002"
+        assert narrate.narrated.index("2301.00009") < narrate.narrated.index("2301.00001")
+        assert server.jobs.get(interactive["job_id"]).priority == "interactive"
+        assert server.jobs.get(bulk["job_ids"][0]).asdict()["priority"] == "bulk"
+
+    @pytest.mark.asyncio
+    async def test_unknown_priority_is_rejected(self, narrate, make_pipeline):
+        server = Server(pipelines={"default": make_pipeline(narrate)})
+        with pytest.raises(HTTPException) as e:
+            await server._add({"arxiv_id": "2301.00001", "priority": "urgent"})
+        assert e.value.status_code == 400
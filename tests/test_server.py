@@ -1,7 +1,12 @@
+import asyncio
+import threading
+import time
+
 import pytest
 from papercast.server import Server
 from papercast.pipelines import Pipeline
 from papercast.base import BaseProcessor, Production
+from papercast.jobs import JobStatus
 from fastapi import HTTPException
 from typing import List
 
@@ -53,7 +58,8 @@ class TestServer:
         )
         result = await server._add({"input1": 5})
         assert result is not None
-        assert result == {"message": "Document(s) added to pipeline"}
+        assert result["message"] == "Document(s) added to pipeline"
+        assert (await server._get_job(result["job_id"]))["pipeline"] == "default"
 
     @pytest.mark.asyncio
     @pytest.mark.xfail
@@ -102,7 +108,8 @@ class TestServer:
         )
         result = await server._add({"pipeline": "non_default", "input1": 5})
         assert result is not None
-        assert result == {"message": "Document(s) added to pipeline"}
+        assert result["message"] == "Document(s) added to pipeline"
+        assert (await server._get_job(result["job_id"]))["pipeline"] == "non_default"
 
     @pytest.mark.asyncio
     @pytest.mark.xfail
@@ -229,3 +236,204 @@ class TestServer:
                 }
             }
         }
+
+    @pytest.mark.asyncio
+    async def test_add_rejects_when_queue_is_full(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        class BlockingProcessor(BaseProcessor):
+            input_types = {"input1": int}
+
+            def process(self, input: Production) -> Production:
+                started.set()
+                release.wait(5)
+                return input
+
+        pipeline = Pipeline("test")
+        pipeline.add_processor("test", BlockingProcessor())
+        server = Server(pipelines={"default": pipeline}, max_queue_size=1, workers=1)
+
+        await server._add({"input1": 1})
+        await asyncio.sleep(0)
+        assert await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        await server._add({"input1": 2})
+
+        with pytest.raises(HTTPException) as exc_info:
+            await server._add({"input1": 3})
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.headers == {"Retry-After": "5"}
+
+        release.set()
+        await server._drain_queues()
+
+    @pytest.mark.asyncio
+    async def test_shutdown_drains_in_flight_documents(self):
+        processed = []
+
+        class SlowProcessor(BaseProcessor):
+            input_types = {"input1": int}
+
+            def process(self, input: Production) -> Production:
+                time.sleep(0.05)
+                processed.append(input.input1)
+                return input
+
+        pipeline = Pipeline("test")
+        pipeline.add_processor("test", SlowProcessor())
+        server = Server(pipelines={"default": pipeline}, workers=2)
+
+        for i in range(4):
+            await server._add({"input1": i})
+        await server._drain_queues()
+
+        assert sorted(processed) == [0, 1, 2, 3]
+        with pytest.raises(HTTPException) as exc_info:
+            await server._add({"input1": 5})
+        assert exc_info.value.status_code == 429
+
+    @pytest.mark.asyncio
+    async def test_job_status_and_outputs(self):
+        class Collector(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"input1": int}
+
+            def process(self, input: Production) -> Production:
+                return input
+
+        class Writer(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"mp3_path": str}
+
+            def process(self, input: Production) -> Production:
+                input.mp3_path = f"data/{input.input1}.mp3"
+                return input
+
+        class Failing(BaseProcessor):
+            input_types = {"input2": int}
+            output_types = {"input2": int}
+
+            def process(self, input: Production) -> Production:
+                raise RuntimeError("boom")
+
+        pipeline = Pipeline("test")
+        pipeline.add_processor("collector", Collector())
+        pipeline.add_processor("writer", Writer())
+        pipeline.add_processor("failing", Failing())
+        pipeline.connect("collector", "input1", "writer", "input1")
+        server = Server(pipelines={"default": pipeline})
+
+        done_id = (await server._add({"input1": 7}))["job_id"]
+        failed_id = (await server._add({"input2": 7}))["job_id"]
+        assert (await server._get_job(done_id))["status"] in ("queued", "running")
+        await server._drain_queues()
+
+        done = await server._get_job(done_id)
+        assert done["status"] == "done"
+        assert done["outputs"] == {"mp3_path": "data/7.mp3"}
+        assert set(done["timings"]) == {"collector", "writer"}
+        assert done["stages"] == []
+
+        failed = await server._get_job(failed_id)
+        assert failed["status"] == "failed"
+        assert failed["error"] == "RuntimeError: boom"
+
+        failed_jobs = (await server._list_jobs(JobStatus.FAILED))["jobs"]
+        assert [j["id"] for j in failed_jobs] == [failed_id]
+        with pytest.raises(HTTPException):
+            await server._get_job("missing")
+
+    @pytest.mark.asyncio
+    async def test_add_batch(self):
+        class Collector(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"input1": int}
+
+            def process(self, input: Production) -> Production:
+                return input
+
+        class Batched(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"output_path": str}
+
+            def __init__(self):
+                super().__init__()
+                self.batch_sizes = []
+
+            def process(self, input: Production) -> Production:
+                raise AssertionError("process_batch should be used")
+
+            def process_batch(self, inputs, **kwargs):
+                self.batch_sizes.append(len(inputs))
+                return [Production(output_path=f"{i.input1}.mp3") for i in inputs]
+
+        batched = Batched()
+        pipeline = Pipeline("test")
+        pipeline.add_processor("collector", Collector())
+        pipeline.add_processor("batched", batched)
+        pipeline.connect("collector", "input1", "batched", "input1")
+        server = Server(pipelines={"default": pipeline}, max_batch_size=3)
+
+        with pytest.raises(HTTPException) as exc_info:
+            await server._add_batch({"documents": [{"input1": 1}, {"wrong": 2}]})
+        assert exc_info.value.status_code == 400
+
+        result = await server._add_batch({"documents": [{"input1": i} for i in range(5)]})
+        await server._drain_queues()
+
+        assert sorted(batched.batch_sizes) == [2, 3]
+        jobs = [await server._get_job(job_id) for job_id in result["job_ids"]]
+        assert [job["status"] for job in jobs] == ["done"] * 5
+        assert jobs[4]["outputs"] == {"output_path": "4.mp3"}
+
+    @pytest.mark.asyncio
+    async def test_metrics(self):
+        from papercast.cache import ResultCache
+
+        class Collector(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"input1": int}
+
+            def process(self, input: Production) -> Production:
+                if input.input1 < 0:
+                    raise RuntimeError("negative")
+                return input
+
+        class Doubler(BaseProcessor):
+            input_types = {"input1": int}
+            output_types = {"output": int}
+
+            def process(self, input: Production) -> Production:
+                input.output = input.input1 * 2
+                return input
+
+        pipeline = Pipeline("test")
+        pipeline.add_processor("collector", Collector())
+        pipeline.add_processor("doubler", Doubler(), cache=ResultCache())
+        pipeline.connect("collector", "input1", "doubler", "input1")
+        server = Server(pipelines={"default": pipeline}, workers=1)
+
+        for value in (1, 1, -1):
+            await server._add({"input1": value})
+        await server._drain_queues()
+
+        response = await server._metrics()
+        assert response.media_type.startswith("text/plain; version=0.0.4")
+        lines = set(response.body.decode().splitlines())
+        labels = 'pipeline="default",processor="doubler"'
+        assert 'papercast_queue_depth{pipeline="default"} 0' in lines
+        assert 'papercast_jobs_in_flight{pipeline="default"} 0' in lines
+        assert 'papercast_jobs_total{pipeline="default",status="done"} 2' in lines
+        assert 'papercast_jobs_total{pipeline="default",status="failed"} 1' in lines
+        assert 'papercast_executor_tasks{pipeline="default"} 0' in lines
+        assert f"papercast_cache_hits_total{{{labels}}} 1" in lines
+        assert f"papercast_cache_hit_ratio{{{labels}}} 0.5" in lines
+        # Cache hits are counted as successful runs but not as latency observations.
+        assert f'papercast_processor_runs_total{{{labels},outcome="success"}} 2' in lines
+        assert f'papercast_processor_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in lines
+        assert f"papercast_processor_duration_seconds_count{{{labels}}} 1" in lines
+        assert (
+            'papercast_processor_runs_total{pipeline="default",processor="collector",'
+            'outcome="failure"} 1'
+        ) in lines
+        assert "# TYPE papercast_processor_duration_seconds histogram" in lines
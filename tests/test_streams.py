@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+
+from papercast.base import AsyncProcessor, BaseProcessor, Production
+from papercast.pipelines import Pipeline
+from papercast.streams import Stream, join_chunks
+
+
+class Extract(BaseProcessor):
+    input_types = {"pdf": str}
+    output_types = {"text": str}
+
+    def __init__(self, sections, delay=0.0, fail_after=None):
+        super().__init__()
+        self.sections = sections
+        self.delay = delay
+        self.fail_after = fail_after
+        self.yielded = []
+
+    def process(self, input: Production):
+        for i, section in enumerate(self.sections):
+            if i == self.fail_after:
+                raise RuntimeError("GROBID failed")
+            time.sleep(self.delay)
+            self.yielded.append(time.perf_counter())
+            yield Production(text=section)
+
+
+class AsyncExtract(AsyncProcessor):
+    input_types = {"pdf": str}
+    output_types = {"text": str}
+
+    async def aprocess(self, input: Production):
+        for section in ("a", "b"):
+            await asyncio.sleep(0)
+            yield {"text": section}
+
+
+class Narrate(BaseProcessor):
+    input_types = {"text": str}
+    output_types = {"audio": bytes}
+    chunked = True
+
+    def __init__(self):
+        super().__init__()
+        self.narrated = []
+
+    def process(self, input: Production) -> Production:
+        self.narrated.append((input.text, time.perf_counter()))
+        input.audio = input.text.upper().encode()
+        return input
+
+
+class Publish(BaseProcessor):
+    input_types = {"audio": bytes}
+    output_types = {"url": str}
+
+    def process(self, input: Production) -> Production:
+        input.url = f"https://example.com/{input.audio.decode()}"
+        return input
+
+
+def build_streaming_pipeline(extract, scheduler="sequential"):
+    narrate = Narrate()
+    pipeline = Pipeline("test", scheduler=scheduler)
+    pipeline.add_processor("extract", extract)
+    pipeline.add_processor("narrate", narrate)
+    pipeline.add_processor("publish", Publish())
+    pipeline.connect("extract", "text", "narrate", "text")
+    pipeline.connect("narrate", "audio", "publish", "audio")
+    return pipeline, narrate
+
+
+class TestStream:
+    @pytest.mark.asyncio
+    async def test_readers_see_every_chunk(self):
+        stream = Stream()
+
+        async def read():
+            return [chunk async for chunk in stream]
+
+        readers = [asyncio.ensure_future(read()) for _ in range(2)]
+        for chunk in ("a", "b"):
+            await asyncio.sleep(0)
+            stream.put(chunk)
+        stream.close()
+        assert await asyncio.gather(*readers) == [["a", "b"], ["a", "b"]]
+        assert await stream.join() == "ab"
+        assert [chunk async for chunk in stream] == ["a", "b"]
+
+    @pytest.mark.asyncio
+    async def test_failed_stream_raises(self):
+        stream = Stream()
+        stream.put("a")
+        stream.close(RuntimeError("boom"))
+        with pytest.raises(RuntimeError, match="boom"):
+            await stream.join()
+
+    def test_join_chunks(self):
+        assert join_chunks(["a", "b"]) == "ab"
+        assert join_chunks([b"a", b"b"]) == b"ab"
+        assert join_chunks([1, 2]) == [1, 2]
+        assert join_chunks(["a", "b"], separator="\n\n") == "a\n\nb"
+        assert Stream(join=sum).chunks == []
+
+
+class TestStreamingPipeline:
+    @pytest.mark.parametrize("scheduler", ["sequential", "concurrent"])
+    def test_chunks_are_processed_as_they_arrive(self, scheduler):
+        extract = Extract(["intro ", "method ", "results"], delay=0.05)
+        pipeline, narrate = build_streaming_pipeline(extract, scheduler)
+
+        report = pipeline.run(pdf="paper.pdf")
+
+        assert [text for text, _ in narrate.narrated] == ["intro ", "method ", "results"]
+        assert narrate.narrated[0][1] < extract.yielded[-1]
+        assert report.production.url == "https://example.com/INTRO METHOD RESULTS"
+        assert report.production.text == "intro method results"
+        assert report.production.audio == b"INTRO METHOD RESULTS"
+
+    def test_async_generator(self):
+        pipeline, narrate = build_streaming_pipeline(AsyncExtract())
+        report = pipeline.run(pdf="paper.pdf")
+        assert report.production.url == "https://example.com/AB"
+        assert len(narrate.narrated) == 2
+
+    def test_producer_error_fails_the_document(self):
+        pipeline, narrate = build_streaming_pipeline(Extract(["a", "b", "c"], fail_after=1))
+        with pytest.raises(RuntimeError, match="GROBID failed"):
+            pipeline.run(pdf="paper.pdf")
+        assert [text for text, _ in narrate.narrated] == ["a"]
+
+    def test_run_many_joins_streams(self):
+        pipeline, _ = build_streaming_pipeline(Extract(["a", "b"]))
+        reports = pipeline.run_many([{"pdf": "1.pdf"}, {"pdf": "2.pdf"}])
+        assert [r.production.url for r in reports] == ["https://example.com/AB"] * 2
+        assert all(r.error is None for r in reports)
+
+    def test_streaming_processors_declare_outputs(self):
+        class Undeclared(BaseProcessor):
+            input_types = {"pdf": str}
+
+            def process(self, input: Production):
+                yield input
+
+        with pytest.raises(ValueError, match="output_types"):
+            Pipeline("test").add_processor("extract", Undeclared())
@@ -0,0 +1,205 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from papercast.base import BaseProcessor, BaseSubscriber, Production
+from papercast.dedup import Deduplicator
+from papercast.jobs import Job, JobStatus, QueueFullError
+from papercast.server import Server
+from papercast.workers import SharedQueue, Worker
+
+
+class Narrate(BaseProcessor):
+    "Writes the ID of the process that narrated the paper to the audio file."
+
+    input_types = {"arxiv_id": str}
+    output_types = {"audio_path": str}
+
+    def __init__(self, directory, crash_once=None):
+        super().__init__()
+        self.directory = directory
+        self.crash_once = crash_once
+
+    def process(self, input: Production) -> Production:
+        if input.arxiv_id == self.crash_once:
+            marker = self.directory / "crashed"
+            if not marker.exists():
+                marker.touch()
+                os._exit(1)
+        path = self.directory / f"{input.arxiv_id}.mp3"
+        path.write_text(str(os.getpid()))
+        input.audio_path = str(path)
+        return input
+
+
+def job(arxiv_id, priority="normal"):
+    return Job(pipeline="default", inputs={"arxiv_id": arxiv_id}, priority=priority)
+
+
+async def wait_for(predicate, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+
+class TestSharedQueue:
+    def test_claims_by_priority_and_reports_updates(self, tmp_path):
+        queue = SharedQueue(str(tmp_path / "queue.db"))
+        bulk, normal, interactive = job("1", "bulk"), job("2"), job("3", "interactive")
+        queue.submit([bulk, normal, interactive])
+        assert queue.depth == 3
+
+        claimed = [queue.claim("w").id for _ in range(3)]
+        assert claimed == [interactive.id, normal.id, bulk.id]
+        assert queue.claim("w") is None
+
+        assert queue.finish(interactive.id, "w", outputs={"audio_path": "a.mp3"})
+        assert queue.finish(normal.id, "w", error="ValueError: boom")
+        updates = {update.id: update for update in queue.updates()}
+        assert updates[interactive.id].outputs == {"audio_path": "a.mp3"}
+        assert updates[normal.id].error == "ValueError: boom"
+        assert updates[bulk.id].status == JobStatus.RUNNING
+        assert [update.id for update in queue.updates()] == []
+        assert queue.pending() == 1
+
+    def test_lost_jobs_are_queued_again_then_failed(self, tmp_path):
+        queue = SharedQueue(str(tmp_path / "queue.db"), max_attempts=2)
+        queue.submit([job("1")])
+        first = queue.claim("w1", now=100.0)
+        assert queue.requeue_expired(timeout=60, now=150.0) == 0
+        assert queue.requeue_expired(timeout=60, now=200.0) == 1
+
+        second = queue.claim("w2")
+        assert second.id == first.id and second.attempts == 2
+        # The first worker's lease expired, so its result is ignored.
+        assert not queue.finish(first.id, "w1")
+        assert queue.release("w2") == 1
+        [update] = [u for u in queue.updates() if u.status != JobStatus.RUNNING]
+        assert update.status == JobStatus.FAILED
+        assert update.error.startswith("WorkerLost")
+
+    def test_rejects_jobs_beyond_max_size(self, tmp_path):
+        queue = SharedQueue(str(tmp_path / "queue.db"))
+        queue.submit([job("1")], max_size=2)
+        with pytest.raises(QueueFullError):
+            queue.submit([job("2"), job("3")], max_size=2)
+        assert queue.depth == 1
+
+
+class TestWorker:
+    def test_runs_submissions_and_subscribed_productions(self, tmp_path, make_pipeline):
+        class Feed(BaseSubscriber):
+            output_types = {"arxiv_id": str}
+
+            async def subscribe(self):
+                yield Production(arxiv_id="2301.00002")
+
+        pipeline = make_pipeline(Narrate(tmp_path))
+        pipeline.add_processor("feed", Feed())
+        pipeline.connect("feed", "arxiv_id", "narrate", "arxiv_id")
+        queue = SharedQueue(str(tmp_path / "queue.db"))
+        queue.submit([job("2301.00001")])
+        queue.submit([job("2301.00002")], start="feed")
+
+        worker = Worker({"default": pipeline}, queue, "w")
+        assert worker.run_one() and worker.run_one()
+        assert not worker.run_one()
+        outputs = [u.outputs for u in queue.updates() if u.status == JobStatus.DONE]
+        assert sorted(outputs, key=str) == [
+            {"audio_path": str(tmp_path / "2301.00001.mp3")},
+            {"audio_path": str(tmp_path / "2301.00002.mp3")},
+        ]
+
+
+    def test_heartbeats_go_on_until_the_job_finishes(self, tmp_path, make_pipeline):
+        started = threading.Event()
+
+        class Slow(BaseProcessor):
+            input_types = {"arxiv_id": str}
+            output_types = {"audio_path": str}
+
+            def process(self, input: Production) -> Production:
+                started.set()
+                time.sleep(0.5)
+                input.audio_path = f"{input.arxiv_id}.mp3"
+                return input
+
+        queue = SharedQueue(str(tmp_path / "queue.db"))
+        queue.submit([job("2301.00001")])
+        heartbeats = []
+        heartbeat = queue.heartbeat
+        queue.heartbeat = lambda worker: heartbeats.append(time.monotonic()) or heartbeat(worker)
+        worker = Worker(
+            {"default": make_pipeline(Slow())}, queue, "w", heartbeat_interval=0.05
+        )
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        assert started.wait(10)
+        worker.stop()
+        stopped = time.monotonic()
+        thread.join(10)
+
+        # The job's lease was renewed after stop() while it finished, and it was not lost.
+        assert len([t for t in heartbeats if t > stopped + 0.1]) >= 3
+        # The worker closed its queue as it stopped.
+        queue = SharedQueue(str(tmp_path / "queue.db"))
+        [update] = [u for u in queue.updates() if u.status != JobStatus.RUNNING]
+        assert update.status == JobStatus.DONE
+
+
+class TestWorkerProcesses:
+    @pytest.mark.asyncio
+    async def test_metrics_report_shared_queue_depth(self, tmp_path, make_pipeline):
+        server = Server(
+            pipelines={"default": make_pipeline(Narrate(tmp_path))},
+            processes=1,
+            queue_path=str(tmp_path / "queue.db"),
+        )
+        # The worker processes are not started, so the jobs stay queued.
+        await server._add_batch({"documents": [{"arxiv_id": f"2301.0000{i}"} for i in range(3)]})
+        await server._follow_shared_queue_once()
+
+        metrics = (await server._metrics()).body.decode()
+        assert 'papercast_queue_depth{pipeline="default"} 3' in metrics
+
+    def test_rejects_journal(self, tmp_path, make_pipeline):
+        from papercast.journal import JobJournal
+
+        with pytest.raises(ValueError):
+            Server(
+                pipelines={"default": make_pipeline(Narrate(tmp_path))},
+                processes=1,
+                journal=JobJournal(str(tmp_path / "journal.db")),
+            )
+
+    @pytest.mark.asyncio
+    async def test_server_runs_jobs_in_worker_processes(self, tmp_path, make_pipeline):
+        narrate = Narrate(tmp_path, crash_once="2301.00003")
+        server = Server(
+            pipelines={"default": make_pipeline(narrate, dedup=Deduplicator())},
+            processes=2,
+            queue_path=str(tmp_path / "queue.db"),
+        )
+        await server.run_pipelines()
+        try:
+            response = await server._add_batch(
+                {"documents": [{"arxiv_id": f"2301.0000{i}"} for i in range(1, 5)]}
+            )
+            jobs = [server.jobs.get(job_id) for job_id in response["job_ids"]]
+            await wait_for(lambda: all(job.status == JobStatus.DONE for job in jobs))
+            # Papers finished by the workers are recorded as published by the server.
+            assert (await server._add({"arxiv_id": "2301.00001"}))["duplicate"]
+        finally:
+            await server._cancel_pipeline_tasks()
+            await server._drain_queues()
+
+        assert not server.pool.running
+        pids = {int((tmp_path / f"2301.0000{i}.mp3").read_text()) for i in range(1, 5)}
+        assert os.getpid() not in pids
+        # The worker that crashed on 2301.00003 was replaced, and the job ran again.
+        assert (tmp_path / "crashed").exists()
+        assert jobs[2].outputs == {"audio_path": str(tmp_path / "2301.00003.mp3")}